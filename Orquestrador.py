@@ -0,0 +1,102 @@
+import importlib.util
+import os
+import sys
+import time
+
+from rede_etl import http_client
+from rede_etl.db_pool import close_pool, get_pool
+from rede_etl.fetch_engine import concurrency_limit
+from rede_etl.job_graph import SUCCESS, Job, run_graph
+from rede_etl.token_manager import TokenManager
+
+"""Config dotenv"""
+from dotenv import load_dotenv
+from pathlib import Path
+def localizar_env(diretorio_raiz="PRIVATE_BAG.ENV"):
+    path = Path(__file__).resolve()
+    for parent in path.parents:
+        possible = parent / diretorio_raiz / ".env"
+        if possible.exists():
+            return possible
+    raise FileNotFoundError(f"Arquivo .env não encontrado dentro de '{diretorio_raiz}'.")
+env_path = localizar_env()
+load_dotenv(dotenv_path=env_path)
+# Os scripts importados pelo orquestrador não carregam o .env de novo
+os.environ["REDE_ENV_CARREGADO"] = "1"
+
+# Executa os jobs diários num único processo, como um grafo de dependências:
+# as parcelas detalhadas dependem das vendas já carregadas em BD_Vendas_Rede;
+# pagamentos e recebíveis são independentes e rodam em paralelo com elas.
+# Todos compartilham um TokenManager (um único login), o pool HTTP e o pool do
+# banco. Uso: python Orquestrador.py [job ...] (padrão: todos).
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+# nome do job -> (script, função de entrada, dependências)
+JOBS = {
+    "vendas": ("VendasRede-Diario.py", "main", []),
+    "parcelas": ("UpdateParcelasDetalhadas.py", "process_sales", ["vendas"]),
+    "pagamentos": ("PagamentosConsolidados-Diario.py", "main", []),
+    "recebiveis_mensal": ("RecebiveisMensal.py", "job", []),
+    "recebiveis_semanal": ("RecebiveisSemanal-Diario.py", "job", []),
+}
+
+
+def load_script(filename):
+    """Importa um script pelo caminho; os nomes com hífen não funcionam com import."""
+    module_name = Path(filename).stem.replace("-", "_")
+    spec = importlib.util.spec_from_file_location(module_name, SCRIPTS_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_jobs(names, token_manager):
+    jobs = []
+    for name in names:
+        filename, entry, depends_on = JOBS[name]
+        func = getattr(load_script(filename), entry)
+        jobs.append(Job(
+            name,
+            lambda func=func: func(token_manager=token_manager),
+            # Dependências fora da seleção já foram executadas por outro meio
+            [dep for dep in depends_on if dep in names],
+        ))
+    return jobs
+
+
+def main(argv=None):
+    names = list(argv if argv is not None else sys.argv[1:]) or list(JOBS)
+    unknown = [name for name in names if name not in JOBS]
+    if unknown:
+        print(f"Jobs desconhecidos: {', '.join(unknown)}. Disponíveis: {', '.join(JOBS)}")
+        return 2
+
+    start_time = time.time()
+    # Um pool do banco e um pool HTTP para todos os jobs, do tamanho que os
+    # processos separados somavam; dimensionados aqui, antes do primeiro uso
+    get_pool(max_size=int(os.getenv("REDE_DB_POOL_SIZE", "10")) * len(names))
+    http_client.configure(concurrency_limit() * len(names))
+
+    token_manager = TokenManager()
+    if not token_manager.get_access_token():
+        print("Erro ao obter token de autenticação.")
+        http_client.close()
+        close_pool()
+        return 1
+
+    try:
+        results = run_graph(build_jobs(names, token_manager))
+    finally:
+        http_client.close()
+        close_pool()
+
+    print(f"Execução concluída em {time.time() - start_time:.1f}s:")
+    for name in names:
+        status, elapsed = results.get(name, ("não executado", 0.0))
+        print(f"  {name}: {status} ({elapsed:.1f}s)")
+    return 0 if all(results.get(name, ("",))[0] == SUCCESS for name in names) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
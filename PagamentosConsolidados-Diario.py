@@ -1,11 +1,22 @@
 import requests
-import pyodbc
 from datetime import datetime, timedelta
-from concurrent.futures import ProcessPoolExecutor
-from concurrent.futures import ThreadPoolExecutor
 import os
+import threading
 from calendar import monthrange
 
+from rede_etl import http_client
+from rede_etl.bulk_writer import batch_size_from_env, varchar, write_rows
+from rede_etl.db_pool import get_pool
+from rede_etl.etl_state import (
+    checkpoint_key, clear_checkpoint, ensure_checkpoint_table, get_checkpoint, set_checkpoint
+)
+from rede_etl.fetch_engine import TaskScheduler, run_tasks
+from rede_etl.negative_cache import clear_keys, failure_reason, load_cached_keys, record_failures, summarize
+from rede_etl.reconcile import clear_staging_slice, prepare_staging, reconcile_period
+from rede_etl.row_hash import ensure_row_hash_column, insert_new_rows, row_hash
+from rede_etl.token_manager import TokenManager
+from rede_etl.write_queue import WriteQueue
+
 """Config dotenv"""
 from dotenv import load_dotenv
 from pathlib import Path
@@ -16,114 +27,95 @@ def localizar_env(diretorio_raiz="PRIVATE_BAG.ENV"):
         if possible.exists():
             return possible
     raise FileNotFoundError(f"Arquivo .env não encontrado dentro de '{diretorio_raiz}'.")
-env_path = localizar_env()
-load_dotenv(dotenv_path=env_path)
-
-class TokenManager:
-    def __init__(self):
-        self.access_token = None
-        self.refresh_token = None
-
-    def update_token(self):
-        print("Reautenticando para obter novo token...")
-        new_access_token, new_refresh_token = get_tokens()
-        if new_access_token:
-            self.access_token = new_access_token
-            self.refresh_token = new_refresh_token
-            print("Token atualizado com sucesso.")
-        else:
-            print("Falha ao atualizar token.")
-
+# O orquestrador já carregou o .env antes de importar o script
+if not os.getenv("REDE_ENV_CARREGADO"):
+    env_path = localizar_env()
+    load_dotenv(dotenv_path=env_path)
 
 # Conexão ao banco de dados
 def connect_to_database():
-    connection_string = (
-        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-        f"SERVER={os.getenv('DB_SERVER_EXCEL')},{os.getenv('DB_PORT_EXCEL')};"
-        f"DATABASE={os.getenv('DB_DATABASE_EXCEL')};"
-        f"UID={os.getenv('DB_USER_EXCEL')};"
-        f"PWD={os.getenv('DB_PASSWORD_EXCEL')}"
-    )
+    """Conexão do pool compartilhado; close() a devolve ao pool."""
     try:
-        conn = pyodbc.connect(connection_string)
-        print("Conexão ao banco de dados realizada com sucesso.")
-        return conn
+        return get_pool().acquire()
     except Exception as e:
         print(f"Erro ao conectar ao banco de dados: {e}")
         return None
 
 
-# Obter tokens de autenticação
-def get_tokens():
-    url = os.getenv("TOKEN_URL_REDE")
-    body = {
-        "grant_type": "password",
-        "username": os.getenv("API_USERNAME_REDE"),
-        "password": os.getenv("API_PASSWORD_REDE")
-    }
-
-    headers = {
-        "Authorization": os.getenv("API_AUTH_HEADER_REDE"),
-    }
-
-    response = requests.post(url, data=body, headers=headers)
-
-    if response.status_code == 200:
-        data = response.json()
-        access_token = data.get("access_token", "")
-        refresh_token = data.get("refresh_token", "")
-        return access_token, refresh_token
-    else:
-        print("Falha na obtenção do token. Status code:", response.status_code)
-        return None, None
+# Buscar as parcelas de um pagamento e enfileirá-las para gravação; falhas vão para `failures`
+def lookup_installments(row, token_manager, writer, failures):
+    row_id, parent_company_number, payment_id = row
+    print(f"Buscando parcelas para Payment ID: {payment_id}, Empresa: {parent_company_number}")
+    status_code, installments_data = fetch_installments_by_payment_id(token_manager, parent_company_number, payment_id)
+    reason = failure_reason(status_code, installments_data)
+    if reason is not None:
+        failures.append((parent_company_number, payment_id, reason))
+        return False
+    for installment in installments_data['content']['installments']:
+        writer.put((installment, row_id))
+    return True
+
+# Tipos dos parâmetros de escrita em BD_PagamentosConsolidados (None = tipo decidido pelo driver)
+PAYMENTS_INPUT_SIZES = [
+    None, varchar(10), None, None, None,
+    None, None, varchar(), varchar(), varchar(),
+    None, varchar(), None, varchar(), None
+]
+INSTALLMENTS_INPUT_SIZES = [
+    None, None, None, None, varchar(), varchar(), varchar(30),
+    None, None, None, None, None
+]
+
+PAYMENTS_TABLE = "BD_PagamentosConsolidados"
+PAYMENTS_ENDPOINT = "payments"
+NEGATIVE_CACHE_PROCESS = "parcelas_pagamento"
+
+PAYMENT_COLUMNS = [
+    'paymentId', 'paymentDate', 'bankCode', 'bankBranchCode', 'accountNumber',
+    'brandCode', 'parentCompanyNumber', 'documentNumber', 'companyName', 'tradeName',
+    'netAmount', 'status', 'statusCode', 'type', 'typeCode'
+]
+
+
+# Converter um pagamento da API para as colunas da tabela, com o RowHash do conteúdo
+def transform_payment(payment):
+    values = (
+        payment.get('paymentId', None),
+        payment.get('paymentDate', None),
+        payment.get('bankCode', None),
+        payment.get('bankBranchCode', None),
+        payment.get('accountNumber', None),
+        payment.get('brandCode', None),
+        payment.get('companyNumber', None),
+        payment.get('documentNumber', None),
+        payment.get('companyName', None),
+        payment.get('tradeName', None),
+        payment.get('netAmount', 0.0),
+        payment.get('status', None),
+        payment.get('statusCode', None),
+        payment.get('type', None),
+        payment.get('typeCode', None)
+    )
+    return values + (row_hash(values),)
 
-def fetch_installments_parallel(rows, token_manager):
-    def fetch_single(row):
-        row_id, parent_company_number, payment_id = row
-        print(f"Buscando parcelas para Payment ID: {payment_id}, Empresa: {parent_company_number}")
-        return fetch_installments_by_payment_id(token_manager, parent_company_number, payment_id), row_id
 
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:  
-        results = list(executor.map(fetch_single, rows))
+# Carga na tabela viva ou no staging de reconciliação têm checkpoints separados
+def checkpoint_endpoint(table):
+    return PAYMENTS_ENDPOINT if table == PAYMENTS_TABLE else f"{PAYMENTS_ENDPOINT}:{table}"
 
-    return results
 
-# Inserir dados de pagamentos no banco
-def insert_payments_batch(cursor, payments):
-    query = """
-        INSERT INTO BD_PagamentosConsolidados (
-            paymentId, paymentDate, bankCode, bankBranchCode, accountNumber,
-            brandCode, parentCompanyNumber, documentNumber, companyName, tradeName,
-            netAmount, status, statusCode, type, typeCode
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """
+# Inserir no banco apenas os pagamentos cujo RowHash ainda não existe (sem commit)
+def insert_payments_batch(cursor, payments, table=PAYMENTS_TABLE):
     try:
-        for payment in payments:
-            print(f"    Inserindo pagamento ID: {payment.get('paymentId')}")
-        cursor.executemany(query, [
-            (
-                payment.get('paymentId', None),
-                payment.get('paymentDate', None),
-                payment.get('bankCode', None),
-                payment.get('bankBranchCode', None),
-                payment.get('accountNumber', None),
-                payment.get('brandCode', None),
-                payment.get('companyNumber', None),
-                payment.get('documentNumber', None),
-                payment.get('companyName', None),
-                payment.get('tradeName', None),
-                payment.get('netAmount', 0.0),
-                payment.get('status', None),
-                payment.get('statusCode', None),
-                payment.get('type', None),
-                payment.get('typeCode', None)
-            ) for payment in payments
-        ])
+        print(f"    Inserindo {len(payments)} pagamentos")
+        insert_new_rows(cursor, table, PAYMENT_COLUMNS, payments, PAYMENTS_INPUT_SIZES)
+        return True
     except Exception as e:
         print(f"Erro ao inserir pagamentos em batch: {e}")
+        return False
 
 
-# Atualizar parcelas no banco de dados
+# Atualizar parcelas no banco de dados (sem commit; erros sobem para quem chamou)
 def update_installments_batch(cursor, installments, row_ids):
     query = """
         UPDATE BD_PagamentosConsolidados
@@ -141,206 +133,346 @@ def update_installments_batch(cursor, installments, row_ids):
             nsu = ?
         WHERE id = ?
     """
+    write_rows(cursor, query, [
+        (
+            installment.get('installmentQuantity', 0),
+            installment.get('installmentNumber', 0),
+            installment.get('saleAmount', 0.0),
+            installment.get('authorizationCode', "N/A"),
+            installment.get('brand', "N/A"),
+            installment.get('cardNumber', "N/A"),
+            installment.get('expirationDate', None),
+            installment.get('flexFee', 0.0),
+            installment.get('mdrAmount', 0.0),
+            installment.get('feeTotal', 0.0),
+            installment.get('nsu', 0),
+            row_id
+        ) for installment, row_id in zip(installments, row_ids)
+    ], INSTALLMENTS_INPUT_SIZES, commit=False)
+
+
+# Listar, entre as linhas recém-carregadas, as que ainda não têm parcelas (NSU nulo)
+def load_pending_payments(cursor, hashes, chunk_size=500):
+    rows = []
+    hashes = list(hashes)
+    for start in range(0, len(hashes), chunk_size):
+        chunk = hashes[start:start + chunk_size]
+        cursor.execute(f"""
+            SELECT id, parentCompanyNumber, paymentId
+            FROM BD_PagamentosConsolidados
+            WHERE nsu IS NULL AND RowHash IN ({", ".join("?" for _ in chunk)})
+        """, chunk)
+        rows.extend(tuple(row) for row in cursor.fetchall())
+    return rows
+
+
+# Gravar uma página de pagamentos e o checkpoint da próxima no mesmo commit, numa
+# conexão usada só para isso; retorna as linhas da página ainda sem parcelas, ou None se falhar
+def write_payments_page(page, endpoint, checkpoint, next_page_key, table=PAYMENTS_TABLE):
+    conn = connect_to_database()
+    if not conn:
+        return None
     try:
-        cursor.executemany(query, [
-            (
-                installment.get('installmentQuantity', 0),
-                installment.get('installmentNumber', 0),
-                installment.get('saleAmount', 0.0),
-                installment.get('authorizationCode', "N/A"),
-                installment.get('brand', "N/A"),
-                installment.get('cardNumber', "N/A"),
-                installment.get('expirationDate', None),
-                installment.get('flexFee', 0.0),
-                installment.get('mdrAmount', 0.0),
-                installment.get('feeTotal', 0.0),
-                installment.get('nsu', 0),
-                row_id
-            ) for installment, row_id in zip(installments, row_ids)
-        ])
-    except Exception as e:
-        print(f"Erro ao atualizar parcelas em batch: {e}")
+        cursor = conn.cursor()
+        if page and not insert_payments_batch(cursor, page, table):
+            conn.rollback()
+            return None
+        if next_page_key is None:
+            clear_checkpoint(cursor, endpoint, checkpoint)
+        else:
+            set_checkpoint(cursor, endpoint, checkpoint, next_page_key)
+        conn.commit()
+        return load_pending_payments(cursor, {payment[-1] for payment in page}) if page else []
+    finally:
+        conn.close()
 
 
 # Processar pagamentos para uma única empresa em um dia
-def process_company_payments(company_number, token_manager, day, conn_string, batch_size):
+def process_company_payments(company_number, token_manager, day, on_page=None, table=PAYMENTS_TABLE):
+    """
+    Cada página é gravada em `table` assim que chega; on_page(linhas), se
+    informado, recebe as linhas da página que ainda precisam de parcelas, para
+    que a busca comece sem esperar o restante do dia. Retorna True se a
+    extração chegou ao fim.
+    """
     print(f"  Processando empresa: {company_number} para o dia {day}")
-    conn = pyodbc.connect(conn_string)
-    cursor = conn.cursor()
+    endpoint = checkpoint_endpoint(table)
+    checkpoint = checkpoint_key(company_number, day, day)
+    # A conexão só é usada nas gravações; as chamadas à API não seguram uma vaga do pool
+    conn = connect_to_database()
+    if not conn:
+        return False
+    try:
+        cursor = conn.cursor()
+        page_key = get_checkpoint(cursor, endpoint, checkpoint)
+        if not page_key and table != PAYMENTS_TABLE:
+            # Dia baixado do início no staging: descarta as linhas da carga anterior,
+            # que podem ter mudado na API desde então
+            clear_staging_slice(cursor, table, "paymentDate", day, day, "parentCompanyNumber", company_number)
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"  Erro ao preparar a carga da empresa {company_number} no dia {day}: {e}")
+        return False
+    finally:
+        conn.close()
+    if page_key:
+        print(f"  Retomando empresa {company_number} no dia {day} a partir do checkpoint {page_key}")
     url = "https://api.userede.com.br/redelabs/merchant-statement/v1/payments"
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token_manager.access_token}"}
+    headers = {"Content-Type": "application/json"}
 
     params = {
         "startDate": day,
         "endDate": day,
         "parentCompanyNumber": company_number,
         "subsidiaries": company_number,
-        "pageKey": None
+        "pageKey": page_key
     }
 
-    payments_batch = []
-
+    completed = False
     while True:
-        response = requests.get(url, params=params, headers=headers)
+        access_token = token_manager.get_access_token()
+        headers["Authorization"] = f"Bearer {access_token}"
+        response = http_client.get(url, params=params, headers=headers)
         if response.status_code == 200:
             data = response.json()
             if 'content' in data and 'payments' in data['content']:
-                payments = data['content']['payments']
-                payments_batch.extend(payments)
-
-                if len(payments_batch) >= batch_size:
-                    insert_payments_batch(cursor, payments_batch[:batch_size])
-                    payments_batch = payments_batch[batch_size:]
-
+                page = [transform_payment(payment) for payment in data['content']['payments']]
                 if 'cursor' in data and data['cursor'].get('hasNextKey', False):
                     params['pageKey'] = data['cursor']['nextKey']
                 else:
+                    params['pageKey'] = None
+
+                pending = write_payments_page(page, endpoint, checkpoint, params['pageKey'], table)
+                if pending is None:
+                    break
+                if pending and on_page is not None:
+                    on_page(pending)
+                if params['pageKey'] is None:
+                    completed = True
                     break
             else:
+                completed = write_payments_page([], endpoint, checkpoint, None, table) is not None
                 break
         elif response.status_code == 401:
             print(f"Token expirado para empresa {company_number}. Reautenticando...")
-            token_manager.update_token()
-            headers["Authorization"] = f"Bearer {token_manager.access_token}"
+            token_manager.update_token(access_token)
         else:
             print(f"Erro na requisição para empresa {company_number}: {response.status_code}")
             break
 
-    if payments_batch:
-        insert_payments_batch(cursor, payments_batch)
-
-    conn.commit()
-    conn.close()
+    return completed
 
-# Remover duplicatas no banco de dados
-def remove_duplicates(cursor):
+# Remover duplicatas restantes (linhas antigas, sem RowHash) apenas no dia carregado
+def remove_duplicates(cursor, day):
     query = """
-    DELETE FROM BD_PagamentosConsolidados
-    WHERE id NOT IN (
-        SELECT MIN(id)
+    WITH CTE AS (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY 
+                paymentId, 
+                paymentDate, 
+                bankCode, 
+                bankBranchCode, 
+                accountNumber, 
+                brandCode, 
+                parentCompanyNumber, 
+                documentNumber, 
+                companyName, 
+                tradeName, 
+                netAmount, 
+                status, 
+                statusCode, 
+                type, 
+                typeCode
+            ORDER BY CASE WHEN RowHash IS NULL THEN 1 ELSE 0 END, id
+        ) AS rn
         FROM BD_PagamentosConsolidados
-        GROUP BY 
-            paymentId, 
-            paymentDate, 
-            bankCode, 
-            bankBranchCode, 
-            accountNumber, 
-            brandCode, 
-            parentCompanyNumber, 
-            documentNumber, 
-            companyName, 
-            tradeName, 
-            netAmount, 
-            status, 
-            statusCode, 
-            type, 
-            typeCode
+        WHERE paymentDate = ?
     )
+    DELETE FROM CTE WHERE rn > 1
     """
     try:
-        cursor.execute(query)
+        cursor.execute(query, (day,))
         cursor.commit()
         print("Linhas duplicadas removidas com sucesso.")
     except Exception as e:
         print(f"Erro ao remover duplicatas: {e}")
 
-# Processar pagamentos e parcelas para todas as empresas de um dia
-def process_daily_payments_and_installments(day, companyNumbers, token_manager, conn_string, batch_size):
-    print(f"Iniciando processamento para o dia: {day}")
-
-    # Processar pagamentos
-    with ProcessPoolExecutor() as executor:
-        tasks = [
-            executor.submit(process_company_payments, company_number, token_manager, day, conn_string, batch_size)
-            for company_number in companyNumbers
-        ]
-        for task in tasks:
-            task.result()
-
-    # Remover duplicatas após processamento de pagamentos
-    conn = pyodbc.connect(conn_string)
-    cursor = conn.cursor()
-    remove_duplicates(cursor)
-    conn.close()
+# Deduplicar o dia e listar os pagamentos que ainda não têm parcelas (NSU nulo)
+def load_payments_without_installments(day):
+    conn = connect_to_database()
+    if not conn:
+        return []
+    try:
+        cursor = conn.cursor()
 
-    # Buscar parcelas paralelamente, somente para linhas onde NSU está nulo
-    conn = pyodbc.connect(conn_string)
-    cursor = conn.cursor()
-    print(f"Buscando parcelas para os pagamentos do dia {day} onde NSU está nulo...")
-
-    cursor.execute("""
-        SELECT id, parentCompanyNumber, paymentId 
-        FROM BD_PagamentosConsolidados 
-        WHERE paymentDate = ? AND nsu IS NULL
-    """, (day,))
-    rows = cursor.fetchall()
-
-    installments_results = fetch_installments_parallel(rows, token_manager)
-
-    # Atualizar parcelas no banco
-    installments_batch = []
-    row_ids = []
-    for installments_data, row_id in installments_results:
-        if installments_data and 'content' in installments_data and 'installments' in installments_data['content']:
-            for installment in installments_data['content']['installments']:
-                installments_batch.append(installment)
-                row_ids.append(row_id)
-
-                if len(installments_batch) >= batch_size:
-                    update_installments_batch(cursor, installments_batch[:batch_size], row_ids[:batch_size])
-                    installments_batch = installments_batch[batch_size:]
-                    row_ids = row_ids[batch_size:]
-
-    if installments_batch:
-        update_installments_batch(cursor, installments_batch, row_ids)
+        # Remover duplicatas após processamento de pagamentos
+        remove_duplicates(cursor, day)
 
-    conn.commit()
-    conn.close()
+        print(f"Buscando parcelas para os pagamentos do dia {day} onde NSU está nulo...")
+        cursor.execute("""
+            SELECT id, parentCompanyNumber, paymentId 
+            FROM BD_PagamentosConsolidados 
+            WHERE paymentDate = ? AND nsu IS NULL
+        """, (day,))
+        return [tuple(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+# Gravar no banco um lote de (parcela, id da linha) vindo da fila de escrita
+def write_installments(items):
+    conn = connect_to_database()
+    if not conn:
+        raise RuntimeError("sem conexão com o banco de dados")
+    try:
+        cursor = conn.cursor()
+        installments, row_ids = zip(*items)
+        update_installments_batch(cursor, installments, row_ids)
+        conn.commit()
+    except Exception:
+        # O lote inteiro é desfeito e contado como falha pela WriteQueue
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# Processar pagamentos e parcelas de todas as (empresa, dia) em um único pipeline
+def process_payments_grid(days, companyNumbers, token_manager, batch_size):
+    """
+    Agenda todas as tarefas (empresa, dia) de pagamentos em um único
+    TaskScheduler. Cada página de pagamentos gravada já dispara as buscas de
+    parcelas das suas linhas, e as parcelas seguem por uma WriteQueue limitada
+    até o banco, então as três etapas (pagamentos, parcelas, gravação) rodam
+    sobrepostas. Quando todas as empresas de um dia terminam, o dia é
+    deduplicado e as linhas antigas ainda sem NSU entram na mesma fila.
+    Retorna False se alguma empresa falhou ou algum lote de parcelas não foi gravado.
+    """
+    scheduler = TaskScheduler()
+    writer = WriteQueue(write_installments, batch_size)
+    payments_pending = {day: len(companyNumbers) for day in days}
+    scheduled_ids = set()
+    scheduled_lock = threading.Lock()
+    failures = []
+    succeeded = []
+    company_results = []
+
+    # Pagamentos que voltaram sem parcelas recentemente ficam fora até o próximo intervalo
+    cached_keys = load_negative_cache()
+
+    def schedule_lookups(rows):
+        for row in rows:
+            with scheduled_lock:
+                if row[0] in scheduled_ids:
+                    continue
+                scheduled_ids.add(row[0])
+            if cached_keys.get((str(row[1]), str(row[2]))):
+                continue
+            scheduler.submit(lookup_installments, (row, token_manager, writer, failures), on_lookup_done)
+
+    def on_lookup_done(args, found):
+        if found:
+            row = args[0]
+            succeeded.append((row[1], row[2]))
+
+    def on_payments_done(args, completed):
+        company_results.append(bool(completed))
+        day = args[2]
+        payments_pending[day] -= 1
+        if payments_pending[day] == 0:
+            print(f"Pagamentos do dia {day} concluídos.")
+            scheduler.submit(load_payments_without_installments, (day,),
+                             lambda _args, rows: schedule_lookups(rows or []))
+
+    for day in days:
+        print(f"Iniciando processamento para o dia: {day}")
+        if not companyNumbers:
+            scheduler.submit(load_payments_without_installments, (day,),
+                             lambda _args, rows: schedule_lookups(rows or []))
+        for company_number in companyNumbers:
+            scheduler.submit(process_company_payments, (company_number, token_manager, day, schedule_lookups),
+                             on_payments_done)
+
+    try:
+        scheduler.run()
+    finally:
+        writer.close()
+    print(f"Parcelas gravadas: {writer.written} (falhas: {writer.failed}).")
+    save_negative_cache(failures, [key for key in succeeded if (str(key[0]), str(key[1])) in cached_keys])
+    return all(company_results) and writer.failed == 0
+
+
+# Ler do cache negativo as chaves de pagamentos sem parcelas: {(empresa, paymentId): bloqueada}
+def load_negative_cache():
+    conn = connect_to_database()
+    if not conn:
+        return {}
+    try:
+        cached_keys = load_cached_keys(conn.cursor(), NEGATIVE_CACHE_PROCESS)
+        conn.commit()
+        return cached_keys
+    except Exception as e:
+        print(f"Erro ao ler o cache negativo: {e}")
+        return {}
+    finally:
+        conn.close()
+
+
+# Registrar no cache negativo as falhas da execução e remover as chaves que voltaram a responder
+def save_negative_cache(failures, recovered):
+    conn = connect_to_database()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        record_failures(cursor, NEGATIVE_CACHE_PROCESS, failures)
+        clear_keys(cursor, NEGATIVE_CACHE_PROCESS, recovered)
+        conn.commit()
+        print(f"Pagamentos sem parcelas registrados no cache negativo: {summarize(failures)}")
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao atualizar o cache negativo: {e}")
+    finally:
+        conn.close()
+
+
+# Processar pagamentos e parcelas para todas as empresas de um dia
+def process_daily_payments_and_installments(day, companyNumbers, token_manager, batch_size):
+    return process_payments_grid([day], companyNumbers, token_manager, batch_size)
 
 
 def fetch_installments_by_payment_id(token_manager, parent_company_number, payment_id):
     url = f"https://api.userede.com.br/redelabs/merchant-statement/v2/payments/installments/{parent_company_number}/{payment_id}"
-    headers = {"Authorization": f"Bearer {token_manager.access_token}", "Content-Type": "application/json"}
+    access_token = token_manager.get_access_token()
+    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     
     retries = 3  # Número de tentativas
     for attempt in range(retries):
         try:
-            response = requests.get(url, headers=headers, timeout=30)
+            response = http_client.get(url, headers=headers, timeout=30)
             if response.status_code == 401:
                 print("Token expirado ao buscar parcelas. Reautenticando...")
-                token_manager.update_token()
-                headers["Authorization"] = f"Bearer {token_manager.access_token}"
-                response = requests.get(url, headers=headers, timeout=30)
+                access_token = token_manager.update_token(access_token)
+                headers["Authorization"] = f"Bearer {access_token}"
+                response = http_client.get(url, headers=headers, timeout=30)
             if response.status_code == 200:
-                return response.json()
+                return response.status_code, response.json()
             else:
                 print(f"Erro na API de parcelas por Payment ID. Status code: {response.status_code}")
-                return None
+                return response.status_code, None
         except requests.exceptions.Timeout:
             print(f"Tentativa {attempt + 1} de {retries} falhou devido a timeout. Retentando...")
         except requests.exceptions.ConnectionError as e:
             print(f"Tentativa {attempt + 1} de {retries} falhou devido a erro de conexão: {e}. Retentando...")
     print("Falha após múltiplas tentativas.")
-    return None
+    return None, None
 
-def delete_previous_month_data(cursor, previous_month_start, previous_month_end):
-    """
-    Apaga os registros do mês anterior na tabela.
-    """
-    delete_query = """
-        DELETE FROM BD_PagamentosConsolidados
-        WHERE paymentDate BETWEEN ? AND ?
+def process_previous_month(token_manager, companyNumbers, batch_size):
     """
-    try:
-        cursor.execute(delete_query, (previous_month_start, previous_month_end))
-        cursor.connection.commit()
-        print(f"Dados de {previous_month_start} a {previous_month_end} removidos com sucesso.")
-    except Exception as e:
-        print(f"Erro ao apagar dados do mês anterior: {e}")
-
-def process_previous_month(token_manager, companyNumbers, conn_string, batch_size):
-    """
-    Processa o mês anterior: apaga os dados do mês anterior e os reprocessa.
+    Reprocessa o mês anterior por diferença: carrega o mês no staging de
+    reconciliação, aplica na tabela viva só as inserções e remoções (um dia
+    por transação) e busca as parcelas das linhas novas.
     """
     today = datetime.today()
     previous_month = today.month - 1 or 12
@@ -356,40 +488,52 @@ def process_previous_month(token_manager, companyNumbers, conn_string, batch_siz
     # Conecta ao banco de dados
     conn = connect_to_database()
     if not conn:
-        return
+        return False
 
     cursor = conn.cursor()
+    staging = prepare_staging(cursor, PAYMENTS_TABLE, PAYMENT_COLUMNS, "paymentDate",
+                              previous_month_start, previous_month_end)
+    conn.commit()
 
-    # Apaga os dados existentes do mês anterior
-    delete_previous_month_data(cursor, previous_month_start, previous_month_end)
-
-    # Processa os pagamentos para cada dia do mês anterior
     date_range = [
         (datetime.strptime(previous_month_start, "%Y-%m-%d") + timedelta(days=i)).strftime("%Y-%m-%d")
         for i in range((datetime.strptime(previous_month_end, "%Y-%m-%d") - datetime.strptime(previous_month_start, "%Y-%m-%d")).days + 1)
     ]
 
-    for day in date_range:
-        process_daily_payments_and_installments(day, companyNumbers, token_manager, conn_string, batch_size)
+    # Carrega todas as (empresa, dia) do mês no staging (retoma checkpoints de uma carga interrompida)
+    results = run_tasks(process_company_payments, [
+        (company_number, token_manager, day, None, staging)
+        for day in date_range
+        for company_number in companyNumbers
+    ])
+    if not all(results):
+        # Aplicar um staging incompleto apagaria linhas que só não foram baixadas ainda
+        print("Carga do mês anterior incompleta; reconciliação adiada para a próxima execução.")
+        conn.close()
+        return False
+
+    deleted, inserted = reconcile_period(conn, PAYMENTS_TABLE, PAYMENT_COLUMNS, "paymentDate", date_range)
+    print(f"Mês anterior reconciliado: {deleted} linhas removidas, {inserted} inseridas.")
+
+    # Parcelas das linhas novas (NSU nulo), dia a dia, no mesmo pipeline da carga diária
+    completed = process_payments_grid(date_range, [], token_manager, batch_size)
 
     conn.close()
     print(f"Processamento do mês anterior concluído: {previous_month_start} a {previous_month_end}.")
+    return completed
 
 # Principal
-def main():
-    conn_string = (
-        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-        f"SERVER={os.getenv('DB_SERVER_EXCEL')},{os.getenv('DB_PORT_EXCEL')};"
-        f"DATABASE={os.getenv('DB_DATABASE_EXCEL')};"
-        f"UID={os.getenv('DB_USER_EXCEL')};"
-        f"PWD={os.getenv('DB_PASSWORD_EXCEL')}"
-    )
-
+def main(token_manager=None):
     conn = connect_to_database()
     if not conn:
-        return
+        return False
+    cursor = conn.cursor()
+    ensure_row_hash_column(cursor, PAYMENTS_TABLE, PAYMENT_COLUMNS)
+    ensure_checkpoint_table(cursor)
+    conn.commit()
+    conn.close()
 
-    batch_size = 5  # Configuração do tamanho do batch
+    batch_size = batch_size_from_env()  # Configuração do tamanho do batch (REDE_BULK_BATCH_SIZE)
 
     company_numbers_str = os.getenv("COMPANY_NUMBERS_REDE")
     if company_numbers_str:
@@ -397,12 +541,14 @@ def main():
     else:
         companyNumbers = []
 
-    token_manager = TokenManager()
-    token_manager.update_token()  # Inicializar o token
+    # Reaproveitar o TokenManager do orquestrador, se houver
+    if token_manager is None:
+        token_manager = TokenManager()
+        token_manager.update_token()  # Inicializar o token
 
     if not token_manager.access_token:
         print("Erro ao obter token de autenticação.")
-        return
+        return False
 
     # Menu de opções
     print("Escolha uma opção para executar:")
@@ -431,11 +577,10 @@ def main():
         start_date = (today - timedelta(days=7)).strftime("%Y-%m-%d")
         end_date = (today - timedelta(days=1)).strftime("%Y-%m-%d")
     elif option == "5":
-        process_previous_month(token_manager, companyNumbers, conn_string, batch_size)
-        return
+        return process_previous_month(token_manager, companyNumbers, batch_size)
     else:
         print("Opção inválida!")
-        return
+        return False
 
     # Converter datas para objetos datetime
     start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
@@ -447,11 +592,11 @@ def main():
         for i in range((end_date_obj - start_date_obj).days + 1)
     ]
 
-    # Processar cada dia no intervalo
-    for day in date_range:
-        process_daily_payments_and_installments(day, companyNumbers, token_manager, conn_string, batch_size)
+    # Processar todas as (empresa, dia) do intervalo em uma única grade
+    completed = process_payments_grid(date_range, companyNumbers, token_manager, batch_size)
 
-    print("Processo concluído.")
+    print("Processo concluído." if completed else "Processo concluído com falhas.")
+    return completed
 
 
 if __name__ == "__main__":
@@ -1,9 +1,17 @@
 import requests
 import datetime
 import pyodbc
-import concurrent.futures
 import os
 
+from rede_etl import http_client
+from rede_etl.bulk_writer import varchar, write_rows
+from rede_etl.db_pool import build_connection_string, get_pool
+from rede_etl.fetch_engine import run_tasks
+from rede_etl.snapshots import (ensure_snapshot_tables, evict_current,
+                                prune_runs, publish_current,
+                                retention_from_env)
+from rede_etl.token_manager import TokenManager
+
 """Config dotenv"""
 from dotenv import load_dotenv
 from pathlib import Path
@@ -14,23 +22,26 @@ def localizar_env(diretorio_raiz="PRIVATE_BAG.ENV"):
         if possible.exists():
             return possible
     raise FileNotFoundError(f"Arquivo .env não encontrado dentro de '{diretorio_raiz}'.")
-env_path = localizar_env()
-load_dotenv(dotenv_path=env_path)
+# O orquestrador já carregou o .env antes de importar o script
+if not os.getenv("REDE_ENV_CARREGADO"):
+    env_path = localizar_env()
+    load_dotenv(dotenv_path=env_path)
+
+RECEIVABLES_TABLE = "BD_RECEBIVEIS_MENSAL"
+KEY_COLUMNS = ["CompanyNumber", "StartDate"]
+VALUE_COLUMNS = ["EndDate", "ValorTotal", "Quantidade"]
+# Execuções mantidas no histórico (0 = todas)
+RETAINED_RUNS = retention_from_env("RECEBIVEIS_MENSAL_EXECUCOES_RETIDAS", 30)
 
 
 # --------------------------------------------------------------------------- #
 # 1. Conexão com o SQL Server
 # --------------------------------------------------------------------------- #
 def create_connection(driver, server, database, user, password, port):
+    # Conexão do pool compartilhado; close() a devolve ao pool
     try:
-        connection = pyodbc.connect(
-            f'DRIVER={{{driver}}};'
-            f'SERVER={server},{port};'
-            f'DATABASE={database};'
-            f'UID={user};'
-            f'PWD={password}'
-        )
-        print("Connection to SQL Server successful RM")
+        connection = get_pool(build_connection_string(
+            driver, server, port, database, user, password)).acquire()
         return connection
     except pyodbc.Error as e:
         print(f"The error '{e}' occurred RM")
@@ -40,83 +51,42 @@ def create_connection(driver, server, database, user, password, port):
 # --------------------------------------------------------------------------- #
 # 2. Inserção de dados
 # --------------------------------------------------------------------------- #
-def insert_data(connection, startdate, enddate, companyNumber,
-                amount, total):
+def insert_data(connection, rows, run_id, window_start):
+    """
+    rows: lista de (StartDate, EndDate, CompanyNumber, ValorTotal, Quantidade).
+    Grava o snapshot da execução no histórico e atualiza a tabela atual na
+    mesma transação, removendo dela os meses anteriores a `window_start`.
+    """
     try:
         cursor = connection.cursor()
-        insert_query = """
-        INSERT INTO BD_RECEBIVEIS_MENSAL
+        insert_query = f"""
+        INSERT INTO {RECEIVABLES_TABLE}
                (StartDate, EndDate, CompanyNumber,
-                ValorTotal, Quantidade)
-        VALUES  (?, ?, ?, ?, ?)
+                ValorTotal, Quantidade, ExecucaoEm)
+        VALUES  (?, ?, ?, ?, ?, ?)
         """
-        cursor.execute(
-            insert_query,
-            (startdate, enddate, companyNumber,
-             amount, total)
-        )
+        write_rows(cursor, insert_query,
+                   [row + (run_id,) for row in rows],
+                   [varchar(10), varchar(10), None, None, None, None],
+                   commit=False)
+        publish_current(cursor, RECEIVABLES_TABLE, KEY_COLUMNS,
+                        VALUE_COLUMNS, run_id)
+        evict_current(cursor, RECEIVABLES_TABLE, "StartDate", window_start)
         connection.commit()
+        return True
     except pyodbc.Error as e:
+        connection.rollback()
         print(f"Erro ao inserir dados: {e} RM")
+        return False
 
 
 # --------------------------------------------------------------------------- #
-# 3. Autenticação / Renovação de token
+# 3. Consulta de um (empresa, mês)
 # --------------------------------------------------------------------------- #
-def get_tokens():
-    url = os.getenv("TOKEN_URL_REDE")
-    body = {
-        "grant_type": "password",
-        "username": os.getenv("API_USERNAME_REDE"),
-        "password": os.getenv("API_PASSWORD_REDE")
-    }
-    headers = {
-        "Authorization": os.getenv("API_AUTH_HEADER_REDE")
-    }
-    response = requests.post(url, data=body, headers=headers)
-    if response.status_code == 200:
-        data = response.json()
-        return (data.get("access_token"), data.get("refresh_token"),
-                data.get("token_type"), data.get("expires_in"),
-                data.get("scope"))
-    else:
-        print("Falha na obtenção do token. Status code:",
-              response.status_code, "RM")
-        return None, None, None, None, None
-
-
-def refresh_access_token(refresh_token):
-    url = "https://api.userede.com.br/redelabs/oauth/token"
-    body = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token
-    }
-    headers = {
-        "Authorization":
-        "Basic N2I3OWIyNjUtNjFjMi00YmJiLThlNmItZGE2NDNjMDliMThiOjI3bWJXMnpDeFE="
-    }
-    response = requests.post(url, data=body, headers=headers)
-    if response.status_code == 200:
-        data = response.json()
-        return data.get("access_token"), data.get("refresh_token")
-    else:
-        print("Falha na atualização do token. Status code:",
-              response.status_code, "RM")
-        return None, None
-
-
-# --------------------------------------------------------------------------- #
-# 4. Processo por empresa (1 thread por CNPJ)
-# --------------------------------------------------------------------------- #
-def process_company(companyNumber, data, url,
-                    access_token, refresh_token,
-                    driver, server, database, user, password, port):
-    connection = create_connection(driver, server, database, user, password,
-                                   port)
-    if not connection:
-        return
-
-    for i in range(13):
+def month_periods(data, months=13):
+    """(startdate, enddate) de cada mês a partir do mês de `data`."""
+    periods = []
+    for i in range(months):
         month = (data.month + i - 1) % 12 + 1
         year_offset = (data.month + i - 1) // 12
         current_year = data.year + year_offset
@@ -127,60 +97,61 @@ def process_company(companyNumber, data, url,
             else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31
         ][month - 1]
 
-        startdate = f"{current_year:04d}-{month:02d}-01"
-        enddate = f"{current_year:04d}-{month:02d}-{dayfin:02d}"
+        periods.append((f"{current_year:04d}-{month:02d}-01",
+                        f"{current_year:04d}-{month:02d}-{dayfin:02d}"))
+    return periods
 
-        params = {
-            "startDate": startdate,
-            "endDate": enddate,
-            "parentCompanyNumber": companyNumber
-        }
+
+def fetch_month_summary(companyNumber, startdate, enddate, url, token_manager):
+    """Retorna a linha (StartDate, EndDate, CompanyNumber, ValorTotal, Quantidade) ou None."""
+    params = {
+        "startDate": startdate,
+        "endDate": enddate,
+        "parentCompanyNumber": companyNumber
+    }
+
+    for _ in range(2):  # segunda tentativa só após renovar o token
+        access_token = token_manager.get_access_token()
         headers = {
             "Content-Type": "application/json",
             "Authorization": "Bearer " + access_token
         }
 
         try:
-            response = requests.get(url,
+            response = http_client.get(url,
                                     params=params,
                                     headers=headers,
                                     timeout=10)
-
-            if response.status_code == 200:
-                content = response.json().get('content', [])
-                if content:
-                    amount = content[0]['amount']
-                    total = content[0]['total']
-                else:
-                    amount = total = 0
-                insert_data(connection, startdate, enddate,
-                            companyNumber, amount, total)
-                print("Valores inseridos para a empresa",
-                      companyNumber, "RM")
-
-            elif response.status_code == 401:
-                (new_access_token,
-                 new_refresh_token) = refresh_access_token(refresh_token)
-                if new_access_token:
-                    access_token = new_access_token
-                    refresh_token = new_refresh_token
-                    headers["Authorization"] = "Bearer " + access_token
-                else:
-                    print("Falha na atualização do token. RM")
-                    break
-            else:
-                print(f"Erro para a empresa {companyNumber}: "
-                      f"{response.status_code} RM")
-
         except requests.exceptions.Timeout:
             print(f"Timeout ao tentar obter dados "
                   f"para a empresa {companyNumber} RM")
+            return None
+
+        if response.status_code == 200:
+            content = response.json().get('content', [])
+            if content:
+                amount = content[0]['amount']
+                total = content[0]['total']
+            else:
+                amount = total = 0
+            return (startdate, enddate, companyNumber, amount, total)
+
+        if response.status_code == 401:
+            if not token_manager.update_token(access_token):
+                print("Falha na atualização do token. RM")
+                return None
+            continue
+
+        print(f"Erro para a empresa {companyNumber}: "
+              f"{response.status_code} RM")
+        return None
+    return None
 
 
 # --------------------------------------------------------------------------- #
-# 5. Orquestração principal
+# 4. Orquestração principal
 # --------------------------------------------------------------------------- #
-def job():
+def job(token_manager=None):
     driver = "ODBC Driver 17 for SQL Server"
     server = os.getenv("DB_SERVER_EXCEL")
     user = os.getenv("DB_USER_EXCEL")
@@ -188,17 +159,28 @@ def job():
     database = os.getenv("DB_DATABASE_EXCEL")
     port = int(os.getenv("DB_PORT_EXCEL"))
 
-    connection_test = create_connection(driver, server, database,
-                                        user, password, port)
-    if not connection_test:
+    connection = create_connection(driver, server, database,
+                                   user, password, port)
+    if not connection:
         print("Não foi possível estabelecer a conexão com o banco de dados."
               " RM")
-        return
+        return False
 
-    access_token, refresh_token, _, _, _ = get_tokens()
-    if not access_token or not refresh_token:
+    # Reaproveitar o TokenManager do orquestrador, se houver
+    if token_manager is None:
+        token_manager = TokenManager()
+    if not token_manager.get_access_token():
         print("Falha na obtenção do token. RM")
-        return
+        connection.close()
+        return False
+
+    try:
+        ensure_snapshot_tables(connection.cursor(), RECEIVABLES_TABLE,
+                               KEY_COLUMNS, VALUE_COLUMNS)
+    except pyodbc.Error as e:
+        print(f"Erro ao preparar as tabelas de snapshot: {e} RM")
+        connection.close()
+        return False
 
     url = ("https://api.userede.com.br/redelabs/"
            "merchant-statement/v2/receivables/summary")
@@ -208,24 +190,34 @@ def job():
                       if num.strip()]
 
     data_base = datetime.datetime.now()
-
-    max_workers = max(1, (os.cpu_count() or 2) - 1)
-    with concurrent.futures.ThreadPoolExecutor(
-            max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(
-                process_company,
-                companyNumber,               # empresa
-                data_base,                   # mês/ano de referência
-                url,
-                access_token,
-                refresh_token,
-                driver, server, database,
-                user, password, port          
-            ) for companyNumber in companyNumbers
-        ]
-        for future in concurrent.futures.as_completed(futures):
-            future.result()
+    # Todas as linhas desta execução compartilham o mesmo ExecucaoEm
+    run_id = data_base.replace(microsecond=0)
+
+    periods = month_periods(data_base)
+
+    # Uma tarefa por (empresa, mês), todas no mesmo executor limitado
+    results = run_tasks(fetch_month_summary, [
+        (companyNumber, startdate, enddate, url, token_manager)
+        for companyNumber in companyNumbers
+        for startdate, enddate in periods
+    ])
+    rows = [row for row in results if row is not None]
+
+    inserted = bool(rows) and insert_data(connection, rows, run_id,
+                                          periods[0][0])
+    if inserted:
+        print(f"{len(rows)} valores inseridos para "
+              f"{len(companyNumbers)} empresas RM")
+        try:
+            removed = prune_runs(connection.cursor(), RECEIVABLES_TABLE,
+                                 RETAINED_RUNS)
+            if removed:
+                print(f"{removed} linhas de execuções antigas removidas RM")
+        except pyodbc.Error as e:
+            connection.rollback()
+            print(f"Erro ao aplicar a retenção: {e} RM")
+    connection.close()
+    return inserted
 
 if __name__ == "__main__":
     job()
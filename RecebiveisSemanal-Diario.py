@@ -1,9 +1,15 @@
 import requests
 import datetime
 import pyodbc
-import concurrent.futures
 import os
 
+from rede_etl import http_client
+from rede_etl.bulk_writer import float_, integer, varchar, write_rows
+from rede_etl.db_pool import build_connection_string, get_pool
+from rede_etl.fetch_engine import run_tasks
+from rede_etl.table_swap import prepare_shadow, swap_in
+from rede_etl.token_manager import TokenManager
+
 """Config dotenv"""
 from dotenv import load_dotenv
 from pathlib import Path
@@ -14,46 +20,53 @@ def localizar_env(diretorio_raiz="PRIVATE_BAG.ENV"):
         if possible.exists():
             return possible
     raise FileNotFoundError(f"Arquivo .env não encontrado dentro de '{diretorio_raiz}'.")
-env_path = localizar_env()
-load_dotenv(dotenv_path=env_path)
+# O orquestrador já carregou o .env antes de importar o script
+if not os.getenv("REDE_ENV_CARREGADO"):
+    env_path = localizar_env()
+    load_dotenv(dotenv_path=env_path)
+
+RECEIVABLES_TABLE = "BD_RECEBIVEIS_SEMANAL"
 
-def job():
+def job(token_manager=None):
     def create_connection(driver, server, database, user, password, port):
+        # Conexão do pool compartilhado; close() a devolve ao pool
         connection = None
         try:
-            connection = pyodbc.connect(
-                f'DRIVER={{{driver}}};'
-                f'SERVER={server},{port};'
-                f'DATABASE={database};'
-                f'UID={user};'
-                f'PWD={password}'
-            )
-            print("Connection to SQL Server successful")
+            connection = get_pool(build_connection_string(
+                driver, server, port, database, user, password)).acquire()
         except pyodbc.Error as e:
             print(f"The error '{e}' occurred")
 
         return connection
 
-    def truncate_table(connection):
+    def prepare_shadow_table(connection):
+        # A carga vai para a tabela sombra; a tabela viva só muda na troca final
         try:
             with connection.cursor() as cursor:
-                cursor.execute("TRUNCATE TABLE BD_RECEBIVEIS_SEMANAL")
+                shadow = prepare_shadow(cursor, RECEIVABLES_TABLE)
                 connection.commit()
-                print("Tabela foi truncada com sucesso. RSD")
+                return shadow
         except pyodbc.Error as e:
             print(f"O erro foi: {e} RSD")
+            return None
 
-    def insert_data(connection, startdate, enddate, companyNumber, amount, total):
+    def insert_data(connection, rows, table):
+        # rows: lista de (StartDate, EndDate, CompanyNumber, ValorTotal, Quantidade)
         try:
             cursor = connection.cursor()
-            insert_query = """
-            INSERT INTO BD_RECEBIVEIS_SEMANAL (StartDate, EndDate, CompanyNumber, ValorTotal, Quantidade)
+            # TABLOCK na tabela sombra vazia reduz o registro no log
+            insert_query = f"""
+            INSERT INTO {table} WITH (TABLOCK) (StartDate, EndDate, CompanyNumber, ValorTotal, Quantidade)
             VALUES (?, ?, ?, ?, ?)
             """
-            cursor.execute(insert_query, (startdate, enddate, companyNumber, float(amount), int(total)))
-            connection.commit()
+            write_rows(cursor, insert_query, [
+                (startdate, enddate, companyNumber, float(amount), int(total))
+                for startdate, enddate, companyNumber, amount, total in rows
+            ], [varchar(10), varchar(10), None, float_(), integer()])
+            return True
         except pyodbc.Error as e:
             print(f"Erro ao inserir dados: {e} RSD")
+            return False
 
     driver = "ODBC Driver 17 for SQL Server"
     server = os.getenv("DB_SERVER_EXCEL")
@@ -69,127 +82,71 @@ def job():
     else:
         print("Código está correto, mas não foi possível estabelecer a conexão. RSD")
 
-    def get_tokens():
-        url = os.getenv("TOKEN_URL_REDE")
-        body = {
-            "grant_type": "password",
-            "username": os.getenv("API_USERNAME_REDE"),
-            "password": os.getenv("API_PASSWORD_REDE")
-        }
-
-        headers = {
-            "Authorization": os.getenv("API_AUTH_HEADER_REDE")
-        }
-
-        response = requests.post(url, data=body, headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()
-            access_token = data.get("access_token", "")
-            refresh_token = data.get("refresh_token", "")
-            token_type = data.get("token_type", "")
-            expires_in = data.get("expires_in", "")
-            scope = data.get("scope", "")
-
-            return access_token, refresh_token, token_type, expires_in, scope
-        else:
-            print("Falha na obtenção do token. Status code:", response.status_code)
-            return None, None, None, None, None
-
-    def refresh_access_token(refresh_token):
-        url = "https://api.userede.com.br/redelabs/oauth/token"
-        body = {
-            "grant_type": "refresh_token",
-            "refresh_token": refresh_token
-        }
-
-        headers = {
-            "Authorization": os.getenv("API_AUTH_HEADER_REDE")
+    url = "https://api.userede.com.br/redelabs/merchant-statement/v2/receivables/summary"
+
+    def business_days(data, days=40):
+        # Dias úteis (seg-sex) a partir de `data`, no formato da API
+        return [
+            f"{day.year:02d}-{day.month:02d}-{day.day:02d}"
+            for day in (data + datetime.timedelta(days=i) for i in range(days))
+            if day.weekday() != 5 and day.weekday() != 6
+        ]
+
+    def fetch_day_summary(companyNumber, startdate, token_manager):
+        # Uma tarefa da grade (empresa, dia): retorna a linha a inserir ou None
+        params = {
+            "startDate": startdate,
+            "endDate": startdate,
+            "parentCompanyNumber": companyNumber
         }
 
-        response = requests.post(url, data=body, headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()
-            access_token = data.get("access_token", "")
-            refresh_token = data.get("refresh_token", "")
-
-            return access_token, refresh_token
-        else:
-            print("Falha na atualização do token. Status code:", response.status_code)
-            return None, None
-
-    def fetch_and_insert_data(companyNumber, access_token, refresh_token, driver, server, database, user, password, port):
-        connection = create_connection(driver, server, database, user, password, port)
-        if not connection:
-            return
-
-        url = "https://api.userede.com.br/redelabs/merchant-statement/v2/receivables/summary"
-        data = datetime.datetime.now()
-
-        for i in range(40):
-            day = data + datetime.timedelta(days=i)
-            if day.weekday() != 5 and day.weekday() != 6:
-                startdate = f"{day.year:02d}-{day.month:02d}-{day.day:02d}"
-                enddate = f"{day.year:02d}-{day.month:02d}-{day.day:02d}"
-
-                params = {
-                    "startDate": startdate,
-                    "endDate": enddate,
-                    "parentCompanyNumber": companyNumber
-                }
-
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": "Bearer " + access_token
-                }
-
-                try:
-                    response = requests.get(url, params=params, headers=headers, timeout=10)
-                    if response.status_code == 200:
-                        content = response.json().get('content')
-                        if content:
-                            amount = content[0]['amount']
-                            total = content[0]['total']
-                            print(f"Empresa {companyNumber}, Data {startdate}: Amount = {amount}, Total = {total} RSD")
-                            insert_data(connection, startdate, enddate, companyNumber, amount, total)
-                        else:
-                            print(f"Empresa {companyNumber}, Data {startdate}: Sem dados. RSD")
-                            insert_data(connection, startdate, enddate, companyNumber, 0, 0)
-                    elif response.status_code == 401:
-                        new_access_token, new_refresh_token = refresh_access_token(refresh_token)
-                        if new_access_token:
-                            access_token = new_access_token
-                            refresh_token = new_refresh_token
-                            headers["Authorization"] = "Bearer " + access_token
-                            response = requests.get(url, params=params, headers=headers, timeout=10)
-                            if response.status_code == 200:
-                                content = response.json().get('content')
-                                if content:
-                                    amount = content[0]['amount']
-                                    total = content[0]['total']
-                                    print(f"Empresa {companyNumber}, Data {startdate}: Amount = {amount}, Total = {total} RSD")
-                                    insert_data(connection, startdate, enddate, companyNumber, amount, total)
-                                else:
-                                    print(f"Empresa {companyNumber}, Data {startdate}: Sem dados. RSD")
-                                    insert_data(connection, startdate, enddate, companyNumber, 0, 0)
-                            else:
-                                print(f"Erro para a empresa {companyNumber}: {response.status_code} RSD")
-                        else:
-                            print("Falha na atualização do token. RSD")
-                    else:
-                        print(f"Erro para a empresa {companyNumber}: {response.status_code} RSD")
-                except requests.exceptions.Timeout:
-                    print(f"Timeout ao tentar obter dados para a empresa {companyNumber} RSD")
-
-    def main():
-        access_token, refresh_token, _, _, _ = get_tokens()
-
-        if not access_token or not refresh_token:
+        for _ in range(2):  # segunda tentativa só após renovar o token
+            access_token = token_manager.get_access_token()
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": "Bearer " + access_token
+            }
+
+            try:
+                response = http_client.get(url, params=params, headers=headers, timeout=10)
+            except requests.exceptions.Timeout:
+                print(f"Timeout ao tentar obter dados para a empresa {companyNumber} RSD")
+                return None
+
+            if response.status_code == 200:
+                content = response.json().get('content')
+                if content:
+                    amount = content[0]['amount']
+                    total = content[0]['total']
+                    print(f"Empresa {companyNumber}, Data {startdate}: Amount = {amount}, Total = {total} RSD")
+                    return (startdate, startdate, companyNumber, amount, total)
+                print(f"Empresa {companyNumber}, Data {startdate}: Sem dados. RSD")
+                return (startdate, startdate, companyNumber, 0, 0)
+
+            if response.status_code == 401:
+                if not token_manager.update_token(access_token):
+                    print("Falha na atualização do token. RSD")
+                    return None
+                continue
+
+            print(f"Erro para a empresa {companyNumber}: {response.status_code} RSD")
+            return None
+        return None
+
+    def main(token_manager):
+        # Reaproveitar o TokenManager do orquestrador, se houver
+        if token_manager is None:
+            token_manager = TokenManager()
+
+        if not token_manager.get_access_token():
             print("Falha na obtenção do token. RSD")
-            return
+            return False
 
-        truncate_table(connection)
+        if not connection:
+            return False
+        shadow = prepare_shadow_table(connection)
+        if not shadow:
+            return False
 
         company_numbers_str = os.getenv("COMPANY_NUMBERS_REDE")
         if company_numbers_str:
@@ -197,14 +154,36 @@ def job():
         else:
             companyNumbers = []
 
-        max_workers = os.cpu_count() - 1
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(fetch_and_insert_data, companyNumber, access_token, refresh_token, driver, server, database, user, password, port) for companyNumber in companyNumbers]
-            for future in concurrent.futures.as_completed(futures):
-                future.result()
+        # Grade (empresa, dia) inteira no mesmo executor limitado; uma única gravação no fim
+        results = run_tasks(fetch_day_summary, [
+            (companyNumber, startdate, token_manager)
+            for companyNumber in companyNumbers
+            for startdate in business_days(datetime.datetime.now())
+        ])
+        rows = [row for row in results if row is not None]
+
+        if len(rows) < len(results):
+            # Publicar uma semana parcial substituiria valores bons por lacunas
+            print(f"{len(results) - len(rows)} consultas falharam; BD_RECEBIVEIS_SEMANAL mantida como estava. RSD")
+            return False
+        if not rows:
+            print("Nenhum valor obtido; BD_RECEBIVEIS_SEMANAL mantida como estava. RSD")
+            return False
+        if not insert_data(connection, rows, shadow):
+            print("Carga da tabela sombra falhou; BD_RECEBIVEIS_SEMANAL mantida como estava. RSD")
+            return False
+        try:
+            swap_in(connection, RECEIVABLES_TABLE)
+            print(f"{len(rows)} valores publicados para {len(companyNumbers)} empresas RSD")
+            return True
+        except pyodbc.Error as e:
+            print(f"Erro ao publicar a tabela sombra; BD_RECEBIVEIS_SEMANAL mantida como estava: {e} RSD")
+            return False
 
-    main()  # Call the main function
+    result = main(token_manager)  # Call the main function
+    if connection:
+        connection.close()
+    return result
 
 if __name__ == "__main__":
     job()
\ No newline at end of file
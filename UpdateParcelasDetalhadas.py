@@ -1,8 +1,4 @@
-import requests
-import pyodbc
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
+from datetime import datetime, timedelta
 import os
 import time
 from math import ceil
@@ -10,6 +6,19 @@ import pythoncom
 from win32com.client import Dispatch
 import logging
 
+from rede_etl import http_client
+from rede_etl.bulk_writer import batch_size_from_env, varchar, write_rows
+from rede_etl.db_pool import get_pool
+from rede_etl.etl_state import get_watermark, set_watermark
+from rede_etl.fetch_engine import run_tasks
+from rede_etl.negative_cache import (
+    NEGATIVE_CACHE_TABLE, REASON_ERROR, clear_keys, failure_reason, is_blocked, load_blocked_keys,
+    record_failures, summarize
+)
+from rede_etl.processed_index import ProcessedIndex
+from rede_etl.token_manager import TokenManager
+from rede_etl.write_queue import WriteQueue
+
 """Config dotenv"""
 from dotenv import load_dotenv
 from pathlib import Path
@@ -20,68 +29,53 @@ def localizar_env(diretorio_raiz="PRIVATE_BAG.ENV"):
         if possible.exists():
             return possible
     raise FileNotFoundError(f"Arquivo .env não encontrado dentro de '{diretorio_raiz}'.")
-env_path = localizar_env()
-load_dotenv(dotenv_path=env_path)
-
-BATCH_SIZE = 150
-BATCH_LOCK = threading.Lock()
-
-class TokenManager:
-    def __init__(self):
-        self.access_token = None
-        self.refresh_token = None
-
-    def update_token(self):
-        print("Reautenticando para obter novo token...")
-        new_access_token, new_refresh_token = self.get_tokens()
-        if new_access_token:
-            self.access_token = new_access_token
-            self.refresh_token = new_refresh_token
-            print("Token atualizado com sucesso.")
-        else:
-            print("Falha ao atualizar token.")
-
-    def get_tokens(self):
-        url = os.getenv("TOKEN_URL_REDE")
-        body = {
-            "grant_type": "password",
-            "username": os.getenv("API_USERNAME_REDE"),
-            "password": os.getenv("API_PASSWORD_REDE")
-        }
-        headers = {
-            "Authorization": os.getenv("API_AUTH_HEADER_REDE"),
-        }
-
-        response = requests.post(url, data=body, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("access_token"), data.get("refresh_token")
-        else:
-            print("Erro ao obter token:", response.status_code, response.text)
-            return None, None
-
+# O orquestrador já carregou o .env antes de importar o script
+if not os.getenv("REDE_ENV_CARREGADO"):
+    env_path = localizar_env()
+    load_dotenv(dotenv_path=env_path)
+
+BATCH_SIZE = batch_size_from_env(150)
+
+# Threads gravadoras dedicadas: os workers da API só enfileiram parcelas
+WRITER_THREADS = int(os.getenv("PARCELAS_GRAVADORAS", "1"))
+
+# Modo incremental: lê só vendas com id acima da marca d'água da última execução
+INCREMENTAL_MODE = os.getenv("PARCELAS_MODO_INCREMENTAL", "1") == "1"
+WATERMARK_PROCESS = "parcelas_detalhadas_vendas"
+
+# Varredura de duplicatas na tabela inteira (manutenção; desnecessária com o MERGE)
+FULL_DEDUP = os.getenv("PARCELAS_DEDUP_COMPLETO", "0") == "1"
+
+# Cache negativo de vendas que a API devolveu sem parcelas (404, vazio ou erro)
+NEGATIVE_CACHE_PROCESS = "parcelas_venda"
+
+# Agenda de consultas de status: cada venda pendente só volta à API na próxima data prevista
+SCHEDULE_TABLE = "BD_Parcelas_Agendamento"
+STATUS_TIME_BUDGET = float(os.getenv("PARCELAS_TEMPO_LIMITE_MIN", "60")) * 60  # 0 = sem limite
+DUE_DATE_GRACE = timedelta(days=1)
+MAX_BACKOFF_DAYS = 30
+MAX_OVERDUE_BACKOFF_DAYS = 7
+# Consulta que falhou (erro de rede, 5xx, resposta inválida) volta logo, sem contar como "sem mudança"
+FAILED_RETRY_DELAY = timedelta(hours=float(os.getenv("PARCELAS_NOVA_TENTATIVA_HORAS", "1")))
+
+# Tipos dos parâmetros do INSERT em BD_Parcelas_Detalhadas (None = tipo decidido pelo driver)
+INSTALLMENTS_INPUT_SIZES = [
+    None, None, varchar(10), None, None,
+    None, None, None, None, None, None,
+    None, varchar(), varchar(), varchar(30), varchar(), None, varchar()
+]
 
 def create_database_connection():
-    connection_string = (
-        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-        f"SERVER={os.getenv('DB_SERVER_EXCEL')},{os.getenv('DB_PORT_EXCEL')};"
-        f"DATABASE={os.getenv('DB_DATABASE_EXCEL')};"
-        f"UID={os.getenv('DB_USER_EXCEL')};"
-        f"PWD={os.getenv('DB_PASSWORD_EXCEL')}"
-    )
+    """Conexão do pool compartilhado; close() a devolve ao pool."""
     try:
-        conn = pyodbc.connect(connection_string)
-        return conn
+        return get_pool().acquire()
     except Exception as e:
         print(f"Erro ao conectar ao banco de dados: {e}")
         return None
 
 
-def remove_duplicate_rows():
-    conn = create_database_connection()
-    if not conn:
-        return
-
+def remove_duplicate_rows(conn):
+    """Remove duplicatas pela chave natural usando a conexão de quem chamou."""
     cursor = conn.cursor()
     try:
         print("Removendo linhas duplicadas...")
@@ -101,35 +95,100 @@ def remove_duplicate_rows():
         conn.commit()
         print("Linhas duplicadas removidas com sucesso.")
     except Exception as e:
+        conn.rollback()
         print(f"Erro ao remover linhas duplicadas: {e}")
-    finally:
-        conn.close()
 
 
 def load_processed_sales():
+    """Sincroniza e retorna o índice em disco das vendas (NSU, merchantId) já processadas."""
+    processed_sales = ProcessedIndex()
     conn = create_database_connection()
     if not conn:
-        return set()
+        return processed_sales
 
     cursor = conn.cursor()
-    query = "SELECT NSU, merchantId FROM BD_Parcelas_Detalhadas"
     try:
-        print("Carregando vendas já processadas em memória...")
-        cursor.execute(query)
-        processed_sales = set((row.NSU, row.merchantId) for row in cursor.fetchall())
-        print(f"Total de vendas já processadas carregadas: {len(processed_sales)}")
-        return processed_sales
+        print("Sincronizando índice de vendas já processadas...")
+        new_keys = processed_sales.sync(cursor)
+        print(f"Índice sincronizado: {new_keys} novas vendas, {len(processed_sales)} no total.")
     except Exception as e:
-        print(f"Erro ao carregar vendas processadas: {e}")
-        return set()
+        print(f"Erro ao sincronizar índice de vendas processadas: {e}")
     finally:
         conn.close()
+    return processed_sales
+
+
+def load_pending_sales(cursor, watermark):
+    """
+    Vendas parceladas carregadas após a marca d'água e que ainda não têm
+    parcelas em BD_Parcelas_Detalhadas. O filtro roda no servidor, então o
+    custo acompanha o volume de vendas novas e não o histórico.
+    """
+    print(f"Consultando vendas novas (id > {watermark})...")
+    query = """
+        SELECT MAX(VR.id) AS id, VR.NSU, VR.Numero_Empresa, MIN(VR.Data_Venda) AS Data_Venda
+        FROM BD_Vendas_Rede VR
+        WHERE VR.Parcelas <> 0
+          AND VR.id > ?
+          AND NOT EXISTS (
+              SELECT 1
+              FROM BD_Parcelas_Detalhadas PD
+              WHERE PD.NSU = VR.NSU AND PD.merchantId = VR.Numero_Empresa
+          )
+        GROUP BY VR.NSU, VR.Numero_Empresa
+    """
+    cursor.execute(query, (watermark,))
+    return cursor.fetchall()
+
+
+def load_retry_sales(cursor):
+    """
+    Vendas do cache negativo cujo intervalo de nova consulta já venceu e que
+    continuam sem parcelas, no mesmo formato de load_pending_sales.
+    """
+    query = f"""
+        SELECT MAX(VR.id) AS id, VR.NSU, VR.Numero_Empresa, MIN(VR.Data_Venda) AS Data_Venda
+        FROM BD_Vendas_Rede VR
+        JOIN {NEGATIVE_CACHE_TABLE} N
+          ON N.Processo = ?
+         AND N.Merchant = CAST(VR.Numero_Empresa AS VARCHAR(50))
+         AND N.Chave = CAST(VR.NSU AS VARCHAR(100))
+        WHERE VR.Parcelas <> 0
+          AND N.ProximaTentativa <= GETDATE()
+          AND NOT EXISTS (
+              SELECT 1
+              FROM BD_Parcelas_Detalhadas PD
+              WHERE PD.NSU = VR.NSU AND PD.merchantId = VR.Numero_Empresa
+          )
+        GROUP BY VR.NSU, VR.Numero_Empresa
+    """
+    cursor.execute(query, (NEGATIVE_CACHE_PROCESS,))
+    return cursor.fetchall()
+
+
+def next_watermark(watermark, sales, results):
+    """
+    Nova marca d'água após a execução: o maior id lido. Vendas que ficaram sem
+    parcelas vão para o cache negativo e voltam por lá, então não seguram a
+    marca d'água. None indica falha de gravação.
+    """
+    if any(result is None for result in results):
+        return None
+    return max([watermark] + [row.id for row in sales])
 
 
 def fetch_installments(merchant_id, nsu, sale_date, token_manager):
+    """Resposta da API de parcelas da venda, ou None se a consulta falhou."""
+    status_code, data = fetch_installments_with_status(merchant_id, nsu, sale_date, token_manager)
+    return data if status_code == 200 else None
+
+
+def fetch_installments_with_status(merchant_id, nsu, sale_date, token_manager):
+    """Retorna (status HTTP, JSON); status None indica erro de conexão."""
     url = f"https://api.userede.com.br/redelabs/merchant-statement/v2/payments/installments/{merchant_id}"
+    access_token = token_manager.get_access_token()
     headers = {
-        "Authorization": f"Bearer {token_manager.access_token}",
+        "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json"
     }
     params = {
@@ -138,66 +197,314 @@ def fetch_installments(merchant_id, nsu, sale_date, token_manager):
     }
 
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = http_client.get(url, headers=headers, params=params)
         if response.status_code == 401:
             print("Token expirado. Tentando atualizar...")
-            token_manager.update_token()
-            headers["Authorization"] = f"Bearer {token_manager.access_token}"
-            response = requests.get(url, headers=headers, params=params)
+            access_token = token_manager.update_token(access_token)
+            headers["Authorization"] = f"Bearer {access_token}"
+            response = http_client.get(url, headers=headers, params=params)
         if response.status_code == 200:
-            return response.json()
+            return response.status_code, response.json()
         else:
             print(f"Erro na API para Merchant ID {merchant_id}, NSU {nsu}: {response.status_code}")
-            return None
+            return response.status_code, None
     except Exception as e:
         print(f"Erro ao conectar na API para NSU {nsu}: {e}")
-        return None
+        return None, None
+
+
+INSTALLMENT_COLUMNS = [
+    "NSU", "merchantId", "saleDate", "installmentNumber", "installmentQuantity",
+    "saleAmount", "netAmount", "discountAmount", "flexFee", "mdrAmount", "feeTotal",
+    "authorizationCode", "brand", "cardNumber", "expirationDate", "status", "paymentId", "detalHash"
+]
+INSTALLMENT_KEY = ["NSU", "merchantId", "installmentNumber"]
+
+
+def ensure_installments_unique_index(conn):
+    """
+    Garante o índice único na chave natural (NSU, merchantId, installmentNumber).
+    Na primeira vez, remove as duplicatas existentes antes de criar o índice.
+    Usa a conexão de quem chamou, sem pegar outra do pool.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT 1 FROM sys.indexes
+            WHERE name = 'UX_Parcelas_Detalhadas_Chave'
+              AND object_id = OBJECT_ID('BD_Parcelas_Detalhadas')
+        """)
+        if cursor.fetchone():
+            return
+        print("Criando índice único na chave natural de BD_Parcelas_Detalhadas...")
+        remove_duplicate_rows(conn)
+        cursor.execute("""
+            CREATE UNIQUE INDEX UX_Parcelas_Detalhadas_Chave
+            ON BD_Parcelas_Detalhadas (NSU, merchantId, installmentNumber)
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao criar índice único de parcelas: {e}")
 
 
 def insert_installments(batch):
+    """
+    Grava o batch de forma idempotente: bulk insert em #StagingParcelas e um
+    MERGE pela chave natural, que atualiza parcelas existentes e insere as
+    novas. Duplicatas dentro do próprio batch são descartadas no MERGE.
+    """
     conn = create_database_connection()
     if not conn:
-        return
+        return False
 
     cursor = conn.cursor()
-    query = """
-        INSERT INTO BD_Parcelas_Detalhadas (
-            NSU, merchantId, saleDate, installmentNumber, installmentQuantity, 
-            saleAmount, netAmount, discountAmount, flexFee, mdrAmount, feeTotal,
-            authorizationCode, brand, cardNumber, expirationDate, status, paymentId, detalHash
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    columns = ", ".join(INSTALLMENT_COLUMNS)
+    staging_insert = f"""
+        INSERT INTO #StagingParcelas ({columns})
+        VALUES ({", ".join("?" for _ in INSTALLMENT_COLUMNS)})
+    """
+    merge_query = f"""
+        MERGE BD_Parcelas_Detalhadas AS alvo
+        USING (
+            SELECT {columns}
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY NSU, merchantId, installmentNumber ORDER BY (SELECT NULL)
+                ) AS rn
+                FROM #StagingParcelas
+            ) AS s
+            WHERE rn = 1
+        ) AS origem
+            ON {" AND ".join(f"alvo.{c} = origem.{c}" for c in INSTALLMENT_KEY)}
+        WHEN MATCHED THEN
+            UPDATE SET {", ".join(f"{c} = origem.{c}" for c in INSTALLMENT_COLUMNS if c not in INSTALLMENT_KEY)}
+        WHEN NOT MATCHED THEN
+            INSERT ({columns})
+            VALUES ({", ".join(f"origem.{c}" for c in INSTALLMENT_COLUMNS)});
     """
     try:
-        cursor.executemany(query, batch)
+        cursor.execute("IF OBJECT_ID('tempdb..#StagingParcelas') IS NOT NULL DROP TABLE #StagingParcelas")
+        cursor.execute(f"SELECT TOP 0 {columns} INTO #StagingParcelas FROM BD_Parcelas_Detalhadas")
+        write_rows(cursor, staging_insert, list(batch), INSTALLMENTS_INPUT_SIZES, commit=False)
+        cursor.execute(merge_query)
+        cursor.execute("DROP TABLE #StagingParcelas")
         conn.commit()
-        print(f"Batch com {len(batch)} parcelas inserido com sucesso no banco de dados.")
+        print(f"Batch com {len(batch)} parcelas gravado com sucesso no banco de dados.")
+        return True
     except Exception as e:
+        conn.rollback()
         print(f"Erro ao inserir batch no banco de dados: {e}")
+        return False
     finally:
         conn.close()
 
 
-def update_installments_status():
+def installments_writer(processed_sales):
+    """
+    Callback do WriteQueue: grava o batch e, só depois do commit, marca as
+    vendas do batch como processadas.
+    """
+    def write_batch(batch):
+        if not insert_installments(batch):
+            return False
+        for row in batch:
+            processed_sales.add((row[0], row[1]))
+        return True
+    return write_batch
+
+
+def create_status_staging_table(conn, cursor):
+    # Mesmos tipos das colunas de destino, para o join não precisar de conversões.
+    # A conexão vem do pool e pode já ter a tabela de uma execução anterior.
+    cursor.execute("IF OBJECT_ID('tempdb..#StatusParcelas') IS NOT NULL DROP TABLE #StatusParcelas")
+    cursor.execute("""
+        SELECT TOP 0 NSU, merchantId, installmentNumber, status
+        INTO #StatusParcelas
+        FROM BD_Parcelas_Detalhadas
+    """)
+    # Commit próprio: criada dentro da transação de um lote, um rollback a descartaria
+    conn.commit()
+
+
+def apply_status_updates(conn, cursor, statuses):
+    """
+    Grava os status retornados pela API na tabela temporária via bulk insert e
+    aplica todas as mudanças com um único UPDATE ... FROM. Retorna as chaves
+    (NSU, merchantId) de cada parcela cujo status realmente mudou, ou None se
+    o lote não pôde ser gravado.
+    """
+    if not statuses:
+        return []
+    try:
+        write_rows(cursor, """
+            INSERT INTO #StatusParcelas (NSU, merchantId, installmentNumber, status)
+            VALUES (?, ?, ?, ?)
+        """, statuses, commit=False)
+        cursor.execute("""
+            UPDATE PD
+            SET status = S.status
+            OUTPUT inserted.NSU, inserted.merchantId
+            FROM BD_Parcelas_Detalhadas PD
+            JOIN #StatusParcelas S
+              ON PD.NSU = S.NSU
+             AND PD.merchantId = S.merchantId
+             AND PD.installmentNumber = S.installmentNumber
+            WHERE ISNULL(PD.status, '') <> ISNULL(S.status, '')
+        """)
+        changed = [tuple(row) for row in cursor.fetchall()]
+        cursor.execute("TRUNCATE TABLE #StatusParcelas")
+        conn.commit()
+        return changed
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao aplicar atualização de status em lote: {e}")
+        # Recria a tabela vazia para os próximos lotes
+        create_status_staging_table(conn, cursor)
+        return None
+
+
+def ensure_schedule_table(cursor):
+    """Cria a agenda de consultas com os mesmos tipos de chave de BD_Parcelas_Detalhadas."""
+    cursor.execute(f"""
+        IF OBJECT_ID('{SCHEDULE_TABLE}', 'U') IS NULL
+            SELECT TOP 0 NSU, merchantId, saleDate INTO {SCHEDULE_TABLE} FROM BD_Parcelas_Detalhadas
+    """)
+    cursor.execute(f"""
+        IF COL_LENGTH('{SCHEDULE_TABLE}', 'ProximaConsulta') IS NULL
+            ALTER TABLE {SCHEDULE_TABLE} ADD
+                ProximaConsulta DATETIME NOT NULL,
+                ConsultasSemMudanca INT NOT NULL DEFAULT 0,
+                AtualizadoEm DATETIME NOT NULL DEFAULT GETDATE()
+    """)
+    cursor.execute(f"""
+        IF NOT EXISTS (
+            SELECT 1 FROM sys.indexes
+            WHERE name = 'UX_{SCHEDULE_TABLE}_Chave' AND object_id = OBJECT_ID('{SCHEDULE_TABLE}')
+        )
+            CREATE UNIQUE INDEX UX_{SCHEDULE_TABLE}_Chave ON {SCHEDULE_TABLE} (NSU, merchantId, saleDate)
+    """)
+    # Vendas que não têm mais parcelas pendentes saem da agenda
+    cursor.execute(f"""
+        DELETE A FROM {SCHEDULE_TABLE} A
+        WHERE NOT EXISTS (
+            SELECT 1 FROM BD_Parcelas_Detalhadas PD
+            WHERE PD.NSU = A.NSU AND PD.merchantId = A.merchantId
+              AND PD.status NOT IN ('PAID', 'ANTICIPATED')
+        )
+    """)
+
+
+def load_due_installments(cursor):
+    """
+    Vendas com parcelas pendentes cuja próxima consulta já venceu (ou que nunca
+    foram agendadas), as mais atrasadas primeiro. Cada linha traz
+    (NSU, merchantId, saleDate, vencimento mais próximo, consultas sem mudança).
+    """
+    cursor.execute(f"""
+        SELECT P.NSU, P.merchantId, P.saleDate, P.dueDate, ISNULL(A.ConsultasSemMudanca, 0)
+        FROM (
+            SELECT NSU, merchantId, saleDate, MIN(expirationDate) AS dueDate
+            FROM BD_Parcelas_Detalhadas
+            WHERE status NOT IN ('PAID', 'ANTICIPATED')
+            GROUP BY NSU, merchantId, saleDate
+        ) P
+        LEFT JOIN {SCHEDULE_TABLE} A
+          ON A.NSU = P.NSU AND A.merchantId = P.merchantId AND A.saleDate = P.saleDate
+        WHERE A.ProximaConsulta IS NULL OR A.ProximaConsulta <= GETDATE()
+        ORDER BY ISNULL(A.ProximaConsulta, '19000101'), P.dueDate
+    """)
+    return cursor.fetchall()
+
+
+def parse_due_date(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def next_check_time(now, due_date, unchanged_polls, failed=False):
+    """
+    Próxima consulta de uma venda. O intervalo dobra a cada consulta sem
+    mudança de status (1, 2, 4... até 30 dias), mas uma parcela a vencer é
+    sempre consultada no dia seguinte ao vencimento; depois do vencimento, no
+    máximo uma semana de intervalo. Uma consulta que falhou é repetida depois
+    de FAILED_RETRY_DELAY.
+    """
+    if failed:
+        return now + FAILED_RETRY_DELAY
+    backoff = timedelta(days=min(2 ** unchanged_polls, MAX_BACKOFF_DAYS))
+    if due_date and due_date > now:
+        return min(due_date + DUE_DATE_GRACE, now + backoff)
+    return now + min(backoff, timedelta(days=MAX_OVERDUE_BACKOFF_DAYS))
+
+
+def save_schedule(conn, cursor, entries):
+    """Grava (NSU, merchantId, saleDate, ProximaConsulta, ConsultasSemMudanca) na agenda via MERGE."""
+    if not entries:
+        return
+    try:
+        cursor.execute("IF OBJECT_ID('tempdb..#AgendaParcelas') IS NOT NULL DROP TABLE #AgendaParcelas")
+        cursor.execute(f"""
+            SELECT TOP 0 NSU, merchantId, saleDate, ProximaConsulta, ConsultasSemMudanca
+            INTO #AgendaParcelas
+            FROM {SCHEDULE_TABLE}
+        """)
+        write_rows(cursor, """
+            INSERT INTO #AgendaParcelas (NSU, merchantId, saleDate, ProximaConsulta, ConsultasSemMudanca)
+            VALUES (?, ?, ?, ?, ?)
+        """, entries, commit=False)
+        cursor.execute(f"""
+            MERGE {SCHEDULE_TABLE} AS alvo
+            USING #AgendaParcelas AS origem
+                ON alvo.NSU = origem.NSU AND alvo.merchantId = origem.merchantId
+               AND alvo.saleDate = origem.saleDate
+            WHEN MATCHED THEN
+                UPDATE SET ProximaConsulta = origem.ProximaConsulta,
+                           ConsultasSemMudanca = origem.ConsultasSemMudanca,
+                           AtualizadoEm = GETDATE()
+            WHEN NOT MATCHED THEN
+                INSERT (NSU, merchantId, saleDate, ProximaConsulta, ConsultasSemMudanca)
+                VALUES (origem.NSU, origem.merchantId, origem.saleDate,
+                        origem.ProximaConsulta, origem.ConsultasSemMudanca);
+        """)
+        cursor.execute("DROP TABLE #AgendaParcelas")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao gravar agenda de consultas: {e}")
+
+
+def update_installments_status(token_manager=None):
+    """
+    Atualiza o status das parcelas pendentes cuja consulta está agendada para
+    agora, mais atrasadas primeiro, até esgotar PARCELAS_TEMPO_LIMITE_MIN. O
+    que sobrar continua vencido na agenda e entra na próxima execução.
+    Retorna quantas parcelas mudaram de status.
+    """
     conn = create_database_connection()
     if not conn:
-        return
+        return 0
 
     cursor = conn.cursor()
+    total_updated = 0
+    started = time.time()
     try:
-        print("Buscando parcelas pendentes para atualização...")
-        query = """
-            SELECT DISTINCT NSU, merchantId, saleDate
-            FROM BD_Parcelas_Detalhadas
-            WHERE status NOT IN ('PAID', 'ANTICIPATED')
-        """
-        cursor.execute(query)
-        pending_installments = cursor.fetchall()
+        print("Buscando parcelas pendentes com consulta agendada...")
+        ensure_schedule_table(cursor)
+        conn.commit()
+        pending_installments = load_due_installments(cursor)
+        create_status_staging_table(conn, cursor)
 
-        # Inicializar o TokenManager
-        token_manager = TokenManager()
-        token_manager.update_token()
+        # Reaproveitar o TokenManager da execução, se houver
+        if token_manager is None:
+            token_manager = TokenManager()
+            token_manager.update_token()
 
-        print(f"Encontradas {len(pending_installments)} parcelas pendentes para atualização.")
+        print(f"Encontradas {len(pending_installments)} vendas com parcelas pendentes a consultar.")
 
         # Dividir os registros em batches
         total_batches = ceil(len(pending_installments) / BATCH_SIZE)
@@ -207,131 +514,129 @@ def update_installments_status():
         total_time_spent = 0
 
         for batch_start in range(0, len(pending_installments), BATCH_SIZE):
-                    # Obter o lote atual
-                    batch = pending_installments[batch_start:batch_start + BATCH_SIZE]
-
-                    # Medir o tempo de processamento do batch
-                    batch_start_time = time.time()
-
-                    # Processar o batch com threads
-                    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-                        futures = [
-                            executor.submit(update_single_installment, row, token_manager)
-                            for row in batch
-                        ]
-                        for future in as_completed(futures):
-                            try:
-                                future.result()
-                            except Exception as e:
-                                print(f"Erro ao atualizar uma parcela: {e}")
-
-                    batch_end_time = time.time()
-                    batch_time = batch_end_time - batch_start_time
-                    total_time_spent += batch_time
-                    processed_batches += 1
-
-                    # Calcular o tempo médio real até agora
-                    avg_time_per_batch = total_time_spent / processed_batches
-
-                    # Calcular o tempo restante com base nos batches restantes
-                    remaining_batches = total_batches - processed_batches
-                    estimated_remaining_time = avg_time_per_batch * remaining_batches
-
-                    # Exibir informações sobre o batch e estimativa
-                    print(f"Batch {processed_batches}/{total_batches} processado em {batch_time:.2f} segundos.")
-                    print(f"Estimativa de tempo restante: {estimated_remaining_time / 60:.2f} minutos.")
+            if STATUS_TIME_BUDGET and time.time() - started >= STATUS_TIME_BUDGET:
+                remaining = len(pending_installments) - batch_start
+                print(f"Tempo limite atingido; {remaining} vendas ficam para a próxima execução.")
+                break
+
+            # Obter o lote atual
+            batch = pending_installments[batch_start:batch_start + BATCH_SIZE]
+
+            # Medir o tempo de processamento do batch
+            batch_start_time = time.time()
+
+            # Buscar os status no motor assíncrono e aplicar tudo de uma vez
+            results = run_tasks(update_single_installment, [(row[:3], token_manager) for row in batch])
+            statuses = [status for result in results if result for status in result]
+            changed = apply_status_updates(conn, cursor, statuses)
+            if changed is None:
+                # Nada foi gravado: o lote inteiro conta como falha de consulta
+                results = [None] * len(batch)
+                changed = []
+            total_updated += len(changed)
+
+            # Reagendar: quem mudou volta ao intervalo mínimo, quem não mudou espera mais e
+            # quem falhou mantém a contagem e tenta de novo em breve
+            changed_sales = set(changed)
+            now = datetime.now()
+            schedule = []
+            for (nsu, merchant_id, sale_date, due_date, unchanged), result in zip(batch, results):
+                failed = result is None
+                if (nsu, merchant_id) in changed_sales:
+                    unchanged = 0
+                elif not failed:
+                    unchanged += 1
+                schedule.append((nsu, merchant_id, sale_date,
+                                 next_check_time(now, parse_due_date(due_date), unchanged, failed), unchanged))
+            save_schedule(conn, cursor, schedule)
+
+            batch_end_time = time.time()
+            batch_time = batch_end_time - batch_start_time
+            total_time_spent += batch_time
+            processed_batches += 1
+
+            # Calcular o tempo médio real até agora
+            avg_time_per_batch = total_time_spent / processed_batches
+
+            # Calcular o tempo restante com base nos batches restantes
+            remaining_batches = total_batches - processed_batches
+            estimated_remaining_time = avg_time_per_batch * remaining_batches
+
+            # Exibir informações sobre o batch e estimativa
+            print(f"Batch {processed_batches}/{total_batches} processado em {batch_time:.2f} segundos "
+                  f"({len(changed)} parcelas atualizadas).")
+            print(f"Estimativa de tempo restante: {estimated_remaining_time / 60:.2f} minutos.")
 
     except Exception as e:
         print(f"Erro ao buscar parcelas pendentes: {e}")
     finally:
         conn.close()
+    return total_updated
 
 
 def update_single_installment(row, token_manager):
+    """
+    Consulta a API e retorna (NSU, merchantId, installmentNumber, status) de
+    cada parcela da venda, ou None se a consulta falhou.
+    """
     nsu, merchant_id, sale_date = row
     response = fetch_installments(merchant_id, nsu, sale_date, token_manager)
     if response and "content" in response and "installments" in response["content"]:
-        installments = response["content"]["installments"]
-        conn = create_database_connection()
-        if not conn:
-            return
-        cursor = conn.cursor()
-        try:
-            for installment in installments:
-                status = installment.get("status")
-                installment_number = installment.get("installmentNumber", 0)
-
-                # Verificar o status atual no banco
-                select_query = """
-                    SELECT status
-                    FROM BD_Parcelas_Detalhadas
-                    WHERE NSU = ? AND merchantId = ? AND installmentNumber = ?
-                """
-                cursor.execute(select_query, (nsu, merchant_id, installment_number))
-                current_status = cursor.fetchone()
-
-                # Atualizar somente se o status for diferente
-                if current_status and current_status[0] != status:
-                    update_query = """
-                        UPDATE BD_Parcelas_Detalhadas
-                        SET status = ?
-                        WHERE NSU = ? AND merchantId = ? AND installmentNumber = ?
-                    """
-                    cursor.execute(update_query, (
-                        status,
-                        nsu,
-                        merchant_id,
-                        installment_number
-                    ))
-                    conn.commit()
-                    print(f"Atualizado: NSU {nsu}, Merchant ID {merchant_id}, Parcela {installment_number} para status {status}.")
-        except Exception as e:
-            print(f"Erro ao atualizar parcelas para NSU {nsu}: {e}")
-        finally:
-            conn.close()
+        return [
+            (nsu, merchant_id, installment.get("installmentNumber", 0), installment.get("status"))
+            for installment in response["content"]["installments"]
+        ]
+    return None
 
 
-def process_single_sale(row, token_manager, batch, processed_sales):
+def process_single_sale(row, token_manager, writer, processed_sales, failures):
+    """
+    Busca as parcelas de uma venda e as enfileira no `writer`, que grava em
+    lotes numa thread própria (put bloqueia se o banco ficar para trás) e
+    marca a venda em `processed_sales` depois do commit.
+    Retorna True se a venda ficou resolvida e False se a API não trouxe
+    parcelas (a falha vai para `failures`, destino do cache negativo).
+    """
     nsu = row.NSU
     merchant_id = row.Numero_Empresa
 
     if (nsu, merchant_id) in processed_sales:
         print(f"Venda NSU {nsu}, Merchant ID {merchant_id} já processada. Ignorando...")
-        return
+        return True
 
     try:
         sale_date = datetime.strptime(row.Data_Venda, "%Y-%m-%d").strftime("%Y-%m-%d")
     except ValueError as e:
         print(f"Erro ao converter Data_Venda para NSU {nsu}: {e}")
-        return
+        failures.append((merchant_id, nsu, REASON_ERROR))
+        return False
 
-    api_response = fetch_installments(merchant_id, nsu, sale_date, token_manager)
-    if api_response and "content" in api_response and "installments" in api_response["content"]:
+    status_code, api_response = fetch_installments_with_status(merchant_id, nsu, sale_date, token_manager)
+    reason = failure_reason(status_code, api_response)
+    if reason is None:
         installments = api_response["content"]["installments"]
 
-        with BATCH_LOCK:
-            for installment in installments:
-                amount_info = installment.get("amountInfo", {})
-                batch.append((nsu, merchant_id, sale_date,
-                            installment.get("installmentNumber", 0),
-                            installment.get("installmentQuantity", 0),
-                            amount_info.get("amount", 0.0),
-                            amount_info.get("netAmount", 0.0),
-                            amount_info.get("discountAmount", 0.0),
-                            installment.get("flexFee", 0.0),
-                            installment.get("mdrAmount", 0.0),
-                            installment.get("feeTotal", 0.0),
-                            installment.get("authorizationCode", None),
-                            installment.get("brand", None),
-                            installment.get("cardNumber", None),
-                            installment.get("expirationDate", None),
-                            installment.get("status", None),
-                            installment.get("paymentId", None),
-                            installment.get("detaillHash", None)))
-
-            if len(batch) >= BATCH_SIZE:
-                insert_installments(batch)
-                batch.clear()
+        for installment in installments:
+            amount_info = installment.get("amountInfo", {})
+            writer.put((nsu, merchant_id, sale_date,
+                        installment.get("installmentNumber", 0),
+                        installment.get("installmentQuantity", 0),
+                        amount_info.get("amount", 0.0),
+                        amount_info.get("netAmount", 0.0),
+                        amount_info.get("discountAmount", 0.0),
+                        installment.get("flexFee", 0.0),
+                        installment.get("mdrAmount", 0.0),
+                        installment.get("feeTotal", 0.0),
+                        installment.get("authorizationCode", None),
+                        installment.get("brand", None),
+                        installment.get("cardNumber", None),
+                        installment.get("expirationDate", None),
+                        installment.get("status", None),
+                        installment.get("paymentId", None),
+                        installment.get("detaillHash", None)))
+        return True
+    failures.append((merchant_id, nsu, reason))
+    return False
 
 
 def setup_logging():
@@ -369,76 +674,122 @@ def send_completion_email(total_processed_sales, total_new_rows_inserted, total_
         # Clear the log file
         open(log_file, 'w').close()
 
-def process_sales():
+def process_sales(token_manager=None):
     start_time = time.time()
     log_file = setup_logging()
     conn = create_database_connection()
     if not conn:
-        return
+        return False
 
-    cursor = conn.cursor()
-
-    # Remover linhas duplicadas no início
-    remove_duplicate_rows()
-
-    # Inicializar o TokenManager
-    token_manager = TokenManager()
-    token_manager.update_token()
-    if not token_manager.access_token:
-        print("Erro ao obter token. Processo encerrado.")
-        return
-
-    # Carregar vendas já processadas
-    processed_sales = load_processed_sales()
-
-    # Selecionar apenas vendas pendentes (não processadas)
-    print("Consultando dados da tabela de vendas...")
-    query = """
-        SELECT VR.NSU, VR.Numero_Empresa, VR.Data_Venda
-        FROM BD_Vendas_Rede VR
-        WHERE VR.Parcelas <> 0;
-    """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-
-    # Filtrar apenas vendas não processadas
-    pending_sales = [
-        row for row in rows if (row.NSU, row.Numero_Empresa) not in processed_sales
-    ]
-
-    print(f"Total de vendas encontradas: {len(rows)}")
-    print(f"Total de vendas pendentes para processamento: {len(pending_sales)}")
-
-    batch = []
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        futures = [
-            executor.submit(process_single_sale, row, token_manager, batch, processed_sales)
-            for row in pending_sales
-        ]
-
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                print(f"Erro durante o processamento de uma venda: {e}")
-
-    # Inserir o restante do batch, se existir
-    if batch:
-        insert_installments(batch)
-
-    # Atualizar parcelas com status pendente
-    pending_installments = update_installments_status()
+    # A conexão vem do pool; devolvê-la em qualquer saída
+    try:
+        cursor = conn.cursor()
 
-    # Remover linhas duplicadas no final
-    remove_duplicate_rows()
+        # Inserções são idempotentes (índice único + MERGE); a varredura completa de
+        # duplicatas virou manutenção opcional
+        ensure_installments_unique_index(conn)
+        if FULL_DEDUP:
+            remove_duplicate_rows(conn)
 
-    total_processed_sales = len(rows)
-    total_new_rows_inserted = len(pending_sales)
-    total_updated_installments = len(pending_installments)
-    total_time = time.time() - start_time
+        # Inicializar o TokenManager (ou reaproveitar o do orquestrador)
+        if token_manager is None:
+            token_manager = TokenManager()
+            token_manager.update_token()
+        if not token_manager.access_token:
+            print("Erro ao obter token. Processo encerrado.")
+            return False
+
+        # O modo incremental já exclui as processadas no servidor (anti-join); o índice
+        # em disco só é sincronizado para a varredura completa
+        processed_sales = set() if INCREMENTAL_MODE else load_processed_sales()
+
+        # Vendas que voltaram sem parcelas recentemente não são consultadas até o próximo intervalo
+        blocked = load_blocked_keys(cursor, NEGATIVE_CACHE_PROCESS)
+
+        if INCREMENTAL_MODE:
+            # Vendas novas desde a última execução, já sem as processadas (anti-join no servidor)
+            watermark = get_watermark(cursor, WATERMARK_PROCESS)
+            rows = load_pending_sales(cursor, watermark)
+            pending_sales = [row for row in rows if not is_blocked(blocked, row.Numero_Empresa, row.NSU)]
+        else:
+            # Selecionar apenas vendas pendentes (não processadas)
+            print("Consultando dados da tabela de vendas...")
+            query = """
+                SELECT VR.NSU, VR.Numero_Empresa, VR.Data_Venda
+                FROM BD_Vendas_Rede VR
+                WHERE VR.Parcelas <> 0;
+            """
+            cursor.execute(query)
+            rows = cursor.fetchall()
+
+            # Filtrar apenas vendas não processadas
+            pending_sales = [
+                row for row in rows
+                if (row.NSU, row.Numero_Empresa) not in processed_sales
+                and not is_blocked(blocked, row.Numero_Empresa, row.NSU)
+            ]
+
+        # Vendas do cache negativo com nova consulta vencida
+        pending_keys = {(row.NSU, row.Numero_Empresa) for row in pending_sales}
+        retry_sales = [row for row in load_retry_sales(cursor) if (row.NSU, row.Numero_Empresa) not in pending_keys]
+        retry_keys = {(row.NSU, row.Numero_Empresa) for row in retry_sales}
+        pending_sales = pending_sales + retry_sales
+
+        print(f"Total de vendas encontradas: {len(rows)}")
+        print(f"Total de vendas pendentes para processamento: {len(pending_sales)} "
+              f"({len(retry_sales)} novas consultas do cache negativo)")
+
+        failures = []
+        writer = WriteQueue(installments_writer(processed_sales), BATCH_SIZE, workers=WRITER_THREADS)
+        try:
+            results = run_tasks(process_single_sale, [
+                (row, token_manager, writer, processed_sales, failures) for row in pending_sales
+            ])
+        finally:
+            # Grava o que ficou na fila e espera as gravadoras terminarem
+            writer.close()
+        flushed = writer.failed == 0
+        print(f"Parcelas gravadas: {writer.written} (falhas: {writer.failed}).")
 
-    print("Processamento concluído.")
-    send_completion_email(total_processed_sales, total_new_rows_inserted, total_updated_installments, total_time, log_file)
+        # Atualizar o cache negativo: falhas ganham um novo intervalo, quem voltou a responder sai
+        try:
+            record_failures(cursor, NEGATIVE_CACHE_PROCESS, failures)
+            if flushed:
+                clear_keys(cursor, NEGATIVE_CACHE_PROCESS, [
+                    (row.Numero_Empresa, row.NSU)
+                    for row, result in zip(pending_sales, results)
+                    if result and (row.NSU, row.Numero_Empresa) in retry_keys
+                ])
+            conn.commit()
+            print(f"Vendas sem parcelas registradas no cache negativo: {summarize(failures)}")
+        except Exception as e:
+            conn.rollback()
+            # Sem o registro no cache negativo as falhas só voltam pela marca d'água
+            flushed = False
+            print(f"Erro ao atualizar o cache negativo: {e}")
+
+        if INCREMENTAL_MODE:
+            # Todas as vendas lidas (inclusive as bloqueadas no cache negativo) avançam a marca d'água
+            new_watermark = next_watermark(watermark, rows, results) if flushed else None
+            if new_watermark is None:
+                print("Falha ao gravar parcelas ou o cache negativo; marca d'água mantida para reprocessar as vendas.")
+            elif new_watermark != watermark:
+                set_watermark(cursor, WATERMARK_PROCESS, new_watermark)
+                conn.commit()
+                print(f"Marca d'água de vendas atualizada: {watermark} -> {new_watermark}")
+
+        # Atualizar parcelas com status pendente
+        total_updated_installments = update_installments_status(token_manager)
+
+        total_processed_sales = len(rows)
+        total_new_rows_inserted = len(pending_sales)
+        total_time = time.time() - start_time
+
+        print("Processamento concluído.")
+        send_completion_email(total_processed_sales, total_new_rows_inserted, total_updated_installments, total_time, log_file)
+        return flushed
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     process_sales()
\ No newline at end of file
@@ -1,10 +1,19 @@
-import requests
-import pyodbc
 from datetime import datetime, timedelta
-from concurrent.futures import ProcessPoolExecutor
 import os
 from calendar import monthrange
 
+from rede_etl import http_client
+from rede_etl.bulk_writer import batch_size_from_env, varchar
+from rede_etl.db_pool import get_pool
+from rede_etl.etl_state import (
+    checkpoint_key, clear_checkpoint, ensure_checkpoint_table, get_checkpoint, set_checkpoint
+)
+from rede_etl.fetch_engine import run_tasks
+from rede_etl.reconcile import clear_staging_slice, prepare_staging, reconcile_period
+from rede_etl.response_cache import split_settled_period
+from rede_etl.row_hash import ensure_row_hash_column, insert_new_rows, row_hash
+from rede_etl.token_manager import TokenManager
+
 """Config dotenv"""
 from dotenv import load_dotenv
 from pathlib import Path
@@ -15,168 +24,223 @@ def localizar_env(diretorio_raiz="PRIVATE_BAG.ENV"):
         if possible.exists():
             return possible
     raise FileNotFoundError(f"Arquivo .env não encontrado dentro de '{diretorio_raiz}'.")
-env_path = localizar_env()
-load_dotenv(dotenv_path=env_path)
-
-class TokenManager:
-    def __init__(self):
-        self.access_token = None
-        self.refresh_token = None
-
-    def update_token(self):
-        print("Reautenticando para obter novo token...")
-        new_access_token, new_refresh_token = self.get_tokens()
-        if new_access_token:
-            self.access_token = new_access_token
-            self.refresh_token = new_refresh_token
-            print("Token atualizado com sucesso.")
-        else:
-            print("Falha ao atualizar token.")
-
-    def get_tokens(self):
-        url = os.getenv("TOKEN_URL_REDE")
-        body = {
-            "grant_type": "password",
-            "username": os.getenv("API_USERNAME_REDE"),
-            "password": os.getenv("API_PASSWORD_REDE")
-        }
-        headers = {
-            "Authorization": os.getenv("API_AUTH_HEADER_REDE"),
-        }
-
-        response = requests.post(url, data=body, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("access_token"), data.get("refresh_token")
-        else:
-            print("Erro ao obter tokens:", response.status_code, response.text)
-            return None, None
-
+# O orquestrador já carregou o .env antes de importar o script
+if not os.getenv("REDE_ENV_CARREGADO"):
+    env_path = localizar_env()
+    load_dotenv(dotenv_path=env_path)
 
 def connect_to_database():
-    connection_string = (
-        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-        f"SERVER={os.getenv('DB_SERVER_EXCEL')},{os.getenv('DB_PORT_EXCEL')};"
-        f"DATABASE={os.getenv('DB_DATABASE_EXCEL')};"
-        f"UID={os.getenv('DB_USER_EXCEL')};"
-        f"PWD={os.getenv('DB_PASSWORD_EXCEL')}"
-    )
+    """Conexão do pool compartilhado; close() a devolve ao pool."""
     try:
-        conn = pyodbc.connect(connection_string)
-        return conn
+        return get_pool().acquire()
     except Exception as e:
         print(f"Erro ao conectar ao banco de dados: {e}")
         return None
 
 
-def insert_transactions_batch(cursor, transactions):
-    query = """
-        INSERT INTO BD_Vendas_Rede (
-            Data_Movimentacao, Codigo_Autorizacao, Tipo_Captura, Valor_Liquido, Valor_Total, Status,
-            TID, Data_Venda, Hora_Venda, NSU, Dispositivo, Tipo_Dispositivo, Taxa_MDR, Valor_MDR,
-            Numero_Cartao, Numero_Token, Numero_Empresa, Nome_Documento, CREDIT, Parcelas
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+SALES_TABLE = "BD_Vendas_Rede"
+SALES_ENDPOINT = "sales"
+
+# Tipos dos parâmetros do INSERT em BD_Vendas_Rede (None = tipo decidido pelo driver)
+TRANSACTIONS_INPUT_SIZES = [
+    varchar(10), None, varchar(), None, None, varchar(),
+    varchar(), varchar(10), varchar(10), None, varchar(), varchar(), None, None,
+    varchar(), varchar(), None, varchar(), varchar(), None
+]
+
+
+TRANSACTION_COLUMNS = [
+    'Data_Movimentacao', 'Codigo_Autorizacao', 'Tipo_Captura', 'Valor_Liquido', 'Valor_Total', 'Status',
+    'TID', 'Data_Venda', 'Hora_Venda', 'NSU', 'Dispositivo', 'Tipo_Dispositivo', 'Taxa_MDR', 'Valor_MDR',
+    'Numero_Cartao', 'Numero_Token', 'Numero_Empresa', 'Nome_Documento', 'CREDIT', 'Parcelas'
+]
+
+
+def transform_transaction(t):
+    """Converte uma transação da API para as colunas de BD_Vendas_Rede, com o RowHash do conteúdo."""
+    transaction = {
+        'Data_Movimentacao': t.get('movementDate', 'N/A'),
+        'Codigo_Autorizacao': t.get('authorizationCode', 'N/A'),
+        'Tipo_Captura': t.get('captureType', 'N/A'),
+        'Valor_Liquido': t.get('netAmount', 0),
+        'Valor_Total': t.get('amount', 0),
+        'Status': t.get('status', 'N/A'),
+        'TID': t.get('tid', 'N/A'),
+        'Data_Venda': t.get('saleDate', 'N/A'),
+        'Hora_Venda': t.get('saleHour', 'N/A'),
+        'NSU': t.get('nsu', 'N/A'),
+        'Dispositivo': t.get('device', 'N/A'),
+        'Tipo_Dispositivo': t.get('deviceType', 'N/A'),
+        'Taxa_MDR': t.get('mdrFee', 0),
+        'Valor_MDR': t.get('mdrAmount', 0),
+        'Numero_Cartao': t.get('cardNumber', 'N/A'),
+        'Numero_Token': t.get('tokenNumber', 'N/A'),
+        'Numero_Empresa': t.get('merchant', {}).get('companyNumber', 'N/A'),
+        'Nome_Documento': t.get('merchant', {}).get('documentName', 'N/A'),
+        'CREDIT': t.get('modality', {}).get('type', 'N/A'),
+        'Parcelas': t.get('installmentQuantity', 0)
+    }
+    transaction['RowHash'] = row_hash(transaction[column] for column in TRANSACTION_COLUMNS)
+    return transaction
+
+
+def checkpoint_endpoint(table):
+    """Carga na tabela viva ou no staging de reconciliação têm checkpoints separados."""
+    return SALES_ENDPOINT if table == SALES_TABLE else f"{SALES_ENDPOINT}:{table}"
+
+
+def insert_transactions_batch(cursor, transactions, table=SALES_TABLE):
+    """
+    Insere apenas as transações cujo RowHash ainda não está em `table`.
+    Não faz commit; retorna False se a inserção falhar.
     """
     try:
-        cursor.executemany(query, [
-            (
-                transaction['Data_Movimentacao'], transaction['Codigo_Autorizacao'], transaction['Tipo_Captura'],
-                transaction['Valor_Liquido'], transaction['Valor_Total'], transaction['Status'], transaction['TID'],
-                transaction['Data_Venda'], transaction['Hora_Venda'], transaction['NSU'], transaction['Dispositivo'],
-                transaction['Tipo_Dispositivo'], transaction['Taxa_MDR'], transaction['Valor_MDR'],
-                transaction['Numero_Cartao'], transaction['Numero_Token'], transaction['Numero_Empresa'],
-                transaction['Nome_Documento'], transaction['CREDIT'], transaction['Parcelas']
-            ) for transaction in transactions
-        ])
+        insert_new_rows(cursor, table, TRANSACTION_COLUMNS, [
+            tuple(transaction[column] for column in TRANSACTION_COLUMNS) + (transaction['RowHash'],)
+            for transaction in transactions
+        ], TRANSACTIONS_INPUT_SIZES)
+        return True
     except Exception as e:
         print(f"Erro ao inserir transações em batch: {e}")
+        return False
 
 
-def fetch_transactions_for_company(company_number, token_manager, start_date, end_date, batch_size):
+def flush_transactions(conn, cursor, transactions, checkpoint, next_page_key, table=SALES_TABLE):
+    """
+    Grava as transações e o checkpoint da próxima página no mesmo commit. Com
+    next_page_key None a extração terminou e o checkpoint é removido.
+    """
+    if transactions and not insert_transactions_batch(cursor, transactions, table):
+        conn.rollback()
+        return False
+    if next_page_key is None:
+        clear_checkpoint(cursor, checkpoint_endpoint(table), checkpoint)
+    else:
+        set_checkpoint(cursor, checkpoint_endpoint(table), checkpoint, next_page_key)
+    conn.commit()
+    return True
+
+
+def read_checkpoint(checkpoint, table=SALES_TABLE):
+    """Página onde a extração parou; (False, None) se não houver conexão."""
     conn = connect_to_database()
     if not conn:
-        return
+        return False, None
+    try:
+        return True, get_checkpoint(conn.cursor(), checkpoint_endpoint(table), checkpoint)
+    finally:
+        conn.close()
 
-    cursor = conn.cursor()
+
+def reset_staging_slice(company_number, start_date, end_date, table):
+    """
+    Antes de baixar a empresa do início no staging, descarta as linhas dela no
+    período, que podem ter mudado na API desde a carga anterior.
+    """
+    conn = connect_to_database()
+    if not conn:
+        return False
+    try:
+        clear_staging_slice(conn.cursor(), table, "Data_Movimentacao", start_date, end_date,
+                            "Numero_Empresa", company_number)
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao limpar o staging da empresa {company_number}: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def write_transactions(transactions, checkpoint, next_page_key, table=SALES_TABLE):
+    """
+    Pega uma conexão do pool só para gravar o lote e o checkpoint e a devolve
+    em seguida, para que as tarefas não segurem conexões durante as chamadas à API.
+    """
+    conn = connect_to_database()
+    if not conn:
+        return False
+    try:
+        return flush_transactions(conn, conn.cursor(), transactions, checkpoint, next_page_key, table)
+    finally:
+        conn.close()
+
+
+def fetch_transactions_for_company(company_number, token_manager, start_date, end_date, batch_size,
+                                   table=SALES_TABLE):
+    """Carrega as vendas da empresa no período em `table`; retorna True se a extração chegou ao fim."""
+    checkpoint = checkpoint_key(company_number, start_date, end_date)
+    connected, page_key = read_checkpoint(checkpoint, table)
+    if not connected:
+        return False
+    if page_key:
+        print(f"Retomando empresa {company_number} a partir do checkpoint {page_key}...")
+    elif table != SALES_TABLE and not reset_staging_slice(company_number, start_date, end_date, table):
+        return False
     print(f"Processando empresa: {company_number} para o período de {start_date} a {end_date}...")
     url = "https://api.userede.com.br/redelabs/merchant-statement/v2/sales"
-    headers = {"Authorization": f"Bearer {token_manager.access_token}"}
+    headers = {}
     params = {
         "startDate": start_date,
         "endDate": end_date,
         "parentCompanyNumber": company_number,
         "subsidiaries": company_number,
-        "pageKey": None,
+        "pageKey": page_key,
         "size": 100
     }
 
     transactions_batch = []
+    completed = False
     while True:
-        response = requests.get(url, params=params, headers=headers)
+        access_token = token_manager.get_access_token()
+        headers["Authorization"] = f"Bearer {access_token}"
+        response = http_client.get(url, params=params, headers=headers)
         if response.status_code == 200:
             data = response.json()
             if 'content' in data and 'transactions' in data['content']:
                 transactions = data['content']['transactions']
-                transactions_batch.extend([
-                    {
-                        'Data_Movimentacao': t.get('movementDate', 'N/A'),
-                        'Codigo_Autorizacao': t.get('authorizationCode', 'N/A'),
-                        'Tipo_Captura': t.get('captureType', 'N/A'),
-                        'Valor_Liquido': t.get('netAmount', 0),
-                        'Valor_Total': t.get('amount', 0),
-                        'Status': t.get('status', 'N/A'),
-                        'TID': t.get('tid', 'N/A'),
-                        'Data_Venda': t.get('saleDate', 'N/A'),
-                        'Hora_Venda': t.get('saleHour', 'N/A'),
-                        'NSU': t.get('nsu', 'N/A'),
-                        'Dispositivo': t.get('device', 'N/A'),
-                        'Tipo_Dispositivo': t.get('deviceType', 'N/A'),
-                        'Taxa_MDR': t.get('mdrFee', 0),
-                        'Valor_MDR': t.get('mdrAmount', 0),
-                        'Numero_Cartao': t.get('cardNumber', 'N/A'),
-                        'Numero_Token': t.get('tokenNumber', 'N/A'),
-                        'Numero_Empresa': t.get('merchant', {}).get('companyNumber', 'N/A'),
-                        'Nome_Documento': t.get('merchant', {}).get('documentName', 'N/A'),
-                        'CREDIT': t.get('modality', {}).get('type', 'N/A'),
-                        'Parcelas': t.get('installmentQuantity', 0)
-                    } for t in transactions
-                ])
-
-                if len(transactions_batch) >= batch_size:
-                    insert_transactions_batch(cursor, transactions_batch[:batch_size])
-                    conn.commit()
-                    transactions_batch = transactions_batch[batch_size:]
+                transactions_batch.extend(transform_transaction(t) for t in transactions)
 
                 if 'cursor' in data and data['cursor'].get('hasNextKey', False):
                     params['pageKey'] = data['cursor']['nextKey']
                 else:
+                    params['pageKey'] = None
+
+                # Grava só em fim de página, para o checkpoint apontar sempre para uma página inteira
+                if len(transactions_batch) >= batch_size or params['pageKey'] is None:
+                    if not write_transactions(transactions_batch, checkpoint, params['pageKey'], table):
+                        break
+                    transactions_batch = []
+                if params['pageKey'] is None:
+                    completed = True
                     break
             else:
+                completed = write_transactions(transactions_batch, checkpoint, None, table)
                 break
         elif response.status_code == 401:
             print(f"Token expirado para empresa {company_number}. Reautenticando...")
-            token_manager.update_token()
-            headers["Authorization"] = f"Bearer {token_manager.access_token}"
+            token_manager.update_token(access_token)
         else:
             print(f"Erro na requisição para empresa {company_number}: {response.status_code}")
             break
 
-    if transactions_batch:
-        insert_transactions_batch(cursor, transactions_batch)
-        conn.commit()
-
-    conn.close()
     print(f"Processamento para empresa {company_number} concluído.")
+    return completed
 
 
-def remove_duplicates():
+def remove_duplicates(start_date, end_date):
+    """
+    Remove duplicatas restantes (linhas antigas, sem RowHash) apenas no período
+    carregado, pela mesma data de movimentação usada na carga e na
+    reconciliação, em vez de varrer a tabela inteira.
+    """
     conn = connect_to_database()
     if not conn:
         return
 
     cursor = conn.cursor()
-    print("Removendo duplicatas da tabela...")
+    print(f"Removendo duplicatas de {start_date} a {end_date}...")
     dedup_query = """
         WITH CTE AS (
             SELECT *, ROW_NUMBER() OVER (
@@ -184,14 +248,15 @@ def remove_duplicates():
                     Data_Movimentacao, Codigo_Autorizacao, Tipo_Captura, Valor_Liquido, Valor_Total, Status,
                     TID, Data_Venda, Hora_Venda, NSU, Dispositivo, Tipo_Dispositivo, Taxa_MDR, Valor_MDR,
                     Numero_Cartao, Numero_Token, Numero_Empresa, Nome_Documento, CREDIT, Parcelas
-                ORDER BY (SELECT NULL)
+                ORDER BY CASE WHEN RowHash IS NULL THEN 1 ELSE 0 END, id
             ) AS RN
             FROM BD_Vendas_Rede
+            WHERE Data_Movimentacao BETWEEN ? AND ?
         )
         DELETE FROM CTE WHERE RN > 1
     """
     try:
-        cursor.execute(dedup_query)
+        cursor.execute(dedup_query, (start_date, end_date))
         conn.commit()
         print("Remoção de duplicatas concluída.")
     except Exception as e:
@@ -200,36 +265,37 @@ def remove_duplicates():
         conn.close()
 
 
-def process_daily_transactions(token_manager, start_date, end_date, companyNumbers, batch_size):
+def process_daily_transactions(token_manager, start_date, end_date, companyNumbers, batch_size,
+                               table=SALES_TABLE):
+    """Retorna True se a extração de todas as empresas chegou ao fim."""
     print(f"Iniciando processamento de transações para o período de {start_date} a {end_date}...")
-    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
-        tasks = [
-            executor.submit(fetch_transactions_for_company, company_number, token_manager, start_date, end_date, batch_size)
-            for company_number in companyNumbers
-        ]
-        for task in tasks:
-            task.result()
-    print("Processamento diário concluído.")
-    remove_duplicates()
+    conn = connect_to_database()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    ensure_row_hash_column(cursor, SALES_TABLE, TRANSACTION_COLUMNS)
+    ensure_checkpoint_table(cursor)
+    conn.commit()
+    conn.close()
 
-def delete_previous_month_data(cursor, previous_month_start, previous_month_end):
-    """
-    Apaga os registros do mês anterior na tabela.
-    """
-    delete_query = """
-        DELETE FROM BD_Vendas_Rede
-        WHERE Data_Movimentacao BETWEEN ? AND ?
-    """
-    try:
-        cursor.execute(delete_query, (previous_month_start, previous_month_end))
-        cursor.connection.commit()
-        print(f"Dados de {previous_month_start} a {previous_month_end} removidos com sucesso.")
-    except Exception as e:
-        print(f"Erro ao apagar dados do mês anterior: {e}")
+    # Na tabela viva, os dias já liquidados vão numa consulta própria, que pode vir do cache
+    # (o staging mantém o período inteiro: a limpeza de recorte é por empresa e período)
+    periods = split_settled_period(start_date, end_date) if table == SALES_TABLE else [(start_date, end_date)]
+    results = run_tasks(fetch_transactions_for_company, [
+        (company_number, token_manager, period_start, period_end, batch_size, table)
+        for company_number in companyNumbers
+        for period_start, period_end in periods
+    ])
+    print("Processamento diário concluído.")
+    if table == SALES_TABLE:
+        remove_duplicates(start_date, end_date)
+    return all(results)
 
 def process_previous_month(token_manager, batch_size, companyNumbers):
     """
-    Identifica o mês anterior, apaga seus registros da tabela e processa os dados novamente.
+    Reprocessa o mês anterior por diferença: carrega o mês no staging de
+    reconciliação e aplica na tabela viva só as inserções e remoções, um dia
+    por transação. O mês nunca fica vazio para quem lê a tabela.
     """
     today = datetime.today()
     previous_month = today.month - 1 or 12
@@ -245,23 +311,40 @@ def process_previous_month(token_manager, batch_size, companyNumbers):
     # Conecta ao banco de dados
     conn = connect_to_database()
     if not conn:
-        return
+        return False
 
     cursor = conn.cursor()
+    ensure_row_hash_column(cursor, SALES_TABLE, TRANSACTION_COLUMNS)
+    staging = prepare_staging(cursor, SALES_TABLE, TRANSACTION_COLUMNS, "Data_Movimentacao",
+                              previous_month_start, previous_month_end)
+    conn.commit()
+
+    # Carrega o mês anterior no staging (retoma checkpoints de uma carga interrompida)
+    loaded = process_daily_transactions(token_manager, previous_month_start, previous_month_end,
+                                        companyNumbers, batch_size, staging)
+    if not loaded:
+        # Aplicar um staging incompleto apagaria linhas que só não foram baixadas ainda
+        print("Carga do mês anterior incompleta; reconciliação adiada para a próxima execução.")
+        conn.close()
+        return False
 
-    # Remove os dados existentes do mês anterior
-    delete_previous_month_data(cursor, previous_month_start, previous_month_end)
-
-    # Processa as transações para o mês anterior
-    process_daily_transactions(token_manager, previous_month_start, previous_month_end, companyNumbers, batch_size)
+    days = [
+        (datetime(year, previous_month, 1) + timedelta(days=i)).strftime("%Y-%m-%d")
+        for i in range(last_day_of_month)
+    ]
+    deleted, inserted = reconcile_period(conn, SALES_TABLE, TRANSACTION_COLUMNS, "Data_Movimentacao", days)
 
     conn.close()
-    print(f"Processamento do mês anterior concluído: {previous_month_start} a {previous_month_end}.")
+    print(f"Processamento do mês anterior concluído: {previous_month_start} a {previous_month_end} "
+          f"({deleted} linhas removidas, {inserted} inseridas).")
+    return True
 
 
-def main():
-    token_manager = TokenManager()
-    token_manager.update_token()
+def main(token_manager=None):
+    # Reaproveitar o TokenManager do orquestrador, se houver
+    if token_manager is None:
+        token_manager = TokenManager()
+        token_manager.update_token()
 
     company_numbers_str = os.getenv("COMPANY_NUMBERS_REDE")
     if company_numbers_str:
@@ -271,10 +354,10 @@ def main():
 
     if not token_manager.access_token:
         print("Erro ao obter token de autenticação.")
-        return
+        return False
 
-    # Configuração do batch size
-    batch_size = 100
+    # Configuração do batch size (REDE_BULK_BATCH_SIZE)
+    batch_size = batch_size_from_env()
 
     # Menu de opções
     print("Escolha uma opção para executar:")
@@ -302,13 +385,12 @@ def main():
         start_date = (today - timedelta(days=7)).strftime("%Y-%m-%d")
         end_date = (today - timedelta(days=1)).strftime("%Y-%m-%d")
     elif option == "5":
-        process_previous_month(token_manager, batch_size, companyNumbers)
-        return
+        return process_previous_month(token_manager, batch_size, companyNumbers)
     else:
         print("Opção inválida!")
-        return
+        return False
 
-    process_daily_transactions(token_manager, start_date, end_date, companyNumbers, batch_size)
+    return process_daily_transactions(token_manager, start_date, end_date, companyNumbers, batch_size)
 
 
 if __name__ == "__main__":
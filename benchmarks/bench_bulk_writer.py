@@ -0,0 +1,103 @@
+"""
+Benchmark de escrita em lote contra o substituto local do banco (fake_db).
+
+Compara as formas antigas de gravação (executemany sem fast_executemany com
+commit por batch de 150, como em insert_installments, e execute + commit por
+linha, como nos scripts de recebíveis) com rede_etl.bulk_writer.write_rows.
+
+Uso:
+    python benchmarks/bench_bulk_writer.py --rows 5000 --latency 0.001
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_db import FakeDatabase
+from rede_etl.bulk_writer import varchar, write_rows
+
+SCHEMA = """
+    CREATE TABLE BD_Parcelas_Detalhadas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        NSU TEXT, merchantId INTEGER, saleDate TEXT, installmentNumber INTEGER, installmentQuantity INTEGER,
+        saleAmount REAL, netAmount REAL, discountAmount REAL, flexFee REAL, mdrAmount REAL, feeTotal REAL,
+        authorizationCode TEXT, brand TEXT, cardNumber TEXT, expirationDate TEXT, status TEXT,
+        paymentId TEXT, detalHash TEXT
+    );
+"""
+
+INSERT = """
+    INSERT INTO BD_Parcelas_Detalhadas (
+        NSU, merchantId, saleDate, installmentNumber, installmentQuantity,
+        saleAmount, netAmount, discountAmount, flexFee, mdrAmount, feeTotal,
+        authorizationCode, brand, cardNumber, expirationDate, status, paymentId, detalHash
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INPUT_SIZES = [
+    None, None, varchar(10), None, None,
+    None, None, None, None, None, None,
+    None, varchar(), varchar(), varchar(30), varchar(), None, varchar()
+]
+
+
+def make_rows(n):
+    return [
+        (str(100000 + i), 123456789, "2025-01-15", i % 12 + 1, 12,
+         100.0, 97.5, 2.5, 0.0, 2.5, 2.5,
+         "A1B2C3", "VISA", "411111******1111", "2025-02-15", "PENDING", str(i), f"hash{i}")
+        for i in range(n)
+    ]
+
+
+def per_row_commit(cursor, rows):
+    for row in rows:
+        cursor.execute(INSERT, row)
+        cursor.connection.commit()
+
+
+def executemany_150(cursor, rows):
+    for start in range(0, len(rows), 150):
+        cursor.executemany(INSERT, rows[start:start + 150])
+        cursor.connection.commit()
+
+
+def bulk_writer(cursor, rows, batch_size):
+    write_rows(cursor, INSERT, rows, INPUT_SIZES, batch_size=batch_size)
+
+
+def run(label, func, rows, latency, *args):
+    db = FakeDatabase(latency=latency)
+    db.executescript(SCHEMA)
+    conn = db.connect()
+    cursor = conn.cursor()
+    start_trips = db.stats.count
+    start = time.perf_counter()
+    func(cursor, rows, *args)
+    elapsed = time.perf_counter() - start
+    trips = db.stats.count - start_trips
+    inserted = cursor.execute("SELECT COUNT(*) FROM BD_Parcelas_Detalhadas").fetchone()[0]
+    assert inserted == len(rows), (label, inserted)
+    print(f"{label:<34} linhas/s={len(rows) / elapsed:>10.0f}  round trips={trips:<7} tempo={elapsed:.2f}s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.001, help="segundos por round trip")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    t_row = run("execute + commit por linha", per_row_commit, rows, args.latency)
+    t_many = run("executemany (lotes de 150)", executemany_150, rows, args.latency)
+    t_bulk = run(f"write_rows (fast, lotes de {args.batch_size})", bulk_writer, rows, args.latency, args.batch_size)
+    print(f"Speedup vs. por linha: {t_row / t_bulk:.0f}x; vs. executemany: {t_many / t_bulk:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark do cliente HTTP compartilhado contra um servidor mock local.
+
+Compara requests.get "puro" (uma conexão nova por chamada, como os scripts
+faziam) com rede_etl.http_client (sessão com pool keep-alive) e reporta o
+número de conexões TCP abertas no servidor e o tempo total. O mock é HTTP
+sem TLS, então o ganho de tempo medido aqui é um piso: em produção cada
+conexão evitada também economiza o handshake TLS.
+
+Uso:
+    python benchmarks/bench_http_pool.py --requests 2000 --workers 8
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Mede só o pool: sem limitador de taxa nem cache de respostas, e sem gravar
+# estado do limitador fora de um diretório temporário
+os.environ["REDE_RATE_LIMIT"] = "0"
+os.environ["REDE_HTTP_CACHE"] = "0"
+os.environ["REDE_RATE_LIMIT_STATE"] = os.path.join(tempfile.mkdtemp(prefix="bench_http_pool_"), "rate_limiter.json")
+
+import requests
+
+from rede_etl import http_client
+
+
+class MockState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+            self.requests = 0
+
+
+STATE = MockState()
+BODY = json.dumps({"content": {"installments": [{"installmentNumber": 1, "status": "PAID"}]}}).encode()
+
+
+class InstallmentsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with STATE.lock:
+            STATE.connections += 1
+
+    def do_GET(self):
+        with STATE.lock:
+            STATE.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(label, get, url, total, workers):
+    STATE.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda i: get(url, params={"nsu": i}, timeout=10).status_code, range(total)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} conexões={STATE.connections:<6} requisições={STATE.requests:<6} "
+          f"tempo={elapsed:.2f}s  req/s={total / elapsed:.0f}")
+    return STATE.connections, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), InstallmentsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/installments/123"
+
+    try:
+        conexoes_antes, tempo_antes = run("requests.get", requests.get, url, args.requests, args.workers)
+        http_client.configure(args.workers)
+        conexoes_depois, tempo_depois = run("http_client (pool)", http_client.get, url, args.requests, args.workers)
+    finally:
+        http_client.close()
+        server.shutdown()
+
+    print(f"Handshakes evitados: {conexoes_antes - conexoes_depois} "
+          f"({conexoes_antes / max(conexoes_depois, 1):.0f}x menos conexões), "
+          f"speedup {tempo_antes / tempo_depois:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+Benchmark ponta a ponta dos jobs contra o mock da API e o banco substituto.
+
+Sobe o mock da API da Rede (mock_rede_api) neste processo e roda cada job num
+processo filho, com os scripts copiados para um diretório temporário que
+contém um PRIVATE_BAG.ENV/.env próprio (REDE_API_BASE_URL e TOKEN_URL_REDE
+apontando para o mock, caches e estado locais no mesmo diretório). No filho, o
+pool do banco é criado sobre o StandInDatabase (fake_db), com handlers para as
+consultas de que cada job depende; o job de parcelas recebe BD_Vendas_Rede
+semeada com as mesmas vendas que o mock devolve e não envia o e-mail de
+conclusão. Onde pyodbc, pythoncom ou win32com não estão disponíveis, o filho
+os substitui por módulos mínimos, para que todos os jobs rodem em qualquer
+máquina.
+
+Jobs e pontos de entrada:
+    vendas              process_daily_transactions (últimos N dias)
+    parcelas            process_sales
+    pagamentos          main (opção 4: os 7 dias até ontem, com a deduplicação e a
+                        busca diária dos pagamentos sem parcelas; ignora --days)
+    recebiveis_mensal   job
+    recebiveis_semanal  job
+
+Para cada job são reportados tempo total, linhas gravadas e linhas/s,
+chamadas à API (e quantas foram 401/429/5xx), round trips ao banco e o pico
+de memória (RSS) do processo filho.
+
+Uso:
+    python -m benchmarks.bench_jobs --companies 3 --days 7 --latency 0.02
+    python -m benchmarks.bench_jobs --jobs vendas pagamentos --rate-429 0.02 --rate-401 0.01
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import types
+from datetime import date, timedelta
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from benchmarks.fake_db import StandInDatabase
+from benchmarks.mock_rede_api import Dataset, MockConfig, MockRedeApi
+
+# nome do job -> script
+SCRIPTS = {
+    "vendas": "VendasRede-Diario.py",
+    "parcelas": "UpdateParcelasDetalhadas.py",
+    "pagamentos": "PagamentosConsolidados-Diario.py",
+    "recebiveis_mensal": "RecebiveisMensal.py",
+    "recebiveis_semanal": "RecebiveisSemanal-Diario.py",
+}
+
+
+def peak_rss_mb():
+    """Pico de memória residente do processo, em MB (None se não houver como medir)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+
+
+def benchmark_days(days):
+    """Os `days` dias até ontem, no formato da API."""
+    today = date.today()
+    return [(today - timedelta(days=i)).isoformat() for i in range(days, 0, -1)]
+
+
+# --------------------------------------------------------------------------- #
+# Processo pai: mock da API, ambiente e relatório
+# --------------------------------------------------------------------------- #
+def prepare_workdir(workdir, api, dataset, args):
+    """Copia os scripts e grava o .env que eles vão encontrar via localizar_env."""
+    for filename in SCRIPTS.values():
+        shutil.copy2(REPO_DIR / filename, workdir / filename)
+    env = {
+        "REDE_API_BASE_URL": api.url,
+        "TOKEN_URL_REDE": api.token_url,
+        "API_AUTH_HEADER_REDE": "Basic bW9jazptb2Nr",
+        "API_USERNAME_REDE": "benchmark",
+        "API_PASSWORD_REDE": "benchmark",
+        "COMPANY_NUMBERS_REDE": ",".join(str(c) for c in dataset.companies),
+        "DB_SERVER_EXCEL": "stand-in",
+        "DB_PORT_EXCEL": "1433",
+        "DB_DATABASE_EXCEL": "benchmark",
+        "DB_USER_EXCEL": "benchmark",
+        "DB_PASSWORD_EXCEL": "benchmark",
+        "REDE_ETL_DATA_DIR": str(workdir / "dados"),
+        "REDE_TOKEN_CACHE": str(workdir / "token.json"),
+        "REDE_RATE_LIMIT_STATE": str(workdir / "rate_limit.json"),
+        "REDE_RATE_LIMIT": "1" if args.rate_limit else "0",
+        "REDE_HTTP_CACHE": "1" if args.http_cache else "0",
+        # Os pontos de entrada reais (main) leem o tamanho do lote do ambiente
+        "REDE_BULK_BATCH_SIZE": str(args.batch_size),
+    }
+    if args.concurrency:
+        env["REDE_MAX_CONCURRENCY"] = str(args.concurrency)
+    env_dir = workdir / "PRIVATE_BAG.ENV"
+    env_dir.mkdir()
+    with open(env_dir / ".env", "w", encoding="utf-8") as f:
+        f.writelines(f"{key}={value}\n" for key, value in env.items())
+    return env
+
+
+def run_job(job, workdir, env, args):
+    """Roda o job num processo filho; retorna o dict de resultado gravado por ele."""
+    result_path = workdir / f"{job}.json"
+    log_path = workdir / f"{job}.log"
+    config = {
+        "companies": args.companies, "days": args.days, "sales_per_day": args.sales_per_day,
+        "payments_per_day": args.payments_per_day, "empty_ratio": args.empty_ratio, "seed": args.seed,
+        "db_latency": args.db_latency, "batch_size": args.batch_size,
+    }
+    command = [sys.executable, "-m", "benchmarks.bench_jobs", "--child", job,
+               "--workdir", str(workdir), "--child-config", json.dumps(config)]
+    child_env = {**os.environ, **env, "PYTHONPATH": str(REPO_DIR)}
+    with open(log_path, "w", encoding="utf-8") as log:
+        completed = subprocess.run(command, cwd=workdir, env=child_env,
+                                   stdout=None if args.verbose else log, stderr=subprocess.STDOUT)
+    if result_path.exists():
+        with open(result_path, encoding="utf-8") as f:
+            return json.load(f)
+    return {"status": "erro", "error": f"processo filho terminou com código {completed.returncode} (log: {log_path})"}
+
+
+def print_report(results):
+    header = (f"{'job':<20} {'status':<8} {'tempo(s)':>9} {'linhas':>8} {'linhas/s':>9} "
+              f"{'API':>7} {'401':>5} {'429':>5} {'5xx':>5} {'round trips':>12} {'pico RSS(MB)':>13}")
+    print(header)
+    print("-" * len(header))
+    for job, result in results.items():
+        api = result.get("api", {})
+        by_status = api.get("by_status", {})
+        errors_5xx = sum(v for k, v in by_status.items() if k.startswith("5"))
+        elapsed = result.get("elapsed") or 0.0
+        rows = result.get("rows_written", 0)
+        rss = result.get("peak_rss_mb")
+        print(f"{job:<20} {result['status']:<8} {elapsed:>9.2f} {rows:>8} "
+              f"{(rows / elapsed if elapsed else 0):>9.0f} {api.get('total', 0):>7} "
+              f"{by_status.get('401', 0):>5} {by_status.get('429', 0):>5} {errors_5xx:>5} "
+              f"{result.get('round_trips', 0):>12} {(f'{rss:.0f}' if rss is not None else 'n/d'):>13}")
+        if result.get("error"):
+            print(f"    {result['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", nargs="+", choices=list(SCRIPTS), default=list(SCRIPTS))
+    parser.add_argument("--companies", type=int, default=3)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--sales-per-day", type=int, default=200)
+    parser.add_argument("--payments-per-day", type=int, default=50)
+    parser.add_argument("--empty-ratio", type=float, default=0.05, help="fração de consultas de parcelas vazias")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", type=float, default=0.02, help="segundos por requisição no mock")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fração de respostas 500")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fração de respostas 429")
+    parser.add_argument("--rate-401", type=float, default=0.0, help="fração de respostas 401")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="validade dos tokens emitidos (s)")
+    parser.add_argument("--db-latency", type=float, default=0.001, help="segundos por round trip ao banco")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=None, help="REDE_MAX_CONCURRENCY dos jobs")
+    parser.add_argument("--rate-limit", action="store_true", help="liga o limitador de taxa compartilhado")
+    parser.add_argument("--http-cache", action="store_true", help="liga o cache persistente de respostas")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="mostra a saída dos jobs")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--child-config", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, Path(args.workdir), json.loads(args.child_config))
+        return
+
+    dataset = Dataset(companies=args.companies, sales_per_day=args.sales_per_day,
+                      payments_per_day=args.payments_per_day, empty_ratio=args.empty_ratio, seed=args.seed)
+    config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        rate_429=args.rate_429, rate_401=args.rate_401, token_ttl=args.token_ttl,
+                        page_size=args.page_size, seed=args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="bench_jobs_"))
+    results = {}
+    try:
+        with MockRedeApi(dataset, config) as api:
+            env = prepare_workdir(workdir, api, dataset, args)
+            for job in args.jobs:
+                print(f"Rodando {job}...", flush=True)
+                api.stats.reset()
+                results[job] = run_job(job, workdir, env, args)
+                results[job]["api"] = api.stats.snapshot()
+    finally:
+        if args.keep_workdir:
+            print(f"Diretório de trabalho mantido em {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_report(results)
+
+
+# --------------------------------------------------------------------------- #
+# Processo filho: banco substituto e execução do job
+# --------------------------------------------------------------------------- #
+def install_driver_stubs():
+    """
+    Substitui pyodbc, pythoncom e win32com.client quando não podem ser
+    importados (Linux, sem driver ODBC). O banco é o StandInDatabase e o
+    e-mail de conclusão não é enviado, então os scripts só precisam dos nomes.
+    """
+    try:
+        import pyodbc  # noqa: F401
+    except ImportError:
+        pyodbc = types.ModuleType("pyodbc")
+        pyodbc.Error = type("Error", (Exception,), {})
+
+        def connect(*args, **kwargs):
+            raise pyodbc.Error("pyodbc indisponível no benchmark; use o pool do StandInDatabase")
+
+        pyodbc.connect = connect
+        sys.modules["pyodbc"] = pyodbc
+    try:
+        import pythoncom  # noqa: F401
+        import win32com.client  # noqa: F401
+    except ImportError:
+        pythoncom = types.ModuleType("pythoncom")
+        pythoncom.CoInitialize = pythoncom.CoUninitialize = lambda: None
+        win32com = types.ModuleType("win32com")
+        client = types.ModuleType("win32com.client")
+
+        def dispatch(*args, **kwargs):
+            raise RuntimeError("win32com indisponível no benchmark")
+
+        client.Dispatch = dispatch
+        win32com.client = client
+        sys.modules.update({"pythoncom": pythoncom, "win32com": win32com, "win32com.client": client})
+
+
+def load_script(path):
+    module_name = path.stem.replace("-", "_")
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _installment_keys(db):
+    return {(row.get("NSU"), row.get("merchantId")) for row in db.table("BD_Parcelas_Detalhadas")}
+
+
+def register_handlers(db):
+    """Respostas das consultas que alimentam os pipelines dos jobs."""
+
+    def pending_sales(db, params):
+        watermark = params[0] or 0
+        done = _installment_keys(db)
+        sales = {}
+        for row in db.table("BD_Vendas_Rede"):
+            key = (row["NSU"], row["Numero_Empresa"])
+            if row.get("Parcelas") and row["id"] > watermark and key not in done:
+                previous = sales.get(key)
+                sales[key] = (max(row["id"], previous[0]) if previous else row["id"],
+                              row["NSU"], row["Numero_Empresa"], row["Data_Venda"])
+        return ["id", "NSU", "Numero_Empresa", "Data_Venda"], list(sales.values())
+
+    def processed_sales(db, params):
+        return ["id", "NSU", "merchantId"], [
+            (row["id"], row["NSU"], row["merchantId"])
+            for row in db.table("BD_Parcelas_Detalhadas") if row["id"] > params[0]
+        ]
+
+    def due_installments(db, params):
+        due = {}
+        for row in db.table("BD_Parcelas_Detalhadas"):
+            if row.get("status") in ("PAID", "ANTICIPATED"):
+                continue
+            key = (row["NSU"], row["merchantId"], row["saleDate"])
+            due[key] = min(due.get(key) or row["expirationDate"], row["expirationDate"])
+        return ["NSU", "merchantId", "saleDate", "dueDate", "ConsultasSemMudanca"], [
+            key + (due_date, 0) for key, due_date in sorted(due.items(), key=lambda item: item[1])
+        ]
+
+    def status_updates(db, params):
+        statuses = {(r["NSU"], r["merchantId"], r["installmentNumber"]): r["status"]
+                    for r in db.table("#StatusParcelas")}
+        changed = []
+        for row in db.table("BD_Parcelas_Detalhadas"):
+            status = statuses.get((row["NSU"], row["merchantId"], row["installmentNumber"]), row["status"])
+            if (status or "") != (row["status"] or ""):
+                row["status"] = status
+                changed.append((row["NSU"], row["merchantId"]))
+        return ["NSU", "merchantId"], changed
+
+    def pending_payments(db, params):
+        hashes = set(params)
+        return ["id", "parentCompanyNumber", "paymentId"], [
+            (row["id"], row["parentCompanyNumber"], row["paymentId"])
+            for row in db.table("BD_PagamentosConsolidados")
+            if row.get("nsu") is None and row.get("RowHash") in hashes
+        ]
+
+    def payments_without_installments(db, params):
+        return ["id", "parentCompanyNumber", "paymentId"], [
+            (row["id"], row["parentCompanyNumber"], row["paymentId"])
+            for row in db.table("BD_PagamentosConsolidados")
+            if row.get("nsu") is None and row.get("paymentDate") == params[0]
+        ]
+
+    def update_payment_installments(db, params):
+        by_id = {row["id"]: row for row in db.table("BD_PagamentosConsolidados")}
+        for values in params:
+            row = by_id.get(values[-1])
+            if row is not None:
+                row["nsu"] = values[-2]
+        db.rows_written["BD_PagamentosConsolidados"] = \
+            db.rows_written.get("BD_PagamentosConsolidados", 0) + len(params)
+        return len(params)
+
+    db.on(r"FROM BD_Vendas_Rede VR\s+WHERE VR\.Parcelas <> 0\s+AND VR\.id > \?", pending_sales)
+    db.on(r"SELECT id, NSU, merchantId\s+FROM BD_Parcelas_Detalhadas\s+WHERE id > \?", processed_sales)
+    db.on(r"FROM BD_Parcelas_Detalhadas\s+WHERE status NOT IN", due_installments)
+    db.on(r"OUTPUT inserted\.NSU, inserted\.merchantId", status_updates)
+    db.on(r"WHERE nsu IS NULL AND RowHash IN", pending_payments)
+    db.on(r"WHERE paymentDate = \? AND nsu IS NULL", payments_without_installments)
+    db.on(r"^\s*UPDATE BD_PagamentosConsolidados\s+SET", update_payment_installments)
+
+
+def seed_sales(db, dataset, days):
+    """BD_Vendas_Rede como o job de vendas a deixaria, para o job de parcelas."""
+    db.seed("BD_Vendas_Rede", [
+        {"NSU": sale["nsu"], "Numero_Empresa": company, "Data_Venda": sale["saleDate"],
+         "Parcelas": sale["installmentQuantity"]}
+        for company in dataset.companies
+        for day in days
+        for sale in dataset.sales(company, date.fromisoformat(day))
+    ])
+
+
+def run_child(job, workdir, config):
+    from rede_etl import http_client
+    from rede_etl.db_pool import close_pool, get_pool
+    from rede_etl.token_manager import TokenManager
+
+    result = {"status": "erro"}
+    db = StandInDatabase(latency=config["db_latency"])
+    try:
+        register_handlers(db)
+        dataset = Dataset(companies=config["companies"], sales_per_day=config["sales_per_day"],
+                          payments_per_day=config["payments_per_day"], empty_ratio=config["empty_ratio"],
+                          seed=config["seed"])
+        days = benchmark_days(config["days"])
+        if job == "parcelas":
+            seed_sales(db, dataset, days)
+        get_pool("stand-in", connect=db.connect)
+
+        install_driver_stubs()
+        module = load_script(workdir / SCRIPTS[job])
+        if job == "parcelas":
+            # O benchmark não envia o e-mail de conclusão
+            module.send_completion_email = lambda *args, **kwargs: None
+
+        token_manager = TokenManager()
+        if not token_manager.get_access_token():
+            raise RuntimeError("o mock não emitiu token")
+
+        round_trips_before = db.stats.count
+        start = time.perf_counter()
+        if job == "vendas":
+            outcome = module.process_daily_transactions(
+                token_manager, days[0], days[-1], dataset.companies, config["batch_size"])
+        elif job == "parcelas":
+            outcome = module.process_sales(token_manager)
+        elif job == "pagamentos":
+            outcome = module.main(token_manager)
+        else:
+            outcome = module.job(token_manager)
+        elapsed = time.perf_counter() - start
+
+        result = {
+            "status": "falhou" if outcome is False else "ok",
+            "elapsed": elapsed,
+            "rows_written": db.total_written(),
+            "rows_by_table": dict(db.rows_written),
+            "round_trips": db.stats.count - round_trips_before,
+            "statements": db.statements,
+        }
+    except BaseException as e:
+        traceback.print_exc()
+        result = {"status": "erro", "error": f"{type(e).__name__}: {e}"}
+    finally:
+        result["peak_rss_mb"] = peak_rss_mb()
+        http_client.close()
+        close_pool()
+        with open(workdir / f"{job}.json", "w", encoding="utf-8") as f:
+            json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main()
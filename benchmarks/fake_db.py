@@ -0,0 +1,380 @@
+"""
+Substitutos locais do SQL Server para benchmarks.
+
+Imitam a interface do pyodbc usada pelos scripts (connect/cursor/execute/
+executemany/fast_executemany/setinputsizes/commit) e simulam a latência de
+rede cobrando `latency` segundos por round trip: cada execute, cada commit e,
+sem fast_executemany, cada linha de um executemany. Com fast_executemany o
+lote inteiro custa um round trip, como no driver real.
+
+FakeDatabase roda sobre um SQLite em memória e serve para SQL portável.
+StandInDatabase aceita o T-SQL dos jobs completos (MERGE, #temporárias,
+IF OBJECT_ID...) sem interpretá-lo: guarda as linhas dos INSERT ... VALUES,
+copia staging para destino em INSERT ... SELECT e MERGE e trata DROP/TRUNCATE/
+SWITCH; qualquer outro comando é aceito e não devolve linhas. Como no SQL
+Server, cada conexão enxerga só as suas #temporárias. As consultas de que um
+job depende são respondidas por handlers registrados com on().
+Transações não são simuladas: rollback não desfaz nada.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+
+
+class RoundTripCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def hit(self, latency, n=1):
+        with self.lock:
+            self.count += n
+        if latency:
+            time.sleep(latency * n)
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection._db.cursor()
+        self.fast_executemany = False
+        self.rowcount = -1
+
+    def _hit(self, n=1):
+        self.connection.stats.hit(self.connection.latency, n)
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def execute(self, query, params=()):
+        self._hit()
+        with self.connection._db_lock:
+            self._cursor.execute(query, params)
+        self.rowcount = self._cursor.rowcount
+        return self
+
+    def executemany(self, query, rows):
+        rows = list(rows)
+        self._hit(1 if self.fast_executemany else len(rows))
+        with self.connection._db_lock:
+            self._cursor.executemany(query, rows)
+        self.rowcount = self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class FakeConnection:
+    def __init__(self, db, db_lock, latency, stats):
+        self._db = db
+        self._db_lock = db_lock
+        self.latency = latency
+        self.stats = stats
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.stats.hit(self.latency)
+        with self._db_lock:
+            self._db.commit()
+
+    def rollback(self):
+        with self._db_lock:
+            self._db.rollback()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDatabase:
+    """Banco compartilhado; connect() devolve conexões que contam round trips."""
+
+    def __init__(self, latency=0.001):
+        self.latency = latency
+        self.stats = RoundTripCounter()
+        self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        self._db_lock = threading.RLock()
+        self.connections = 0
+
+    def connect(self, *args, **kwargs):
+        self.stats.hit(self.latency)
+        self.connections += 1
+        return FakeConnection(self._db, self._db_lock, self.latency, self.stats)
+
+    def executescript(self, script):
+        with self._db_lock:
+            self._db.executescript(script)
+
+
+class Row(tuple):
+    """Linha com acesso por atributo (row.NSU), como pyodbc.Row."""
+
+    def __new__(cls, columns, values):
+        row = super().__new__(cls, values)
+        row._index = {name: i for i, name in enumerate(columns)}
+        return row
+
+    def __getattr__(self, name):
+        try:
+            return self[self._index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+_INSERT_VALUES = re.compile(
+    r"^\s*INSERT\s+INTO\s+([#\w.]+)(?:\s+WITH\s*\([^)]*\))?\s*\(([^)]*)\)\s*VALUES", re.I | re.S)
+_INSERT_SELECT = re.compile(r"^\s*INSERT\s+INTO\s+([#\w.]+)\s*\(([^)]*)\)\s*SELECT\b", re.I | re.S)
+_MERGE = re.compile(r"^\s*MERGE\s+([#\w.]+)", re.I)
+_MERGE_KEY = re.compile(r"alvo\.(\w+)\s*=\s*origem\.\1", re.I)
+_SELECT_INTO = re.compile(r"SELECT\s+TOP\s+0\s+.*?\s+INTO\s+([#\w.]+)\s+FROM", re.I | re.S)
+_DROP = re.compile(r"DROP\s+TABLE\s+([#\w.]+)", re.I)
+_TRUNCATE = re.compile(r"^\s*TRUNCATE\s+TABLE\s+([#\w.]+)", re.I)
+_SWITCH = re.compile(r"^\s*ALTER\s+TABLE\s+([#\w.]+)\s+SWITCH\s+TO\s+([#\w.]+)", re.I)
+_RENAME = re.compile(r"^\s*EXEC\s+sp_rename", re.I)
+_AGGREGATE = re.compile(r"^\s*SELECT\s+(MIN|MAX|SUM|COUNT)\s*\([^)]*\)\s+FROM\b", re.I)
+_FROM = re.compile(r"\b(?:FROM|USING)\s+([#\w.]+)", re.I)
+_OBJECT_ID = re.compile(r"^\s*SELECT\s+OBJECT_ID\(", re.I)
+_TEMP_NAME = re.compile(r"#(\w+)")
+
+
+class StandInDatabase:
+    """Banco substituto para os jobs completos; ver o docstring do módulo."""
+
+    def __init__(self, latency=0.001):
+        self.latency = latency
+        self.stats = RoundTripCounter()
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.rows_written = {}
+        self.statements = 0
+        self.connections = 0
+        self._handlers = []
+        self._next_id = 0
+        self._scope = None
+
+    def connect(self, *args, **kwargs):
+        self.stats.hit(self.latency)
+        with self.lock:
+            self.connections += 1
+            return StandInConnection(self, self.connections)
+
+    def on(self, pattern, handler):
+        """
+        Registra handler(db, params) para comandos que casem com `pattern`
+        (regex, busca sem diferenciar maiúsculas). Retorna (colunas, linhas)
+        para consultas ou um inteiro (rowcount) para comandos.
+        """
+        self._handlers.append((re.compile(pattern, re.I | re.S), handler))
+
+    def _scoped(self, name):
+        # Tabelas #temporárias pertencem à conexão, como no SQL Server
+        if name.startswith("#") and self._scope is not None and not name.endswith(f"__c{self._scope}"):
+            return f"{name}__c{self._scope}"
+        return name
+
+    def table(self, name):
+        """Linhas de `name`; nomes #temporários se referem à conexão em execução."""
+        return self.tables.setdefault(self._scoped(name), [])
+
+    def seed(self, name, rows):
+        """Carrega linhas (dicts) numa tabela antes da execução, sem contar como escrita."""
+        with self.lock:
+            self._append(name, rows, count=False)
+
+    def total_written(self):
+        with self.lock:
+            return sum(self.rows_written.values())
+
+    def _append(self, name, rows, count=True):
+        table = self.table(name)
+        for row in rows:
+            self._next_id += 1
+            row.setdefault("id", self._next_id)
+            table.append(row)
+        if count and not name.startswith("#"):
+            self.rows_written[name] = self.rows_written.get(name, 0) + len(rows)
+        return len(rows)
+
+    def execute(self, query, params, many=False, scope=None):
+        """
+        Executa um comando da conexão `scope`; retorna (colunas, linhas, rowcount).
+        Os nomes #temporários do comando são trocados pelos da conexão.
+        """
+        with self.lock:
+            self.statements += 1
+            self._scope = scope
+            try:
+                for pattern, handler in self._handlers:
+                    if pattern.search(query):
+                        result = handler(self, params)
+                        if isinstance(result, int):
+                            return None, [], result
+                        columns, rows = result
+                        return columns, [Row(columns, row) for row in rows], len(rows)
+                if scope is not None:
+                    query = _TEMP_NAME.sub(lambda m: f"#{m.group(1)}__c{scope}", query)
+                return self._generic(query, params, many)
+            finally:
+                self._scope = None
+
+    def _generic(self, query, params, many):
+        match = _INSERT_VALUES.match(query)
+        if match:
+            columns = [c.strip() for c in match.group(2).split(",")]
+            rows = params if many else [params]
+            return None, [], self._append(match.group(1), [dict(zip(columns, row)) for row in rows])
+
+        match = _INSERT_SELECT.match(query)
+        if match:
+            target = match.group(1)
+            columns = [c.strip() for c in match.group(2).split(",")]
+            source = next((t for t in _FROM.findall(query) if t != target), None)
+            existing = {row.get("RowHash") for row in self.table(target)} if "RowHash" in columns else set()
+            new = [{c: row.get(c) for c in columns} for row in self.tables.get(source, [])
+                   if not existing or row.get("RowHash") not in existing]
+            return None, [], self._append(target, new)
+
+        match = _MERGE.match(query)
+        if match:
+            return None, [], self._merge(match.group(1), query)
+
+        match = _SELECT_INTO.search(query)
+        if match:
+            name = match.group(1)
+            guarded = re.search(r"OBJECT_ID\([^)]*\)\s+IS\s+NULL", query, re.I)
+            if not (guarded and name in self.tables):
+                self.tables[name] = []
+            return None, [], 0
+
+        match = _TRUNCATE.match(query)
+        if match:
+            self.tables[match.group(1)] = []
+            return None, [], 0
+
+        match = _SWITCH.match(query)
+        if match:
+            moved = self.tables.pop(match.group(1), [])
+            self.tables[match.group(2)] = moved
+            return None, [], len(moved)
+
+        if _RENAME.match(query):
+            old, new = params
+            if old in self.tables:
+                self.tables[new] = self.tables.pop(old)
+            return None, [], 0
+
+        match = _DROP.search(query)
+        if match:
+            self.tables.pop(match.group(1), None)
+            return None, [], 0
+
+        if _OBJECT_ID.match(query):
+            exists = 1 if params and params[0] in self.tables else None
+            return ["valor"], [Row(["valor"], (exists,))], 1
+
+        match = _AGGREGATE.match(query)
+        if match:
+            value = 0 if match.group(1).upper() == "COUNT" else None
+            return ["valor"], [Row(["valor"], (value,))], 1
+        return None, [], 0
+
+    def _merge(self, target, query):
+        """Upsert das linhas da tabela de origem pelas colunas do ON alvo.X = origem.X."""
+        sources = [t for t in _FROM.findall(query) if t != target and t.upper() != "SELECT"]
+        source = next((t for t in sources if t in self.tables), None)
+        keys = _MERGE_KEY.findall(query)
+        if source is None or not keys:
+            return 0
+        index = {tuple(row.get(k) for k in keys): row for row in self.table(target)}
+        new = []
+        for row in self.tables[source]:
+            key = tuple(row.get(k) for k in keys)
+            if key in index:
+                index[key].update({c: v for c, v in row.items() if c != "id"})
+            else:
+                copy = {c: v for c, v in row.items() if c != "id"}
+                index[key] = copy
+                new.append(copy)
+        self._append(target, new)
+        return len(self.tables[source])
+
+
+class StandInCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.fast_executemany = False
+        self.rowcount = -1
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self, query, params, many, trips):
+        db = self.connection.db
+        db.stats.hit(db.latency, trips)
+        _columns, self._rows, self.rowcount = db.execute(query, params, many, self.connection.scope)
+        return self
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def execute(self, query, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        return self._run(query, tuple(params), False, 1)
+
+    def executemany(self, query, rows):
+        rows = [tuple(row) for row in rows]
+        self._run(query, rows, True, 1 if self.fast_executemany else len(rows))
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self._rows = []
+
+
+class StandInConnection:
+    def __init__(self, db, scope):
+        self.db = db
+        self.scope = scope
+        self.autocommit = False
+
+    def cursor(self):
+        return StandInCursor(self)
+
+    def commit(self):
+        self.db.stats.hit(self.db.latency)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,384 @@
+"""
+Servidor mock local da API da Rede para os benchmarks.
+
+Atende os endpoints usados pelos scripts (token, vendas, pagamentos, parcelas
+por venda e por pagamento, resumo de recebíveis) a partir de uma massa de
+dados determinística (Dataset): a mesma semente gera sempre as mesmas vendas,
+o que permite ao benchmark semear o banco substituto com os dados que a API
+vai devolver. Vendas e pagamentos são paginados com cursor/pageKey como na
+API real.
+
+MockConfig controla a latência por requisição e a injeção de falhas: 429 (com
+Retry-After), 500 e 401 aleatórios, além da expiração real dos tokens emitidos
+(token_ttl). Os scripts são apontados para o mock com REDE_API_BASE_URL e
+TOKEN_URL_REDE.
+
+Uso avulso (servidor em primeiro plano):
+    python -m benchmarks.mock_rede_api --port 8089 --latency 0.05
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TOKEN_PATH = "/oauth/token"
+
+ROUTES = [
+    ("sales", re.compile(r"^/redelabs/merchant-statement/v2/sales$")),
+    ("payments", re.compile(r"^/redelabs/merchant-statement/v1/payments$")),
+    ("payment_installments",
+     re.compile(r"^/redelabs/merchant-statement/v2/payments/installments/(?P<merchant>\d+)/(?P<payment_id>[^/]+)$")),
+    ("sale_installments", re.compile(r"^/redelabs/merchant-statement/v2/payments/installments/(?P<merchant>\d+)$")),
+    ("receivables_summary", re.compile(r"^/redelabs/merchant-statement/v2/receivables/summary$")),
+]
+
+
+def _parse_date(value):
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def _days(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+class Dataset:
+    """Massa de dados determinística; toda consulta é função da semente e dos parâmetros."""
+
+    def __init__(self, companies=3, sales_per_day=200, payments_per_day=50, empty_ratio=0.05, seed=42):
+        self.companies = [10000001 + i for i in range(companies)]
+        self.sales_per_day = sales_per_day
+        self.payments_per_day = payments_per_day
+        self.empty_ratio = empty_ratio
+        self.seed = seed
+
+    def _rng(self, *key):
+        return random.Random(":".join(str(part) for part in (self.seed,) + key))
+
+    def installment_quantity(self, merchant, nsu):
+        rng = self._rng("qtd", merchant, nsu)
+        if rng.random() < 0.3:
+            return 0  # venda à vista: sem parcelas
+        return rng.randint(1, 12)
+
+    def sales(self, merchant, day):
+        rng = self._rng("vendas", merchant, day)
+        sales = []
+        for i in range(self.sales_per_day):
+            nsu = int(f"{day:%y%m%d}{self.companies.index(merchant) if merchant in self.companies else 0:02d}{i:05d}")
+            amount = round(rng.uniform(10, 2000), 2)
+            mdr = round(amount * 0.025, 2)
+            sales.append({
+                "movementDate": day.isoformat(),
+                "authorizationCode": f"{rng.randint(0, 999999):06d}",
+                "captureType": "POS",
+                "netAmount": round(amount - mdr, 2),
+                "amount": amount,
+                "status": "APPROVED",
+                "tid": uuid.UUID(int=rng.getrandbits(128)).hex,
+                "saleDate": day.isoformat(),
+                "saleHour": f"{rng.randint(8, 21):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+                "nsu": nsu,
+                "device": f"PV{rng.randint(1000, 9999)}",
+                "deviceType": "POS",
+                "mdrFee": 2.5,
+                "mdrAmount": mdr,
+                "cardNumber": f"{rng.randint(400000, 599999)}******{rng.randint(0, 9999):04d}",
+                "tokenNumber": None,
+                "merchant": {"companyNumber": merchant, "documentName": f"EMPRESA {merchant}"},
+                "modality": {"type": "CREDIT"},
+                "installmentQuantity": self.installment_quantity(merchant, nsu),
+            })
+        return sales
+
+    def sale_installments(self, merchant, nsu, sale_date):
+        quantity = self.installment_quantity(merchant, nsu)
+        rng = self._rng("parcelas", merchant, nsu)
+        if quantity == 0 or rng.random() < self.empty_ratio:
+            return []
+        amount = round(rng.uniform(10, 2000), 2)
+        sale_day = _parse_date(sale_date)
+        installments = []
+        for number in range(1, quantity + 1):
+            due = sale_day + timedelta(days=30 * number)
+            value = round(amount / quantity, 2)
+            installments.append({
+                "installmentNumber": number,
+                "installmentQuantity": quantity,
+                "amountInfo": {"amount": value, "netAmount": round(value * 0.975, 2),
+                               "discountAmount": round(value * 0.025, 2)},
+                "flexFee": 0.0,
+                "mdrAmount": round(value * 0.025, 2),
+                "feeTotal": round(value * 0.025, 2),
+                "authorizationCode": f"{rng.randint(0, 999999):06d}",
+                "brand": "VISA",
+                "cardNumber": "411111******1111",
+                "expirationDate": due.isoformat(),
+                "status": "PAID" if due < date.today() else "PENDING",
+                "paymentId": f"P{merchant}{nsu}{number:02d}",
+                "detaillHash": uuid.UUID(int=rng.getrandbits(128)).hex,
+            })
+        return installments
+
+    def payments(self, merchant, day):
+        rng = self._rng("pagamentos", merchant, day)
+        return [{
+            "paymentId": f"{day:%Y%m%d}{merchant}{i:05d}",
+            "paymentDate": day.isoformat(),
+            "bankCode": 341,
+            "bankBranchCode": rng.randint(1000, 9999),
+            "accountNumber": rng.randint(10000, 99999),
+            "brandCode": rng.randint(1, 9),
+            "companyNumber": merchant,
+            "documentNumber": f"{merchant:014d}",
+            "companyName": f"EMPRESA {merchant} LTDA",
+            "tradeName": f"EMPRESA {merchant}",
+            "netAmount": round(rng.uniform(100, 50000), 2),
+            "status": "PAID",
+            "statusCode": 1,
+            "type": "CREDIT",
+            "typeCode": 1,
+        } for i in range(self.payments_per_day)]
+
+    def payment_installments(self, merchant, payment_id):
+        rng = self._rng("parcelas_pagamento", merchant, payment_id)
+        if rng.random() < self.empty_ratio:
+            return []
+        return [{
+            "installmentQuantity": 3,
+            "installmentNumber": number,
+            "saleAmount": round(rng.uniform(10, 2000), 2),
+            "authorizationCode": f"{rng.randint(0, 999999):06d}",
+            "brand": "MASTERCARD",
+            "cardNumber": "555555******4444",
+            "expirationDate": (date.today() + timedelta(days=30 * number)).isoformat(),
+            "flexFee": 0.0,
+            "mdrAmount": round(rng.uniform(0, 50), 2),
+            "feeTotal": round(rng.uniform(0, 50), 2),
+            "nsu": rng.randint(10 ** 8, 10 ** 9),
+        } for number in range(1, rng.randint(1, 3) + 1)]
+
+    def receivables_summary(self, merchant, start, end):
+        rng = self._rng("recebiveis", merchant, start, end)
+        if rng.random() < self.empty_ratio:
+            return []
+        return [{"amount": round(rng.uniform(1000, 500000), 2), "total": rng.randint(1, 5000)}]
+
+
+class MockConfig:
+    def __init__(self, latency=0.02, jitter=0.0, error_rate=0.0, rate_429=0.0, rate_401=0.0,
+                 token_ttl=3600, page_size=100, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.rate_401 = rate_401
+        self.token_ttl = token_ttl
+        self.page_size = page_size
+        self.rng = random.Random(seed)
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.by_endpoint = {}
+            self.by_status = {}
+
+    def hit(self, endpoint, status):
+        with self.lock:
+            self.by_endpoint[endpoint] = self.by_endpoint.get(endpoint, 0) + 1
+            self.by_status[status] = self.by_status.get(status, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "total": sum(self.by_endpoint.values()),
+                "by_endpoint": dict(self.by_endpoint),
+                "by_status": {str(k): v for k, v in self.by_status.items()},
+            }
+
+
+class MockRedeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, endpoint, status, payload=None, headers=None):
+        body = json.dumps(payload if payload is not None else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats.hit(endpoint, status)
+
+    def _delay(self):
+        config = self.server.config
+        delay = config.latency + (config.rng.uniform(0, config.jitter) if config.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        self._delay()
+        if urlparse(self.path).path != TOKEN_PATH:
+            self._send_json("unknown", 404)
+            return
+        token, refresh = uuid.uuid4().hex, uuid.uuid4().hex
+        with self.server.tokens_lock:
+            self.server.tokens[token] = time.time() + self.server.config.token_ttl
+        self._send_json("token", 200, {
+            "access_token": token, "refresh_token": refresh,
+            "expires_in": self.server.config.token_ttl, "token_type": "Bearer",
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        for endpoint, pattern in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            self._delay()
+            self._send_json("unknown", 404)
+            return
+
+        self._delay()
+        config = self.server.config
+        if not self._authorized():
+            self._send_json(endpoint, 401, {"message": "invalid_token"})
+            return
+        roll = config.rng.random()
+        if roll < config.rate_429:
+            self._send_json(endpoint, 429, {"message": "too many requests"}, {"Retry-After": "0"})
+            return
+        if roll < config.rate_429 + config.error_rate:
+            self._send_json(endpoint, 500, {"message": "internal error"})
+            return
+        if roll < config.rate_429 + config.error_rate + config.rate_401:
+            self._send_json(endpoint, 401, {"message": "token expired"})
+            return
+
+        status, payload = getattr(self, f"_get_{endpoint}")(params, **match.groupdict())
+        self._send_json(endpoint, status, payload)
+
+    def _authorized(self):
+        auth = self.headers.get("Authorization") or ""
+        token = auth[len("Bearer "):] if auth.startswith("Bearer ") else None
+        with self.server.tokens_lock:
+            expires_at = self.server.tokens.get(token)
+        return expires_at is not None and time.time() < expires_at
+
+    def _page(self, items, list_key, params, default_size):
+        size = int(params.get("size") or default_size)
+        offset = int(params.get("pageKey") or 0)
+        page = items[offset:offset + size]
+        has_next = offset + size < len(items)
+        return 200, {
+            "content": {list_key: page},
+            "cursor": {"hasNextKey": has_next, "nextKey": str(offset + size) if has_next else None},
+        }
+
+    def _get_sales(self, params):
+        data = self.server.dataset
+        merchant = int(params["parentCompanyNumber"])
+        items = [sale for day in _days(_parse_date(params["startDate"]), _parse_date(params["endDate"]))
+                 for sale in data.sales(merchant, day)]
+        return self._page(items, "transactions", params, self.server.config.page_size)
+
+    def _get_payments(self, params):
+        data = self.server.dataset
+        merchant = int(params["parentCompanyNumber"])
+        items = [payment for day in _days(_parse_date(params["startDate"]), _parse_date(params["endDate"]))
+                 for payment in data.payments(merchant, day)]
+        return self._page(items, "payments", params, self.server.config.page_size)
+
+    def _get_sale_installments(self, params, merchant):
+        installments = self.server.dataset.sale_installments(int(merchant), int(params["nsu"]), params["saleDate"])
+        return 200, {"content": {"installments": installments}}
+
+    def _get_payment_installments(self, params, merchant, payment_id):
+        return 200, {"content": {"installments": self.server.dataset.payment_installments(int(merchant), payment_id)}}
+
+    def _get_receivables_summary(self, params):
+        content = self.server.dataset.receivables_summary(
+            int(params["parentCompanyNumber"]), params["startDate"], params["endDate"])
+        return 200, {"content": content}
+
+
+class MockRedeApi:
+    """Sobe o mock numa thread; url aponta para a base a usar em REDE_API_BASE_URL."""
+
+    def __init__(self, dataset=None, config=None, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), MockRedeHandler)
+        self.server.daemon_threads = True
+        self.server.dataset = dataset or Dataset()
+        self.server.config = config or MockConfig()
+        self.server.stats = MockStats()
+        self.server.tokens = {}
+        self.server.tokens_lock = threading.Lock()
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.token_url = self.url + TOKEN_PATH
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def stats(self):
+        return self.server.stats
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--companies", type=int, default=3)
+    parser.add_argument("--sales-per-day", type=int, default=200)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-401", type=float, default=0.0)
+    args = parser.parse_args()
+
+    dataset = Dataset(companies=args.companies, sales_per_day=args.sales_per_day)
+    config = MockConfig(latency=args.latency, error_rate=args.error_rate,
+                        rate_429=args.rate_429, rate_401=args.rate_401)
+    api = MockRedeApi(dataset, config, port=args.port)
+    print(f"Mock da API da Rede em {api.url} (token: {api.token_url}). "
+          f"Empresas: {','.join(str(c) for c in dataset.companies)}. Ctrl+C para encerrar.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(api.stats.snapshot(), indent=2))
+        api.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Escrita em lote no SQL Server.
+
+Usa fast_executemany do pyodbc (um array de parâmetros por round trip, em vez
+de um round trip por linha) com tipos de parâmetro declarados via
+setinputsizes (None deixa o tipo da posição a cargo do driver), e faz um
+commit por lote. O tamanho do lote é ajustável por REDE_BULK_BATCH_SIZE.
+"""
+
+import os
+
+DEFAULT_BATCH_SIZE = 100
+
+# Códigos de tipo SQL do ODBC (os mesmos expostos como pyodbc.SQL_*)
+SQL_VARCHAR = 12
+SQL_INTEGER = 4
+SQL_DOUBLE = 8
+
+
+def varchar(size=255):
+    return (SQL_VARCHAR, size, 0)
+
+
+def integer():
+    return (SQL_INTEGER, 0, 0)
+
+
+def float_():
+    return (SQL_DOUBLE, 0, 0)
+
+
+def batch_size_from_env(default=DEFAULT_BATCH_SIZE):
+    return max(1, int(os.getenv("REDE_BULK_BATCH_SIZE", default)))
+
+
+def write_rows(cursor, query, rows, input_sizes=None, batch_size=None, commit=True):
+    """
+    Executa `query` para todas as linhas em lotes de `batch_size`, com
+    fast_executemany. Faz commit ao fim de cada lote quando commit=True.
+    Retorna o número de linhas enviadas.
+    """
+    batch_size = batch_size or batch_size_from_env()
+    total = 0
+    for start in range(0, len(rows), batch_size):
+        chunk = rows[start:start + batch_size]
+        cursor.fast_executemany = True
+        if input_sizes:
+            cursor.setinputsizes(input_sizes)
+        cursor.executemany(query, chunk)
+        if commit:
+            cursor.connection.commit()
+        total += len(chunk)
+    return total
+
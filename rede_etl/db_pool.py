@@ -0,0 +1,163 @@
+"""
+Pool de conexões com o SQL Server compartilhado por toda a execução.
+
+As conexões devolvidas por acquire() são proxies: chamar close() devolve a
+conexão ao pool (após rollback de qualquer transação pendente) em vez de
+fechá-la, de modo que o código existente que faz connect/close por batch passa
+a reaproveitar conexões já autenticadas. Conexões ociosas há mais de
+`health_check_interval` segundos são testadas com SELECT 1 antes do reuso.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def build_connection_string(driver="ODBC Driver 17 for SQL Server", server=None, port=None,
+                            database=None, user=None, password=None):
+    """Connection string a partir dos parâmetros ou das variáveis DB_*_EXCEL do .env."""
+    return (
+        f"DRIVER={{{driver}}};"
+        f"SERVER={server or os.getenv('DB_SERVER_EXCEL')},{port or os.getenv('DB_PORT_EXCEL')};"
+        f"DATABASE={database or os.getenv('DB_DATABASE_EXCEL')};"
+        f"UID={user or os.getenv('DB_USER_EXCEL')};"
+        f"PWD={password or os.getenv('DB_PASSWORD_EXCEL')}"
+    )
+
+
+def _pyodbc_connect(conn_string):
+    import pyodbc
+    return pyodbc.connect(conn_string)
+
+
+class PooledConnection:
+    """Proxy de uma conexão do pool; close() devolve a conexão em vez de fechá-la."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self):
+        return self._raw.cursor()
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+
+    # Rede de segurança para caminhos de erro que não chegam ao close()
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, conn_string=None, max_size=None, connect=None,
+                 health_check_interval=30, acquire_timeout=600):
+        self.conn_string = conn_string or build_connection_string()
+        self.max_size = max(1, int(max_size or os.getenv("REDE_DB_POOL_SIZE", "10")))
+        self._connect = connect or _pyodbc_connect
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._idle = []  # (conexão, instante em que ficou ociosa)
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _healthy(self, raw, idle_since):
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            cursor = raw.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("Timeout aguardando conexão livre no pool do banco de dados.")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    raw = self._connect(self.conn_string)
+                    with self._lock:
+                        self.created += 1
+                    return PooledConnection(self, raw)
+                raw, idle_since = item
+                if self._healthy(raw, idle_since):
+                    return PooledConnection(self, raw)
+                self._discard(raw)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, raw):
+        try:
+            raw.rollback()
+            with self._lock:
+                self._idle.append((raw, time.monotonic()))
+        except Exception:
+            # Conexão quebrada: descarta e libera a vaga para uma nova
+            self._discard(raw)
+        finally:
+            self._slots.release()
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for raw, _ in idle:
+            self._discard(raw)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(conn_string=None, max_size=None, connect=None):
+    """Pool único do processo, criado na primeira chamada (que define os parâmetros)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(conn_string, max_size=max_size, connect=connect)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
@@ -0,0 +1,96 @@
+"""
+Tabelas de controle do ETL no SQL Server.
+
+As funções recebem um cursor e não fazem commit: quem chama decide se o
+estado é gravado junto com os dados da mesma transação.
+"""
+
+WATERMARK_TABLE = "BD_ETL_Watermark"
+
+
+def ensure_watermark_table(cursor):
+    cursor.execute(f"""
+        IF OBJECT_ID('{WATERMARK_TABLE}', 'U') IS NULL
+            CREATE TABLE {WATERMARK_TABLE} (
+                Processo VARCHAR(100) NOT NULL PRIMARY KEY,
+                Valor BIGINT NOT NULL,
+                AtualizadoEm DATETIME NOT NULL DEFAULT GETDATE()
+            )
+    """)
+
+
+def get_watermark(cursor, processo, default=0):
+    """Retorna o último valor gravado para o processo, ou `default` se não houver."""
+    ensure_watermark_table(cursor)
+    cursor.execute(f"SELECT Valor FROM {WATERMARK_TABLE} WHERE Processo = ?", (processo,))
+    row = cursor.fetchone()
+    return row[0] if row else default
+
+
+def set_watermark(cursor, processo, valor):
+    ensure_watermark_table(cursor)
+    cursor.execute(f"""
+        MERGE {WATERMARK_TABLE} AS alvo
+        USING (SELECT ? AS Processo, ? AS Valor) AS origem
+            ON alvo.Processo = origem.Processo
+        WHEN MATCHED THEN
+            UPDATE SET Valor = origem.Valor, AtualizadoEm = GETDATE()
+        WHEN NOT MATCHED THEN
+            INSERT (Processo, Valor) VALUES (origem.Processo, origem.Valor);
+    """, (processo, valor))
+
+
+CHECKPOINT_TABLE = "BD_ETL_PageCheckpoint"
+
+
+def checkpoint_key(company_number, start_date, end_date):
+    return f"{company_number}:{start_date}:{end_date}"
+
+
+def ensure_checkpoint_table(cursor):
+    cursor.execute(f"""
+        IF OBJECT_ID('{CHECKPOINT_TABLE}', 'U') IS NULL
+            CREATE TABLE {CHECKPOINT_TABLE} (
+                Endpoint VARCHAR(100) NOT NULL,
+                Chave VARCHAR(200) NOT NULL,
+                PageKey VARCHAR(500) NOT NULL,
+                AtualizadoEm DATETIME NOT NULL DEFAULT GETDATE(),
+                CONSTRAINT PK_{CHECKPOINT_TABLE} PRIMARY KEY (Endpoint, Chave)
+            )
+    """)
+
+
+def get_checkpoint(cursor, endpoint, chave):
+    """
+    Retorna o pageKey da próxima página a buscar para (endpoint, chave), ou
+    None se não houver extração interrompida.
+    """
+    ensure_checkpoint_table(cursor)
+    cursor.execute(
+        f"SELECT PageKey FROM {CHECKPOINT_TABLE} WHERE Endpoint = ? AND Chave = ?",
+        (endpoint, chave))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_checkpoint(cursor, endpoint, chave, page_key):
+    """Grava o pageKey da próxima página; deve ir no mesmo commit das linhas já gravadas."""
+    ensure_checkpoint_table(cursor)
+    cursor.execute(f"""
+        MERGE {CHECKPOINT_TABLE} AS alvo
+        USING (SELECT ? AS Endpoint, ? AS Chave, ? AS PageKey) AS origem
+            ON alvo.Endpoint = origem.Endpoint AND alvo.Chave = origem.Chave
+        WHEN MATCHED THEN
+            UPDATE SET PageKey = origem.PageKey, AtualizadoEm = GETDATE()
+        WHEN NOT MATCHED THEN
+            INSERT (Endpoint, Chave, PageKey) VALUES (origem.Endpoint, origem.Chave, origem.PageKey);
+    """, (endpoint, chave, str(page_key)))
+
+
+def clear_checkpoint(cursor, endpoint, chave):
+    """Remove o checkpoint ao concluir a extração; a próxima execução começa da primeira página."""
+    ensure_checkpoint_table(cursor)
+    cursor.execute(
+        f"DELETE FROM {CHECKPOINT_TABLE} WHERE Endpoint = ? AND Chave = ?",
+        (endpoint, chave))
+
@@ -0,0 +1,136 @@
+"""
+Execução concorrente de tarefas em um pool de threads.
+
+As chamadas à API são limitadas por I/O, então a concorrência não deve ser
+dimensionada por os.cpu_count(). As funções de tarefa são síncronas
+(requests/pyodbc, I/O bloqueante) e rodam em um ThreadPoolExecutor com
+REDE_MAX_CONCURRENCY threads (padrão 64). Um loop asyncio serve apenas para
+coordenar: limita quantas tarefas ficam em voo, entrega cada resultado a
+on_result assim que sai e permite que o TaskScheduler agende novas tarefas de
+dentro das que estão rodando. Não há I/O assíncrono de verdade.
+
+Uma tarefa que levanta exceção tem o traceback impresso e resultado None; quem
+chama trata None como falha daquela tarefa.
+
+O pool de conexões do http_client é dimensionado uma vez, pelo mesmo
+REDE_MAX_CONCURRENCY, e compartilhado por todas as execuções do processo.
+"""
+
+import asyncio
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CONCURRENCY = 64
+
+
+def _report_failure(func, e):
+    print(f"Erro ao executar tarefa {func.__name__}: {e}")
+    traceback.print_exception(type(e), e, e.__traceback__)
+
+
+def concurrency_limit(limit=None):
+    """Resolve o limite de concorrência: argumento explícito, REDE_MAX_CONCURRENCY ou padrão."""
+    if limit:
+        return max(1, int(limit))
+    return max(1, int(os.getenv("REDE_MAX_CONCURRENCY", DEFAULT_CONCURRENCY)))
+
+
+async def gather_tasks(func, tasks, limit=None, on_result=None):
+    """
+    Executa func(*args) para cada tupla de args em tasks, com no máximo `limit`
+    tarefas simultâneas. Retorna os resultados na ordem das tarefas; tarefas que
+    falharem têm o traceback impresso e resultado None. on_result(args, resultado),
+    se informado, é chamado no loop assim que cada tarefa termina.
+    """
+    limit = concurrency_limit(limit)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(limit)
+
+    with ThreadPoolExecutor(max_workers=limit) as executor:
+        async def run_one(args):
+            async with semaphore:
+                try:
+                    result = await loop.run_in_executor(executor, func, *args)
+                except Exception as e:
+                    _report_failure(func, e)
+                    result = None
+            if on_result is not None:
+                on_result(args, result)
+            return result
+
+        return await asyncio.gather(*(run_one(args) for args in tasks))
+
+
+def run_tasks(func, tasks, limit=None, on_result=None):
+    """Ponto de entrada síncrono para gather_tasks, usado pelos scripts."""
+    return asyncio.run(gather_tasks(func, list(tasks), limit=limit, on_result=on_result))
+
+
+class TaskScheduler:
+    """
+    Agendador de longa duração para grades de tarefas dependentes.
+
+    Todas as tarefas compartilham um único executor e o mesmo limite de
+    concorrência. submit() pode ser chamado antes de run(), de dentro de um
+    on_result ou de dentro de uma tarefa em execução, de modo que etapas
+    seguintes (ex.: busca de parcelas de um dia cujos pagamentos terminaram)
+    entram na mesma fila sem esperar as demais. run() retorna quando não há
+    mais tarefas pendentes.
+
+    on_result(args, resultado) roda no loop asyncio; deve ser leve e delegar
+    trabalho pesado a novas tarefas via submit().
+    """
+
+    def __init__(self, limit=None):
+        self.limit = concurrency_limit(limit)
+        self._queued = []
+        self._loop = None
+        self._loop_thread = None
+        self._running = set()
+
+    def submit(self, func, args=(), on_result=None):
+        item = (func, tuple(args), on_result)
+        if self._loop is None:
+            self._queued.append(item)
+        elif threading.get_ident() == self._loop_thread:
+            self._spawn(*item)
+        else:
+            self._loop.call_soon_threadsafe(self._spawn, *item)
+
+    def run(self):
+        asyncio.run(self._main())
+
+    def _spawn(self, func, args, on_result):
+        self._running.add(asyncio.ensure_future(self._run_one(func, args, on_result)))
+
+    async def _run_one(self, func, args, on_result):
+        async with self._semaphore:
+            try:
+                result = await self._loop.run_in_executor(self._executor, func, *args)
+            except Exception as e:
+                _report_failure(func, e)
+                result = None
+        if on_result is not None:
+            try:
+                on_result(args, result)
+            except Exception as e:
+                print(f"Erro ao tratar resultado de {func.__name__}: {e}")
+                traceback.print_exception(type(e), e, e.__traceback__)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._semaphore = asyncio.Semaphore(self.limit)
+        try:
+            with ThreadPoolExecutor(max_workers=self.limit) as self._executor:
+                queued, self._queued = self._queued, []
+                for item in queued:
+                    self._spawn(*item)
+                while self._running:
+                    done, _ = await asyncio.wait(self._running)
+                    self._running -= done
+        finally:
+            self._loop = None
+            self._loop_thread = None
@@ -0,0 +1,169 @@
+"""
+Cliente HTTP compartilhado para as chamadas à API da Rede.
+
+Mantém uma sessão por processo com pool de conexões keep-alive (e gzip), de
+modo que as milhares de chamadas por NSU reaproveitam a mesma conexão TLS em
+vez de abrir uma nova a cada requisição. O pool é dimensionado uma vez, na
+criação do cliente, pelo número de workers (REDE_HTTP_POOL_SIZE ou
+REDE_MAX_CONCURRENCY); o cliente é compartilhado por todos os jobs do processo
+e só é fechado por close(), no fim da execução. Com REDE_RATE_LIMIT=1 toda requisição passa pelo
+limitador de taxa compartilhado; respostas 429/5xx são repetidas (até
+REDE_HTTP_MAX_RETRIES vezes) respeitando o Retry-After. Com REDE_HTTP2=1 e o pacote httpx[http2] instalado, as
+requisições são multiplexadas em HTTP/2. GETs de períodos já fechados passam
+pelo cache persistente de respostas (response_cache). REDE_API_BASE_URL
+redireciona as chamadas para outro servidor (homologação ou o mock local dos
+benchmarks).
+"""
+
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rede_etl.rate_limiter import backoff, get_rate_limiter, parse_retry_after
+from rede_etl.response_cache import get_response_cache
+
+try:
+    import httpx
+except ImportError:  # HTTP/2 é opcional
+    httpx = None
+
+
+# Sem "Connection: keep-alive": o pool já reaproveita as conexões e o cabeçalho
+# é proibido em HTTP/2
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+}
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+API_BASE_URL = "https://api.userede.com.br"
+
+_pool_size = int(os.getenv("REDE_HTTP_POOL_SIZE") or os.getenv("REDE_MAX_CONCURRENCY") or "64")
+_client = None
+_client_lock = threading.Lock()
+
+
+def configure(pool_size):
+    """
+    Define o tamanho do pool antes da criação do cliente. Depois que o cliente
+    existe não faz nada: fechá-lo derrubaria requisições em voo de outros jobs.
+    """
+    global _pool_size
+    with _client_lock:
+        if _client is None:
+            _pool_size = max(1, int(pool_size))
+
+
+def _http2_habilitado():
+    return httpx is not None and os.getenv("REDE_HTTP2", "0") == "1"
+
+
+def _criar_cliente():
+    if _http2_habilitado():
+        limits = httpx.Limits(max_connections=_pool_size, max_keepalive_connections=_pool_size)
+        return httpx.Client(http2=True, limits=limits, headers=DEFAULT_HEADERS)
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=_pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+
+def get_client():
+    """Retorna o cliente HTTP do processo, criando-o na primeira chamada."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _criar_cliente()
+    return _client
+
+
+def close():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def resolve_url(url):
+    """Troca o host de produção pelo de REDE_API_BASE_URL, se definido."""
+    base = os.getenv("REDE_API_BASE_URL")
+    if base and url.startswith(API_BASE_URL):
+        return base.rstrip("/") + url[len(API_BASE_URL):]
+    return url
+
+
+def request(method, url, params=None, headers=None, data=None, timeout=30):
+    """
+    Executa a requisição respeitando o limitador de taxa. 429 e 5xx são
+    repetidos após o Retry-After (ou backoff); só 429 ou Retry-After reduzem a
+    taxa compartilhada. A última resposta é devolvida se as tentativas se
+    esgotarem.
+    """
+    url = resolve_url(url)
+    limiter = get_rate_limiter()
+    max_retries = int(os.getenv("REDE_HTTP_MAX_RETRIES", "5"))
+    for tentativa in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        response = _send(method, url, params, headers, data, timeout)
+        if response.status_code not in RETRY_STATUS:
+            if limiter is not None:
+                limiter.on_success()
+            return response
+
+        espera = parse_retry_after(response.headers.get("Retry-After"))
+        # Só 429 ou um Retry-After explícito indicam throttling; um 5xx isolado
+        # é repetido com backoff local, sem mexer na taxa compartilhada
+        throttled = response.status_code == 429 or espera is not None
+        if espera is None:
+            espera = backoff(tentativa)
+        if limiter is not None and throttled:
+            # A pausa fica registrada no estado compartilhado e é cumprida no próximo acquire
+            taxa = limiter.on_throttle(espera)
+            print(f"HTTP {response.status_code} em {url}. Taxa reduzida para {taxa:.1f} req/s.")
+        if tentativa == max_retries:
+            break
+        print(f"HTTP {response.status_code} em {url}. Nova tentativa em {espera:.1f}s ({tentativa + 1}/{max_retries})...")
+        if limiter is None or not throttled:
+            time.sleep(espera)
+    return response
+
+
+def _send(method, url, params, headers, data, timeout):
+    """
+    Envia a requisição no cliente compartilhado. Erros do httpx são
+    convertidos nas exceções equivalentes do requests, para que os scripts
+    continuem tratando apenas requests.exceptions.
+    """
+    client = get_client()
+    if httpx is not None and isinstance(client, httpx.Client):
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+        try:
+            return client.request(method, url, params=params, headers=headers, data=data, timeout=timeout)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+    return client.request(method, url, params=params, headers=headers, data=data, timeout=timeout)
+
+
+def get(url, params=None, headers=None, timeout=30):
+    """GET passando pelo cache de respostas (ver response_cache) quando o endpoint tem regra de validade."""
+    cache = get_response_cache()
+    if cache is None:
+        return request("GET", url, params=params, headers=headers, timeout=timeout)
+    return cache.get(url, params, lambda extra: request(
+        "GET", url, params=params, headers={**(headers or {}), **extra}, timeout=timeout))
+
+
+def post(url, data=None, headers=None, timeout=30):
+    return request("POST", url, data=data, headers=headers, timeout=timeout)
@@ -0,0 +1,103 @@
+"""
+Execução de jobs em um grafo de dependências (DAG) dentro de um único processo.
+
+Cada job roda em sua própria thread assim que todas as suas dependências
+terminam com sucesso, e jobs independentes rodam em paralelo. Um job falha se
+levantar exceção ou retornar False; nesse caso os jobs que dependem dele,
+direta ou indiretamente, são pulados. Como tudo roda no mesmo processo, os
+jobs compartilham o TokenManager, o pool HTTP (http_client) e o pool do banco
+(db_pool).
+"""
+
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+SUCCESS = "ok"
+FAILED = "falhou"
+SKIPPED = "pulado"
+
+
+class Job:
+    def __init__(self, name, func, depends_on=()):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+
+
+def check_graph(jobs):
+    """Valida nomes, dependências e ausência de ciclos; levanta ValueError."""
+    by_name = {}
+    for job in jobs:
+        if job.name in by_name:
+            raise ValueError(f"Job duplicado: {job.name}")
+        by_name[job.name] = job
+    for job in jobs:
+        unknown = [dep for dep in job.depends_on if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Job {job.name} depende de jobs inexistentes: {', '.join(unknown)}")
+
+    visiting, visited = set(), set()
+
+    def visit(name, path):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Ciclo de dependências: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        visited.add(name)
+
+    for job in jobs:
+        visit(job.name, [])
+    return by_name
+
+
+def _run_job(job):
+    started = time.time()
+    print(f"[{job.name}] Iniciando.")
+    try:
+        ok = job.func() is not False
+    except Exception as e:
+        traceback.print_exc()
+        print(f"[{job.name}] Erro: {e}")
+        ok = False
+    elapsed = time.time() - started
+    print(f"[{job.name}] {'Concluído' if ok else 'Falhou'} em {elapsed:.1f}s.")
+    return (SUCCESS if ok else FAILED), elapsed
+
+
+def run_graph(jobs, max_workers=None):
+    """
+    Executa os jobs respeitando as dependências e retorna
+    {nome: (status, segundos)}, com status SUCCESS, FAILED ou SKIPPED.
+    """
+    pending = dict(check_graph(jobs))
+    results = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(jobs))) as executor:
+        while pending or running:
+            # Repete até estabilizar: um job pulado pode tornar outros puláveis
+            changed = True
+            while changed:
+                changed = False
+                for name, job in list(pending.items()):
+                    statuses = [results[dep][0] if dep in results else None for dep in job.depends_on]
+                    if any(status in (FAILED, SKIPPED) for status in statuses):
+                        print(f"[{name}] Pulado: dependência não concluída.")
+                        results[name] = (SKIPPED, 0.0)
+                    elif all(status == SUCCESS for status in statuses):
+                        running[executor.submit(_run_job, job)] = name
+                    else:
+                        continue
+                    del pending[name]
+                    changed = True
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
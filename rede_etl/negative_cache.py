@@ -0,0 +1,148 @@
+"""
+Cache negativo persistente para consultas que não trouxeram resultado.
+
+Chaves (processo, merchant, chave) cuja consulta voltou 404, vazia ou com erro
+ficam registradas com o motivo e o número de tentativas, e só voltam à API
+depois de um intervalo que dobra a cada nova falha (até um teto). Assim, vendas
+e pagamentos sem parcelas deixam de consumir chamadas em toda execução, mas
+ainda são reconsultados de tempos em tempos.
+
+Como em etl_state, as funções recebem um cursor e não fazem commit.
+"""
+
+import os
+
+from rede_etl.bulk_writer import varchar, write_rows
+
+NEGATIVE_CACHE_TABLE = "BD_ETL_CacheNegativo"
+
+REASON_NOT_FOUND = "not_found"
+REASON_EMPTY = "empty"
+REASON_ERROR = "error"
+
+# Intervalo inicial por motivo, em minutos: erros podem ser transitórios
+_BASE_MINUTES = {REASON_NOT_FOUND: 24 * 60, REASON_EMPTY: 24 * 60, REASON_ERROR: 60}
+
+
+def max_retry_minutes():
+    return int(float(os.getenv("REDE_CACHE_NEGATIVO_MAX_DIAS", "30")) * 24 * 60)
+
+
+def failure_reason(status_code, data, list_key="installments"):
+    """Motivo da falha de uma consulta, ou None se ela trouxe itens."""
+    if status_code == 404:
+        return REASON_NOT_FOUND
+    if status_code != 200:
+        return REASON_ERROR
+    if not data or not (data.get("content") or {}).get(list_key):
+        return REASON_EMPTY
+    return None
+
+
+def ensure_negative_cache_table(cursor):
+    cursor.execute(f"""
+        IF OBJECT_ID('{NEGATIVE_CACHE_TABLE}', 'U') IS NULL
+            CREATE TABLE {NEGATIVE_CACHE_TABLE} (
+                Processo VARCHAR(50) NOT NULL,
+                Merchant VARCHAR(50) NOT NULL,
+                Chave VARCHAR(100) NOT NULL,
+                Motivo VARCHAR(20) NOT NULL,
+                Tentativas INT NOT NULL,
+                ProximaTentativa DATETIME NOT NULL,
+                AtualizadoEm DATETIME NOT NULL DEFAULT GETDATE(),
+                CONSTRAINT PK_{NEGATIVE_CACHE_TABLE} PRIMARY KEY (Processo, Merchant, Chave)
+            )
+    """)
+
+
+def load_blocked_keys(cursor, processo):
+    """Chaves (merchant, chave), como texto, que ainda não devem ser consultadas."""
+    ensure_negative_cache_table(cursor)
+    cursor.execute(f"""
+        SELECT Merchant, Chave FROM {NEGATIVE_CACHE_TABLE}
+        WHERE Processo = ? AND ProximaTentativa > GETDATE()
+    """, (processo,))
+    return {(row[0], row[1]) for row in cursor.fetchall()}
+
+
+def load_cached_keys(cursor, processo):
+    """Todas as chaves do processo: {(merchant, chave): True se ainda bloqueada}."""
+    ensure_negative_cache_table(cursor)
+    cursor.execute(f"""
+        SELECT Merchant, Chave, CASE WHEN ProximaTentativa > GETDATE() THEN 1 ELSE 0 END
+        FROM {NEGATIVE_CACHE_TABLE}
+        WHERE Processo = ?
+    """, (processo,))
+    return {(row[0], row[1]): bool(row[2]) for row in cursor.fetchall()}
+
+
+def is_blocked(blocked, merchant, chave):
+    return (str(merchant), str(chave)) in blocked
+
+
+def record_failures(cursor, processo, failures):
+    """
+    Registra falhas [(merchant, chave, motivo)]. Cada nova falha da mesma chave
+    incrementa Tentativas e dobra o intervalo até a próxima consulta.
+    """
+    if not failures:
+        return
+    # Uma linha por chave (a última falha vence), exigência do MERGE
+    latest = {(str(merchant), str(chave)): motivo for merchant, chave, motivo in failures}
+    ensure_negative_cache_table(cursor)
+    cursor.execute("IF OBJECT_ID('tempdb..#CacheNegativo') IS NOT NULL DROP TABLE #CacheNegativo")
+    cursor.execute("""
+        CREATE TABLE #CacheNegativo (
+            Merchant VARCHAR(50), Chave VARCHAR(100), Motivo VARCHAR(20), BaseMinutos INT
+        )
+    """)
+    write_rows(cursor, """
+        INSERT INTO #CacheNegativo (Merchant, Chave, Motivo, BaseMinutos) VALUES (?, ?, ?, ?)
+    """, [
+        (merchant, chave, motivo, _BASE_MINUTES.get(motivo, _BASE_MINUTES[REASON_ERROR]))
+        for (merchant, chave), motivo in latest.items()
+    ], [varchar(50), varchar(100), varchar(20), None], commit=False)
+    teto = max_retry_minutes()
+    cursor.execute(f"""
+        MERGE {NEGATIVE_CACHE_TABLE} AS alvo
+        USING #CacheNegativo AS origem
+            ON alvo.Processo = ? AND alvo.Merchant = origem.Merchant AND alvo.Chave = origem.Chave
+        WHEN MATCHED THEN
+            UPDATE SET
+                Motivo = origem.Motivo,
+                Tentativas = alvo.Tentativas + 1,
+                ProximaTentativa = DATEADD(MINUTE,
+                    CASE WHEN alvo.Tentativas >= 20
+                           OR origem.BaseMinutos * POWER(CAST(2 AS BIGINT), alvo.Tentativas) > ?
+                         THEN ?
+                         ELSE origem.BaseMinutos * POWER(CAST(2 AS BIGINT), alvo.Tentativas) END,
+                    GETDATE()),
+                AtualizadoEm = GETDATE()
+        WHEN NOT MATCHED THEN
+            INSERT (Processo, Merchant, Chave, Motivo, Tentativas, ProximaTentativa)
+            VALUES (?, origem.Merchant, origem.Chave, origem.Motivo, 1,
+                    DATEADD(MINUTE, origem.BaseMinutos, GETDATE()));
+    """, (processo, teto, teto, processo))
+    cursor.execute("DROP TABLE #CacheNegativo")
+
+
+def clear_keys(cursor, processo, keys, chunk_size=500):
+    """Remove do cache as chaves [(merchant, chave)] que voltaram a trazer resultado."""
+    keys = [(str(merchant), str(chave)) for merchant, chave in keys]
+    if not keys:
+        return
+    ensure_negative_cache_table(cursor)
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        cursor.execute(f"""
+            DELETE FROM {NEGATIVE_CACHE_TABLE}
+            WHERE Processo = ? AND ({" OR ".join("(Merchant = ? AND Chave = ?)" for _ in chunk)})
+        """, [processo] + [value for key in chunk for value in key])
+
+
+def summarize(failures):
+    """Contagem de falhas por motivo, para os logs de execução."""
+    counts = {}
+    for _merchant, _chave, motivo in failures:
+        counts[motivo] = counts.get(motivo, 0) + 1
+    return ", ".join(f"{motivo}: {total}" for motivo, total in sorted(counts.items())) or "nenhuma"
@@ -0,0 +1,9 @@
+import os
+from pathlib import Path
+
+
+def data_dir():
+    """Diretório de dados locais persistentes do ETL (REDE_ETL_DATA_DIR ou ~/.rede_etl)."""
+    path = Path(os.getenv("REDE_ETL_DATA_DIR") or Path.home() / ".rede_etl")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,164 @@
+"""
+Índice persistente das chaves (NSU, merchantId) já presentes em
+BD_Parcelas_Detalhadas.
+
+As chaves ficam em um arquivo ordenado de pares uint64 big-endian (16 bytes
+por chave), lido via mmap e consultado por busca binária, então a memória não
+cresce com o histórico. A cada execução o índice é sincronizado só com as
+linhas de id acima do último id já indexado.
+"""
+
+import heapq
+import json
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+
+from rede_etl.file_lock import FileLock
+from rede_etl.paths import data_dir
+
+MAGIC = b"RPIX"
+HEADER = struct.Struct(">4sxxxxQQ")  # magic, quantidade de chaves, último id sincronizado
+RECORD = struct.Struct(">QQ")
+FETCH_SIZE = 50000
+
+
+def _pack(nsu, merchant_id):
+    """Empacota a chave; retorna None se NSU/merchantId não forem inteiros."""
+    try:
+        nsu, merchant_id = int(nsu), int(merchant_id)
+    except (TypeError, ValueError):
+        return None
+    if not (0 <= nsu < 2 ** 64 and 0 <= merchant_id < 2 ** 64):
+        return None
+    return RECORD.pack(nsu, merchant_id)
+
+
+class ProcessedIndex:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else data_dir() / "parcelas_processadas.idx"
+        self.extras_path = self.path.with_name(self.path.name + ".extras.json")
+        self.count = 0
+        self.last_id = 0
+        self._file = None
+        self._mmap = None
+        self._extras = set()   # chaves não numéricas (raras), mantidas em JSON
+        self._novos = set()    # chaves processadas nesta execução
+        self._lock = threading.Lock()
+        self._abrir()
+
+    def _abrir(self):
+        if os.path.exists(self.extras_path):
+            with open(self.extras_path, "r", encoding="utf-8") as f:
+                self._extras = {tuple(k) for k in json.load(f)}
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size:
+            return
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.last_id = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Arquivo de índice inválido: {self.path}")
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+    def _record(self, i):
+        offset = HEADER.size + i * RECORD.size
+        return self._mmap[offset:offset + RECORD.size]
+
+    def _iter_records(self):
+        for i in range(self.count):
+            yield self._record(i)
+
+    def _busca(self, chave):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid) < chave:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.count and self._record(lo) == chave
+
+    def __contains__(self, key):
+        nsu, merchant_id = key
+        if key in self._novos:
+            return True
+        chave = _pack(nsu, merchant_id)
+        if chave is None:
+            return (str(nsu), str(merchant_id)) in self._extras
+        return self._mmap is not None and self._busca(chave)
+
+    def __len__(self):
+        return self.count + len(self._extras)
+
+    def add(self, key):
+        """Marca a chave como processada nesta execução (a persistência vem do sync)."""
+        with self._lock:
+            self._novos.add(key)
+
+    def sync(self, cursor):
+        """Incorpora ao índice as linhas de BD_Parcelas_Detalhadas com id acima do último sincronizado."""
+        with FileLock(str(self.path) + ".lock", timeout=600):
+            # Outra execução pode ter sincronizado enquanto esperávamos o lock
+            self.close()
+            self._abrir()
+            return self._sync(cursor)
+
+    def _sync(self, cursor):
+        cursor.execute("""
+            SELECT id, NSU, merchantId
+            FROM BD_Parcelas_Detalhadas
+            WHERE id > ?
+        """, (self.last_id,))
+        novas = set()
+        novas_extras = set()
+        last_id = self.last_id
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row_id, nsu, merchant_id in rows:
+                last_id = max(last_id, row_id)
+                chave = _pack(nsu, merchant_id)
+                if chave is None:
+                    novas_extras.add((str(nsu), str(merchant_id)))
+                else:
+                    novas.add(chave)
+
+        if last_id != self.last_id:
+            self._gravar(sorted(novas), last_id)
+        if novas_extras - self._extras:
+            self._extras |= novas_extras
+            with open(self.extras_path, "w", encoding="utf-8") as f:
+                json.dump(sorted(self._extras), f)
+        return len(novas) + len(novas_extras)
+
+    def _gravar(self, novas, last_id):
+        """Mescla as chaves novas com as existentes em um arquivo novo e troca atomicamente."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        count = 0
+        anterior = None
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, 0, last_id))
+            buffer = bytearray()
+            for chave in heapq.merge(self._iter_records(), novas):
+                if chave == anterior:
+                    continue
+                buffer += chave
+                anterior = chave
+                count += 1
+                if len(buffer) >= 1 << 20:
+                    f.write(buffer)
+                    buffer.clear()
+            f.write(buffer)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, count, last_id))
+        self.close()
+        os.replace(tmp_path, self.path)
+        self._abrir()
@@ -0,0 +1,160 @@
+"""
+Limitador de taxa adaptativo (AIMD) compartilhado entre threads, processos e
+scripts rodando ao mesmo tempo na mesma máquina.
+
+Cada processo mantém em memória um balde de tokens (taxa atual, tokens
+disponíveis e pausa imposta por Retry-After); cada requisição consome um token
+sem tocar no disco. Respostas bem-sucedidas aumentam a taxa aos poucos
+(aumento aditivo). Só sinais explícitos de throttling reduzem a taxa pela
+metade (redução multiplicativa): 429 ou qualquer resposta com Retry-After, que
+também pausa todos os clientes pelo tempo pedido. Um 5xx isolado sem
+Retry-After não altera a taxa; quem chamou só espera um backoff antes de
+repetir aquela requisição.
+
+A taxa e a pausa são sincronizadas com um arquivo local protegido por FileLock
+a cada REDE_RATE_SYNC_S segundos (e logo após um throttling): cada processo
+adota a taxa menor e a pausa mais longa que encontrar no arquivo e grava as
+suas. Desligado por padrão (REDE_RATE_LIMIT=1 liga) até ser calibrado contra
+a API real; o piso de REDE_RATE_MIN req/s evita que poucas falhas derrubem a
+vazão.
+"""
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+from rede_etl.file_lock import FileLock
+
+
+def parse_retry_after(value):
+    """Converte o header Retry-After (segundos ou data HTTP) em segundos de espera."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    def __init__(self, path=None, taxa_inicial=None, taxa_min=None, taxa_max=None,
+                 incremento=2.0, fator_reducao=0.5, burst=None, intervalo_sync=None):
+        self.path = Path(path or os.getenv("REDE_RATE_LIMIT_STATE")
+                         or Path(tempfile.gettempdir()) / "rede_rate_limiter.json")
+        self.lock = FileLock(str(self.path) + ".lock")
+        self.taxa_inicial = float(taxa_inicial or os.getenv("REDE_RATE_INICIAL", "100"))
+        self.taxa_min = float(taxa_min or os.getenv("REDE_RATE_MIN", "10"))
+        self.taxa_max = float(taxa_max or os.getenv("REDE_RATE_MAX", "200"))
+        self.incremento = incremento
+        self.fator_reducao = fator_reducao
+        self.burst = float(burst or self.taxa_max)
+        self.intervalo_sync = float(intervalo_sync or os.getenv("REDE_RATE_SYNC_S", "5"))
+        self._thread_lock = threading.Lock()
+        agora = time.time()
+        self.taxa = self.taxa_inicial
+        self.tokens = self.taxa_inicial
+        self.atualizado_em = agora
+        self.pausa_ate = 0.0
+        self._sincronizado_em = 0.0
+        self._reduzido_em = 0.0
+
+    def _reabastecer(self, agora):
+        decorrido = max(0.0, agora - self.atualizado_em)
+        self.tokens = min(self.burst, self.tokens + decorrido * self.taxa)
+        self.atualizado_em = agora
+
+    def _sincronizar(self, agora):
+        """Troca taxa e pausa com os outros processos pelo arquivo de estado."""
+        self._sincronizado_em = agora
+        try:
+            with self.lock:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        estado = json.load(f)
+                    # Só vale o estado recente gravado por outro processo
+                    if (estado.get("pid") != os.getpid()
+                            and agora - estado.get("atualizado_em", 0) < 10 * self.intervalo_sync):
+                        self.taxa = max(self.taxa_min, min(self.taxa, estado["taxa"]))
+                        self.pausa_ate = max(self.pausa_ate, estado["pausa_ate"])
+                except (OSError, ValueError, KeyError):
+                    pass
+                tmp_path = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"taxa": self.taxa, "pausa_ate": self.pausa_ate, "atualizado_em": agora,
+                               "pid": os.getpid()}, f)
+                os.replace(tmp_path, self.path)
+        except (OSError, TimeoutError) as e:
+            # Sem o arquivo o limitador continua valendo para o processo
+            print(f"Erro ao sincronizar o limitador de taxa: {e}")
+
+    def acquire(self):
+        """Bloqueia até haver um token disponível e nenhuma pausa em vigor."""
+        while True:
+            with self._thread_lock:
+                agora = time.time()
+                if agora - self._sincronizado_em >= self.intervalo_sync:
+                    self._sincronizar(agora)
+                self._reabastecer(agora)
+                if self.pausa_ate > agora:
+                    espera = self.pausa_ate - agora
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    espera = (1 - self.tokens) / self.taxa
+            time.sleep(min(espera, 5.0))
+
+    def on_success(self):
+        # Aumento aditivo: ~`incremento` req/s a cada segundo de respostas sem throttling
+        with self._thread_lock:
+            self.taxa = min(self.taxa_max, self.taxa + self.incremento / max(self.taxa, 1.0))
+
+    def on_throttle(self, espera=None):
+        """
+        Reduz a taxa (no máximo uma vez por segundo, sem passar de taxa_min) e,
+        se informado, pausa todos os clientes por `espera` segundos. Retorna a
+        nova taxa.
+        """
+        with self._thread_lock:
+            agora = time.time()
+            self._reabastecer(agora)
+            # Uma rajada de 429 das requisições já em voo conta como um único sinal
+            if agora - self._reduzido_em >= 1.0:
+                self._reduzido_em = agora
+                self.taxa = max(self.taxa_min, self.taxa * self.fator_reducao)
+                self.tokens = min(self.tokens, 0.0)
+            if espera:
+                self.pausa_ate = max(self.pausa_ate, agora + espera)
+            # Os outros processos precisam saber logo
+            self._sincronizar(agora)
+            return self.taxa
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Retorna o limitador do processo, ou None se REDE_RATE_LIMIT não for 1."""
+    global _limiter
+    if os.getenv("REDE_RATE_LIMIT", "0") != "1":
+        return None
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+
+def backoff(tentativa, base=1.0, maximo=60.0):
+    """Espera exponencial com jitter para quando não há Retry-After."""
+    return min(maximo, base * (2 ** tentativa)) * random.uniform(0.5, 1.0)
@@ -0,0 +1,120 @@
+"""
+Reconciliação de períodos fechados por diferença, sem apagar e recarregar.
+
+O período é carregado numa tabela de staging persistente ({tabela}_Reconcile,
+mesmas colunas + RowHash). Depois, dia a dia e cada dia na sua transação, a
+tabela viva recebe só a diferença: linhas cujo RowHash não veio da API são
+apagadas e linhas novas são inseridas; as que não mudaram não são tocadas.
+Uma linha alterada aparece como a remoção do hash antigo e a inserção do novo.
+
+O staging sobrevive a falhas, então uma carga interrompida pode ser retomada
+(junto com os checkpoints de paginação) antes de aplicar a diferença. Um
+recorte (empresa e período) que volta a ser baixado do início tem antes as
+suas linhas apagadas do staging (clear_staging_slice), para que o hash de uma
+linha alterada ou removida na API desde a carga anterior não sobreviva.
+"""
+
+from rede_etl.row_hash import HASH_COLUMN
+
+
+def staging_table_name(table):
+    return f"{table}_Reconcile"
+
+
+def prepare_staging(cursor, table, columns, date_column, start_date, end_date):
+    """
+    Cria a tabela de staging de `table`, se necessário, e descarta linhas de
+    outros períodos. Linhas do próprio período são mantidas para retomada.
+    Retorna o nome da tabela de staging. Não faz commit.
+    """
+    staging = staging_table_name(table)
+    all_columns = ", ".join(columns + [HASH_COLUMN])
+    cursor.execute(f"""
+        IF OBJECT_ID('{staging}', 'U') IS NULL
+            SELECT TOP 0 {all_columns} INTO {staging} FROM {table}
+    """)
+    cursor.execute(f"""
+        IF NOT EXISTS (
+            SELECT 1 FROM sys.indexes
+            WHERE name = 'IX_{staging}_{HASH_COLUMN}' AND object_id = OBJECT_ID('{staging}')
+        )
+            CREATE INDEX IX_{staging}_{HASH_COLUMN} ON {staging} ({HASH_COLUMN})
+    """)
+    cursor.execute(
+        f"DELETE FROM {staging} WHERE {date_column} NOT BETWEEN ? AND ? OR {date_column} IS NULL",
+        (start_date, end_date))
+    return staging
+
+
+def clear_staging_slice(cursor, staging, date_column, start_date, end_date, key_column, key):
+    """
+    Apaga do staging as linhas de um recorte (período de `date_column` e um
+    valor de `key_column`) antes de recarregá-lo do início. Não faz commit.
+    """
+    # A chave vai como texto: a coluna pode ser varchar com valores não numéricos
+    cursor.execute(
+        f"DELETE FROM {staging} WHERE {date_column} BETWEEN ? AND ? AND {key_column} = ?",
+        (start_date, end_date, str(key)))
+    return max(cursor.rowcount, 0)
+
+
+def apply_day(cursor, table, columns, date_column, day):
+    """
+    Aplica em `table` a diferença do staging para um dia. Não faz commit.
+    Retorna (apagadas, inseridas).
+    """
+    staging = staging_table_name(table)
+    all_columns = ", ".join(columns + [HASH_COLUMN])
+    cursor.execute(f"""
+        DELETE t FROM {table} AS t
+        WHERE t.{date_column} = ?
+          AND (t.{HASH_COLUMN} IS NULL
+               OR NOT EXISTS (
+                   SELECT 1 FROM {staging} AS s
+                   WHERE s.{HASH_COLUMN} = t.{HASH_COLUMN} AND s.{date_column} = ?
+               ))
+    """, (day, day))
+    deleted = max(cursor.rowcount, 0)
+    cursor.execute(f"""
+        INSERT INTO {table} ({all_columns})
+        SELECT {all_columns}
+        FROM {staging} AS s
+        WHERE s.{date_column} = ?
+          AND NOT EXISTS (
+              SELECT 1 FROM {table} AS t WHERE t.{HASH_COLUMN} = s.{HASH_COLUMN}
+          )
+    """, (day,))
+    inserted = max(cursor.rowcount, 0)
+    return deleted, inserted
+
+
+def reconcile_period(conn, table, columns, date_column, days):
+    """
+    Aplica a diferença de cada dia em sua própria transação e, ao final, limpa
+    o staging do período. Um dia que falhar sofre rollback e mantém o staging
+    para a próxima execução. Retorna (apagadas, inseridas) no total.
+    """
+    cursor = conn.cursor()
+    staging = staging_table_name(table)
+    total_deleted = total_inserted = 0
+    failed = False
+    for day in days:
+        try:
+            deleted, inserted = apply_day(cursor, table, columns, date_column, day)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            failed = True
+            print(f"Erro ao reconciliar {table} no dia {day}: {e}")
+            continue
+        total_deleted += deleted
+        total_inserted += inserted
+        if deleted or inserted:
+            print(f"{table} {day}: {deleted} linhas removidas, {inserted} inseridas.")
+
+    if not failed and days:
+        cursor.execute(
+            f"DELETE FROM {staging} WHERE {date_column} BETWEEN ? AND ?",
+            (min(days), max(days)))
+        conn.commit()
+    return total_deleted, total_inserted
@@ -0,0 +1,279 @@
+"""
+Cache persistente (sqlite) de respostas GET da API da Rede.
+
+A chave é o endpoint mais os parâmetros normalizados (ordenados, sem valores
+None). Cada endpoint tem uma regra de validade:
+
+- vendas e pagamentos com data final anterior a REDE_HTTP_CACHE_DIAS_IMUTAVEL
+  (padrão 3) dias atrás são tratados como liquidados e imutáveis; na janela
+  D-7..D-1 da opção 4 de VendasRede, D-7..D-4 vêm do cache, e o reprocessamento
+  do mês anterior também (split_settled_period separa o trecho liquidado de
+  uma janela, para que ele tenha a sua própria chave no cache);
+- resumos de recebíveis de períodos já encerrados (data final antes de hoje)
+  são imutáveis. Os de períodos em aberto (tudo o que RecebiveisMensal e
+  RecebiveisSemanal consultam hoje) mudam ao longo do dia e por padrão não são
+  guardados; REDE_HTTP_CACHE_HORAS_RECEBIVEIS > 0 os guarda por essa
+  quantidade de horas;
+- endpoints sem regra (parcelas, token) nunca são guardados.
+
+Entradas vencidas com ETag/Last-Modified são revalidadas com requisição
+condicional; um 304 renova a entrada sem baixar o corpo de novo. O tamanho
+total é limitado por REDE_HTTP_CACHE_MB, descartando as entradas usadas há
+mais tempo (LRU). REDE_HTTP_CACHE=0 desliga o cache.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from rede_etl.paths import data_dir
+
+DAY = 24 * 60 * 60
+
+
+def _immutable_days():
+    return int(os.getenv("REDE_HTTP_CACHE_DIAS_IMUTAVEL", "3"))
+
+
+def _end_date(params):
+    value = (params or {}).get("endDate") or (params or {}).get("startDate")
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _closed_period_ttl(params, days=None):
+    """Períodos encerrados há mais de N dias não mudam mais; os recentes não são guardados."""
+    end = _end_date(params)
+    if days is None:
+        days = _immutable_days()
+    if end and end < date.today() - timedelta(days=days):
+        return 30 * DAY
+    return None
+
+
+def split_settled_period(start_date, end_date):
+    """
+    Divide o período (YYYY-MM-DD) em [trecho já imutável, trecho recente],
+    para que uma janela como D-7..D-1 reaproveite do cache os dias liquidados.
+    Sem cache, ou se o período não cruza o corte, devolve o período inteiro.
+    """
+    if os.getenv("REDE_HTTP_CACHE", "1") == "0":
+        return [(start_date, end_date)]
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    last_settled = date.today() - timedelta(days=_immutable_days() + 1)
+    if not start <= last_settled < end:
+        return [(start_date, end_date)]
+    return [(start_date, last_settled.isoformat()),
+            ((last_settled + timedelta(days=1)).isoformat(), end_date)]
+
+
+def _receivables_ttl(params):
+    # Recebíveis de um período que já terminou não mudam mais
+    ttl = _closed_period_ttl(params, days=0)
+    if ttl:
+        return ttl
+    # Períodos em aberto só são guardados se REDE_HTTP_CACHE_HORAS_RECEBIVEIS for configurado
+    hours = float(os.getenv("REDE_HTTP_CACHE_HORAS_RECEBIVEIS", "0"))
+    return hours * 60 * 60 if hours > 0 else None
+
+
+# (padrão da URL, validade em segundos a partir dos parâmetros; None = não guardar)
+TTL_RULES = [
+    (re.compile(r"/merchant-statement/v\d+/sales$"), _closed_period_ttl),
+    (re.compile(r"/merchant-statement/v\d+/payments$"), _closed_period_ttl),
+    (re.compile(r"/merchant-statement/v\d+/receivables/summary$"), _receivables_ttl),
+]
+
+
+def cache_key(url, params=None):
+    normalized = sorted((str(k), str(v)) for k, v in (params or {}).items() if v is not None)
+    return f"{url}?{urlencode(normalized)}"
+
+
+class CachedEntry:
+    def __init__(self, key, status, headers, body, etag, last_modified, expires_at):
+        self.key = key
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires_at
+
+    def validators(self):
+        """Cabeçalhos da requisição condicional de revalidação."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_response(self, url):
+        response = requests.models.Response()
+        response.status_code = self.status
+        response._content = self.body
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.encoding = "utf-8"
+        response.url = url
+        response.from_cache = True
+        return response
+
+
+class ResponseCache:
+    def __init__(self, path=None, max_bytes=None):
+        self.path = str(path or data_dir() / "http_cache.sqlite")
+        self.max_bytes = max_bytes or int(float(os.getenv("REDE_HTTP_CACHE_MB", "512")) * 1024 * 1024)
+        self._local = threading.local()
+        self._size_lock = threading.Lock()
+        self.hits = self.misses = self.revalidated = 0
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS respostas (
+                chave TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                cabecalhos TEXT NOT NULL,
+                corpo BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expira_em REAL NOT NULL,
+                ultimo_acesso REAL NOT NULL,
+                tamanho INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_respostas_acesso ON respostas (ultimo_acesso)")
+        conn.commit()
+        self._total = conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+
+    def _conn(self):
+        # Uma conexão sqlite por thread; WAL permite leituras concorrentes entre processos
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def ttl_for(self, url, params=None):
+        """Validade da resposta em segundos, ou None se o endpoint não deve ser guardado."""
+        path = url.split("?", 1)[0].rstrip("/")
+        for pattern, rule in TTL_RULES:
+            if pattern.search(path):
+                return rule(params)
+        return None
+
+    def lookup(self, url, params=None):
+        key = cache_key(url, params)
+        conn = self._conn()
+        row = conn.execute("""
+            SELECT status, cabecalhos, corpo, etag, last_modified, expira_em
+            FROM respostas WHERE chave = ?
+        """, (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE respostas SET ultimo_acesso = ? WHERE chave = ?", (time.time(), key))
+        conn.commit()
+        return CachedEntry(key, row[0], json.loads(row[1]), row[2], row[3], row[4], row[5])
+
+    def store(self, url, params, response, ttl):
+        if response.status_code != 200:
+            return
+        body = response.content
+        headers = {k: v for k, v in response.headers.items() if k.lower() in ("content-type", "etag", "last-modified")}
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        key = cache_key(url, params)
+        now = time.time()
+        conn = self._conn()
+        previous = conn.execute("SELECT tamanho FROM respostas WHERE chave = ?", (key,)).fetchone()
+        conn.execute("""
+            INSERT OR REPLACE INTO respostas
+                (chave, status, cabecalhos, corpo, etag, last_modified, expira_em, ultimo_acesso, tamanho)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (key, response.status_code, json.dumps(headers), body,
+              response.headers.get("ETag"), response.headers.get("Last-Modified"), now + ttl, now, size))
+        conn.commit()
+        with self._size_lock:
+            self._total += size - (previous[0] if previous else 0)
+            over = self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def refresh(self, entry, ttl):
+        """Renova a validade após um 304 da revalidação."""
+        entry.expires_at = time.time() + ttl
+        conn = self._conn()
+        conn.execute("UPDATE respostas SET expira_em = ?, ultimo_acesso = ? WHERE chave = ?",
+                     (entry.expires_at, time.time(), entry.key))
+        conn.commit()
+
+    def _evict(self):
+        """Remove as entradas usadas há mais tempo até o total voltar a 90% do limite."""
+        target = self.max_bytes * 0.9
+        conn = self._conn()
+        with self._size_lock:
+            while self._total > target:
+                rows = conn.execute(
+                    "SELECT chave, tamanho FROM respostas ORDER BY ultimo_acesso LIMIT 100").fetchall()
+                if not rows:
+                    self._total = 0
+                    break
+                conn.executemany("DELETE FROM respostas WHERE chave = ?", [(row[0],) for row in rows])
+                self._total -= sum(row[1] for row in rows)
+            conn.commit()
+
+    def get(self, url, params, send):
+        """
+        GET com cache. send(cabecalhos_extras) faz a requisição real; é chamado
+        só quando não há entrada válida, com os cabeçalhos condicionais da
+        entrada vencida, se houver.
+        """
+        ttl = self.ttl_for(url, params)
+        if not ttl:
+            return send({})
+        entry = self.lookup(url, params)
+        if entry is not None and entry.fresh:
+            self.hits += 1
+            return entry.to_response(url)
+
+        response = send(entry.validators() if entry is not None else {})
+        if response.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            self.refresh(entry, ttl)
+            return entry.to_response(url)
+        self.misses += 1
+        self.store(url, params, response, ttl)
+        return response
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Cache do processo, ou None se REDE_HTTP_CACHE=0."""
+    global _cache
+    if os.getenv("REDE_HTTP_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,119 @@
+"""
+Cargas idempotentes por hash de conteúdo.
+
+Cada linha recebe, na transformação, um SHA-256 dos seus valores (RowHash,
+BINARY(32), indexado). A carga passa por uma tabela temporária e só insere os
+hashes que ainda não existem na tabela de destino, então recargas do mesmo
+período não geram duplicatas.
+"""
+
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from rede_etl.bulk_writer import write_rows
+
+HASH_COLUMN = "RowHash"
+
+
+def _normalize(value):
+    if value is None:
+        return "\x00"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float, Decimal)):
+        # 10, 10.0 e Decimal("10.00") geram o mesmo hash
+        try:
+            return format(Decimal(str(value)).normalize(), "f")
+        except InvalidOperation:
+            return str(value)
+    return str(value)
+
+
+def row_hash(values):
+    """SHA-256 (32 bytes) dos valores da linha, na ordem das colunas."""
+    payload = "\x1f".join(_normalize(v) for v in values)
+    return hashlib.sha256(payload.encode("utf-8")).digest()
+
+
+def ensure_row_hash_column(cursor, table, columns=None):
+    """
+    Cria a coluna RowHash e o índice sobre ela, se ainda não existirem. Com
+    `columns` (as colunas do hash, na ordem da transformação), preenche o hash
+    das linhas antigas; ver backfill_row_hash.
+    """
+    cursor.execute(f"""
+        IF COL_LENGTH('{table}', '{HASH_COLUMN}') IS NULL
+            ALTER TABLE {table} ADD {HASH_COLUMN} BINARY(32) NULL
+    """)
+    cursor.execute(f"""
+        IF NOT EXISTS (
+            SELECT 1 FROM sys.indexes
+            WHERE name = 'IX_{table}_{HASH_COLUMN}' AND object_id = OBJECT_ID('{table}')
+        )
+            CREATE INDEX IX_{table}_{HASH_COLUMN} ON {table} ({HASH_COLUMN})
+    """)
+    cursor.connection.commit()
+    if columns:
+        backfill_row_hash(cursor, table, columns)
+
+
+def backfill_row_hash(cursor, table, columns, chunk_size=5000):
+    """
+    Calcula o RowHash das linhas gravadas antes da coluna existir, para que
+    elas entrem no anti-join de insert_new_rows e não sejam duplicadas a cada
+    recarga. Percorre a tabela por id em blocos, com commit a cada bloco; depois
+    da primeira passagem não sobram linhas sem hash e a consulta só toca o
+    índice. Retorna o número de linhas preenchidas.
+    """
+    total = 0
+    last_id = 0
+    while True:
+        cursor.execute(f"""
+            SELECT TOP (?) id, {", ".join(columns)}
+            FROM {table}
+            WHERE {HASH_COLUMN} IS NULL AND id > ?
+            ORDER BY id
+        """, (chunk_size, last_id))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        write_rows(cursor, f"UPDATE {table} SET {HASH_COLUMN} = ? WHERE id = ?", [
+            (row_hash(tuple(row)[1:]), row[0]) for row in rows
+        ], commit=False)
+        cursor.connection.commit()
+        total += len(rows)
+        last_id = rows[-1][0]
+    if total:
+        print(f"RowHash preenchido em {total} linhas antigas de {table}.")
+    return total
+
+
+def insert_new_rows(cursor, table, columns, rows, input_sizes=None):
+    """
+    Insere em `table` apenas as linhas cujo hash ainda não existe. Cada linha
+    de `rows` traz os valores de `columns` seguidos do RowHash. Não faz commit.
+    Retorna o número de linhas efetivamente inseridas.
+    """
+    staging = f"#Staging_{table}"
+    all_columns = ", ".join(columns + [HASH_COLUMN])
+    cursor.execute(f"IF OBJECT_ID('tempdb..{staging}') IS NOT NULL DROP TABLE {staging}")
+    cursor.execute(f"SELECT TOP 0 {all_columns} INTO {staging} FROM {table}")
+    write_rows(cursor, f"""
+        INSERT INTO {staging} ({all_columns})
+        VALUES ({", ".join("?" for _ in columns)}, ?)
+    """, rows, (input_sizes + [None]) if input_sizes else None, commit=False)
+    cursor.execute(f"""
+        INSERT INTO {table} ({all_columns})
+        SELECT {all_columns}
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY {HASH_COLUMN} ORDER BY (SELECT NULL)) AS rn
+            FROM {staging}
+        ) AS s
+        WHERE s.rn = 1
+          AND NOT EXISTS (
+              SELECT 1 FROM {table} AS t WHERE t.{HASH_COLUMN} = s.{HASH_COLUMN}
+          )
+    """)
+    inserted = cursor.rowcount
+    cursor.execute(f"DROP TABLE {staging}")
+    return max(inserted, 0)
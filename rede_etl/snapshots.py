@@ -0,0 +1,136 @@
+"""
+Snapshots versionados por execução, com tabela "atual" e retenção.
+
+Cada execução grava suas linhas no histórico marcadas com o mesmo ExecucaoEm
+(data/hora de início da execução). Em seguida a tabela {tabela}_Atual, com
+índice clusterizado único nas colunas de negócio, recebe o valor mais recente
+de cada chave via MERGE; consumidores leem dela sem procurar a última execução
+no histórico. Chaves que não vieram na execução (ex.: empresa com erro na API)
+mantêm o último valor conhecido.
+
+evict_current remove da tabela atual as chaves que saíram da janela consultada
+(ex.: meses anteriores ao primeiro mês da execução), para que ela continue do
+tamanho de uma execução.
+
+prune_runs descarta do histórico as execuções além das N mais recentes, em
+blocos, para não inflar o log de transações. Só age quando há mais de N
+execuções registradas; linhas antigas sem ExecucaoEm nunca são removidas por
+ela.
+
+As funções recebem um cursor; publish_current e evict_current não fazem
+commit, para entrar na mesma transação da gravação do histórico.
+"""
+
+import os
+
+RUN_COLUMN = "ExecucaoEm"
+
+
+def current_table_name(table):
+    return f"{table}_Atual"
+
+
+def retention_from_env(name, default=30):
+    """Quantas execuções manter no histórico; 0 mantém todas."""
+    return max(0, int(os.getenv(name, str(default))))
+
+
+def ensure_snapshot_tables(cursor, table, key_columns, value_columns):
+    """Cria a coluna de execução no histórico e a tabela atual, se necessário."""
+    current = current_table_name(table)
+    cursor.execute(f"""
+        IF COL_LENGTH('{table}', '{RUN_COLUMN}') IS NULL
+            ALTER TABLE {table} ADD {RUN_COLUMN} DATETIME2(0) NULL
+    """)
+    cursor.execute(f"""
+        IF NOT EXISTS (
+            SELECT 1 FROM sys.indexes
+            WHERE name = 'IX_{table}_{RUN_COLUMN}' AND object_id = OBJECT_ID('{table}')
+        )
+            CREATE INDEX IX_{table}_{RUN_COLUMN} ON {table} ({RUN_COLUMN})
+    """)
+    columns = ", ".join(key_columns + value_columns + [RUN_COLUMN])
+    cursor.execute(f"""
+        IF OBJECT_ID('{current}', 'U') IS NULL
+            SELECT TOP 0 {columns} INTO {current} FROM {table}
+    """)
+    cursor.execute(f"""
+        IF NOT EXISTS (
+            SELECT 1 FROM sys.indexes
+            WHERE name = 'UX_{current}' AND object_id = OBJECT_ID('{current}')
+        )
+            CREATE UNIQUE CLUSTERED INDEX UX_{current} ON {current} ({", ".join(key_columns)})
+    """)
+    cursor.connection.commit()
+
+
+def publish_current(cursor, table, key_columns, value_columns, run_id):
+    """
+    Atualiza a tabela atual com as linhas da execução `run_id`. Não faz commit.
+    Retorna o número de chaves inseridas ou atualizadas.
+    """
+    current = current_table_name(table)
+    columns = key_columns + value_columns + [RUN_COLUMN]
+    keys = ", ".join(key_columns)
+    cursor.execute(f"""
+        MERGE {current} AS alvo
+        USING (
+            SELECT {", ".join(columns)}
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY (SELECT NULL)) AS rn
+                FROM {table}
+                WHERE {RUN_COLUMN} = ?
+            ) AS h
+            WHERE h.rn = 1
+        ) AS origem
+            ON {" AND ".join(f"alvo.{c} = origem.{c}" for c in key_columns)}
+        WHEN MATCHED THEN
+            UPDATE SET {", ".join(f"{c} = origem.{c}" for c in value_columns + [RUN_COLUMN])}
+        WHEN NOT MATCHED THEN
+            INSERT ({", ".join(columns)})
+            VALUES ({", ".join(f"origem.{c}" for c in columns)});
+    """, (run_id,))
+    return max(cursor.rowcount, 0)
+
+
+def evict_current(cursor, table, column, oldest):
+    """
+    Remove da tabela atual as linhas com `column` anterior a `oldest`.
+    Não faz commit. Retorna o número de linhas removidas.
+    """
+    cursor.execute(f"DELETE FROM {current_table_name(table)} WHERE {column} < ?", (oldest,))
+    return max(cursor.rowcount, 0)
+
+
+def prune_runs(cursor, table, keep, chunk_size=50000):
+    """
+    Remove do histórico as linhas das execuções mais antigas que as `keep`
+    mais recentes, fazendo commit a cada bloco. Não faz nada com keep=0 ou com
+    até `keep` execuções; linhas sem ExecucaoEm são mantidas. Retorna o total
+    removido.
+    """
+    if not keep:
+        return 0
+    cursor.execute(f"SELECT COUNT(DISTINCT {RUN_COLUMN}) FROM {table}")
+    if cursor.fetchone()[0] <= keep:
+        return 0
+    cursor.execute(f"""
+        SELECT MIN({RUN_COLUMN}) FROM (
+            SELECT DISTINCT TOP (?) {RUN_COLUMN}
+            FROM {table}
+            WHERE {RUN_COLUMN} IS NOT NULL
+            ORDER BY {RUN_COLUMN} DESC
+        ) AS recentes
+    """, (keep,))
+    oldest_kept = cursor.fetchone()[0]
+    total = 0
+    while True:
+        cursor.execute(f"""
+            DELETE TOP (?) FROM {table}
+            WHERE {RUN_COLUMN} < ?
+        """, (chunk_size, oldest_kept))
+        deleted = max(cursor.rowcount, 0)
+        cursor.connection.commit()
+        total += deleted
+        if deleted < chunk_size:
+            return total
@@ -0,0 +1,112 @@
+"""
+Recarga completa de uma tabela via tabela sombra e troca atômica.
+
+A carga vai para {tabela}_Carga, uma tabela sombra permanente com a mesma
+estrutura da tabela viva (colunas, índice clusterizado/PK, índices não
+clusterizados e CHECK constraints). Ela é criada a partir do catálogo na
+primeira execução e depois só esvaziada com TRUNCATE; enquanto a API é
+consultada os leitores continuam vendo a tabela antiga inteira.
+
+No fim, swap_in troca o conteúdo numa única transação: TRUNCATE da tabela viva
+seguido de ALTER TABLE ... SWITCH da sombra, que só altera metadados e mantém
+índices, defaults e permissões da tabela viva. A sombra volta a ficar vazia
+para a próxima execução. Se o SWITCH falhar (por exemplo, a tabela viva ganhou
+um índice que a sombra não tem), a transação é desfeita e o erro sobe: a
+execução falha e a tabela viva fica como estava. Quem lê vê a versão anterior
+ou a nova, nunca uma carga parcial.
+"""
+
+
+def shadow_table_name(table):
+    return f"{table}_Carga"
+
+
+def _index_statements(cursor, table, shadow):
+    """DDL dos índices rowstore (PK, UNIQUE e demais) de `table`, aplicada a `shadow`."""
+    cursor.execute("""
+        SELECT i.name, i.type_desc, i.is_unique, i.is_primary_key, i.is_unique_constraint,
+               i.filter_definition, c.name, ic.is_descending_key, ic.is_included_column
+        FROM sys.indexes i
+        JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+        JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+        WHERE i.object_id = OBJECT_ID(?) AND i.type IN (1, 2)
+        ORDER BY i.type, i.index_id, ic.is_included_column, ic.key_ordinal, ic.index_column_id
+    """, (table,))
+    indexes = {}
+    for name, type_desc, is_unique, is_pk, is_unique_constraint, filter_definition, column, desc, included \
+            in cursor.fetchall():
+        index = indexes.setdefault(name, {
+            "kind": type_desc, "unique": is_unique, "pk": is_pk,
+            "constraint": is_unique_constraint, "filter": filter_definition, "keys": [], "include": [],
+        })
+        if included:
+            index["include"].append(f"[{column}]")
+        else:
+            index["keys"].append(f"[{column}]{' DESC' if desc else ''}")
+
+    statements = []
+    for name, index in indexes.items():
+        keys = ", ".join(index["keys"])
+        if index["pk"] or index["constraint"]:
+            # Nomes de constraint são únicos no schema
+            kind = "PRIMARY KEY" if index["pk"] else "UNIQUE"
+            statements.append(
+                f"ALTER TABLE {shadow} ADD CONSTRAINT [{name}_Carga] {kind} {index['kind']} ({keys})"
+            )
+            continue
+        statement = f"CREATE {'UNIQUE ' if index['unique'] else ''}{index['kind']} INDEX [{name}] ON {shadow} ({keys})"
+        if index["include"]:
+            statement += f" INCLUDE ({', '.join(index['include'])})"
+        if index["filter"]:
+            statement += f" WHERE {index['filter']}"
+        statements.append(statement)
+    return statements
+
+
+def _check_statements(cursor, table, shadow):
+    cursor.execute("""
+        SELECT name, definition FROM sys.check_constraints
+        WHERE parent_object_id = OBJECT_ID(?) AND is_disabled = 0
+    """, (table,))
+    return [
+        f"ALTER TABLE {shadow} WITH CHECK ADD CONSTRAINT [{name}_Carga] CHECK {definition}"
+        for name, definition in cursor.fetchall()
+    ]
+
+
+def create_shadow(cursor, table):
+    """Cria a sombra com as colunas, índices e CHECKs de `table`. Não faz commit."""
+    shadow = shadow_table_name(table)
+    cursor.execute(f"SELECT TOP 0 * INTO {shadow} FROM {table}")
+    for statement in _index_statements(cursor, table, shadow) + _check_statements(cursor, table, shadow):
+        cursor.execute(statement)
+    return shadow
+
+
+def prepare_shadow(cursor, table):
+    """
+    Deixa a tabela sombra de `table` vazia e pronta para a carga, criando-a na
+    primeira vez, e retorna o nome. Não faz commit.
+    """
+    shadow = shadow_table_name(table)
+    cursor.execute("SELECT OBJECT_ID(?, 'U')", (shadow,))
+    if cursor.fetchone()[0] is None:
+        return create_shadow(cursor, table)
+    cursor.execute(f"TRUNCATE TABLE {shadow}")
+    return shadow
+
+
+def swap_in(conn, table):
+    """
+    Publica o conteúdo da sombra em `table` numa transação; a sombra fica vazia.
+    Em caso de erro faz rollback, a tabela viva fica intacta e a exceção sobe.
+    """
+    shadow = shadow_table_name(table)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"TRUNCATE TABLE {table}")
+        cursor.execute(f"ALTER TABLE {shadow} SWITCH TO {table}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
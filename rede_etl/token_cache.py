@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from rede_etl.file_lock import FileLock
+
+
+def default_cache_path():
+    return Path(os.getenv("REDE_TOKEN_CACHE") or Path(tempfile.gettempdir()) / "rede_token_cache.json")
+
+
+class TokenCache:
+    """
+    Cache do token da Rede em arquivo local, compartilhado entre processos
+    filhos e entre execuções dos scripts. Leituras e escritas são feitas sob
+    um lock de arquivo; a escrita é atômica (arquivo temporário + replace).
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_cache_path()
+        self.lock = FileLock(str(self.path) + ".lock")
+
+    def read(self):
+        """Retorna o dict salvo (access_token, refresh_token, expires_at) ou None."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not data.get("access_token"):
+            return None
+        return data
+
+    def write(self, access_token, refresh_token, expires_at):
+        data = {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "expires_at": expires_at,
+            "updated_at": time.time(),
+        }
+        tmp_path = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
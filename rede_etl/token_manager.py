@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+
+import requests
+
+from rede_etl import http_client
+from rede_etl.token_cache import TokenCache
+
+
+class TokenManager:
+    """
+    Gerencia o token OAuth da Rede compartilhado por todas as threads de um processo.
+
+    O token é renovado antes de expirar (com base no expires_in) e, quando uma
+    renovação é necessária, apenas uma thread faz a chamada; as demais aguardam
+    e reutilizam o token novo. A renovação tenta primeiro o grant refresh_token
+    e só cai para o grant password se ele falhar.
+
+    O token também é publicado em um cache local (TokenCache), de modo que
+    processos filhos e outros scripts rodando na mesma máquina reaproveitam o
+    token já obtido em vez de fazer um novo login.
+    """
+
+    def __init__(self, margem_renovacao=60, cache=None, usar_cache=True):
+        self.access_token = None
+        self.refresh_token = None
+        self.expires_at = 0.0
+        self.margem_renovacao = margem_renovacao
+        self.cache = (cache or TokenCache()) if usar_cache else None
+        self._lock = threading.Lock()
+
+    # O lock não é serializável; cada processo filho recria o seu.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _token_valido(self):
+        return bool(self.access_token) and time.time() < self.expires_at - self.margem_renovacao
+
+    def get_access_token(self):
+        """Retorna um token válido, renovando antecipadamente se estiver perto de expirar."""
+        if not self._token_valido():
+            with self._lock:
+                if not self._token_valido():
+                    self._obter_token(self.access_token)
+        return self.access_token
+
+    def update_token(self, token_expirado=None):
+        """
+        Substitui o token atual. Quando token_expirado é informado (token que
+        recebeu 401), a renovação só acontece se nenhuma outra thread já o tiver
+        substituído.
+        """
+        with self._lock:
+            if token_expirado is not None and self.access_token != token_expirado and self._token_valido():
+                return self.access_token
+            self._obter_token(token_expirado or self.access_token)
+        return self.access_token
+
+    def _obter_token(self, token_rejeitado):
+        """Reaproveita o token do cache local, se válido, ou renova e publica no cache."""
+        if self.cache is None:
+            self._renovar()
+            return
+        try:
+            with self.cache.lock:
+                data = self.cache.read()
+                if data and data["access_token"] != token_rejeitado \
+                        and time.time() < data["expires_at"] - self.margem_renovacao:
+                    self.access_token = data["access_token"]
+                    self.refresh_token = data.get("refresh_token")
+                    self.expires_at = data["expires_at"]
+                    print("Token reaproveitado do cache local.")
+                    return
+                if data and data.get("refresh_token"):
+                    # O refresh_token mais recente é o publicado por quem renovou por último
+                    self.refresh_token = data["refresh_token"]
+                self._renovar()
+                if self.access_token and self.access_token != token_rejeitado:
+                    self.cache.write(self.access_token, self.refresh_token, self.expires_at)
+        except (OSError, TimeoutError) as e:
+            print(f"Cache de token indisponível ({e}). Renovando sem cache...")
+            self._renovar()
+
+    def _renovar(self):
+        print("Reautenticando para obter novo token...")
+        data = None
+        if self.refresh_token:
+            data = self._solicitar_token({
+                "grant_type": "refresh_token",
+                "refresh_token": self.refresh_token
+            })
+        if data is None:
+            data = self._solicitar_token({
+                "grant_type": "password",
+                "username": os.getenv("API_USERNAME_REDE"),
+                "password": os.getenv("API_PASSWORD_REDE")
+            })
+
+        if data and data.get("access_token"):
+            self.access_token = data.get("access_token")
+            self.refresh_token = data.get("refresh_token") or self.refresh_token
+            expires_in = data.get("expires_in")
+            # Sem expires_in, a renovação fica por conta do 401.
+            self.expires_at = time.time() + float(expires_in) if expires_in else float("inf")
+            print("Token atualizado com sucesso.")
+        else:
+            print("Falha ao atualizar token.")
+
+    def _solicitar_token(self, body):
+        url = os.getenv("TOKEN_URL_REDE")
+        headers = {
+            "Authorization": os.getenv("API_AUTH_HEADER_REDE"),
+        }
+        try:
+            response = http_client.post(url, data=body, headers=headers, timeout=30)
+        except requests.exceptions.RequestException as e:
+            print(f"Erro ao obter token ({body['grant_type']}): {e}")
+            return None
+        if response.status_code == 200:
+            return response.json()
+        print(f"Erro ao obter token ({body['grant_type']}):", response.status_code, response.text)
+        return None
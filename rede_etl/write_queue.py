@@ -0,0 +1,85 @@
+"""
+Fila de escrita limitada com threads gravadoras dedicadas.
+
+Os produtores (threads de API) chamam put() e seguem trabalhando; uma ou mais
+threads gravadoras drenam a fila em lotes e chamam write_batch(itens). Como a
+fila tem tamanho máximo, put() bloqueia quando o banco fica para trás
+(backpressure), mantendo a memória limitada. close() grava o que restou e
+espera as threads terminarem.
+"""
+
+import queue
+import threading
+
+from rede_etl.bulk_writer import batch_size_from_env
+
+_STOP = object()
+
+
+class WriteQueue:
+    def __init__(self, write_batch, batch_size=None, maxsize=None, workers=1, flush_interval=1.0):
+        """
+        write_batch(itens) grava uma lista de itens (e faz o commit); exceção ou
+        retorno False contam o lote como falho. Um lote é gravado ao atingir
+        batch_size ou após flush_interval segundos sem novos itens. maxsize
+        padrão: 4 lotes por gravadora.
+        """
+        self.write_batch = write_batch
+        self.batch_size = batch_size or batch_size_from_env()
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.failed = 0
+        self._counter_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize or self.batch_size * 4 * workers)
+        self._threads = [
+            threading.Thread(target=self._drain, name=f"db-writer-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if batch:
+                    self._flush(batch)
+                    batch = []
+                continue
+            if item is _STOP:
+                if batch:
+                    self._flush(batch)
+                return
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+
+    def _flush(self, batch):
+        try:
+            ok = self.write_batch(batch) is not False
+        except Exception as e:
+            print(f"Erro ao gravar lote de {len(batch)} itens: {e}")
+            ok = False
+        with self._counter_lock:
+            if ok:
+                self.written += len(batch)
+            else:
+                self.failed += len(batch)
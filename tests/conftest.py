@@ -0,0 +1,58 @@
+"""
+Fixtures dos testes dos módulos de rede_etl que alteram dados.
+
+Os testes rodam sobre o StandInDatabase dos benchmarks. O T-SQL que ele não
+interpreta (DELETE ... FROM, UPDATE por id, consultas ao catálogo) é
+respondido por handlers registrados em cada teste, que reproduzem sobre as
+linhas em memória o efeito do comando no SQL Server.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fake_db import StandInConnection, StandInDatabase  # noqa: E402
+
+
+class RecordingDatabase(StandInDatabase):
+    """StandInDatabase que guarda o texto de cada comando executado."""
+
+    def __init__(self):
+        super().__init__(latency=0)
+        self.queries = []
+
+    def execute(self, query, params, many=False, scope=None):
+        self.queries.append(query)
+        return super().execute(query, params, many, scope)
+
+    def executed(self, fragment):
+        """Comandos executados que contêm `fragment`."""
+        return [query for query in self.queries if fragment in query]
+
+
+class TrackingConnection(StandInConnection):
+    """Conexão que conta commits e rollbacks (o substituto não simula transações)."""
+
+    def __init__(self, db, scope=1):
+        super().__init__(db, scope)
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def db():
+    return RecordingDatabase()
+
+
+@pytest.fixture
+def conn(db):
+    return TrackingConnection(db)
@@ -0,0 +1,120 @@
+import pytest
+
+from rede_etl.reconcile import clear_staging_slice, prepare_staging, reconcile_period, staging_table_name
+from rede_etl.row_hash import row_hash
+
+TABLE = "BD_Teste"
+STAGING = staging_table_name(TABLE)
+COLUMNS = ["Empresa", "Dia", "Valor"]
+
+
+def line(empresa, dia, valor):
+    values = (empresa, dia, valor)
+    return {**dict(zip(COLUMNS, values)), "RowHash": row_hash(values)}
+
+
+def install_reconcile_sql(db, fail_on_day=None):
+    """Efeito no banco dos comandos de reconcile sobre BD_Teste / BD_Teste_Reconcile."""
+
+    def delete_day(db, params):
+        day = params[0]
+        hashes = {row["RowHash"] for row in db.table(STAGING) if row["Dia"] == day}
+        live = db.table(TABLE)
+        kept = [row for row in live
+                if row["Dia"] != day or (row["RowHash"] is not None and row["RowHash"] in hashes)]
+        removed = len(live) - len(kept)
+        live[:] = kept
+        return removed
+
+    def insert_day(db, params):
+        day = params[0]
+        if day == fail_on_day:
+            raise RuntimeError("falha simulada")
+        hashes = {row["RowHash"] for row in db.table(TABLE)}
+        new = [dict(row) for row in db.table(STAGING) if row["Dia"] == day and row["RowHash"] not in hashes]
+        for row in new:
+            row.pop("id", None)
+        return db._append(TABLE, new)
+
+    def delete_staging(db, params, keep):
+        staging = db.table(STAGING)
+        kept = [row for row in staging if keep(row, params)]
+        removed = len(staging) - len(kept)
+        staging[:] = kept
+        return removed
+
+    db.on(r"DELETE t FROM BD_Teste AS t", delete_day)
+    db.on(r"INSERT INTO BD_Teste \(.*FROM BD_Teste_Reconcile AS s", insert_day)
+    db.on(r"DELETE FROM BD_Teste_Reconcile WHERE Dia BETWEEN \? AND \? AND Empresa = \?",
+          lambda db, p: delete_staging(db, p, lambda row, p: not (
+              p[0] <= row["Dia"] <= p[1] and str(row["Empresa"]) == p[2])))
+    db.on(r"DELETE FROM BD_Teste_Reconcile WHERE Dia NOT BETWEEN",
+          lambda db, p: delete_staging(db, p, lambda row, p: p[0] <= row["Dia"] <= p[1]))
+    db.on(r"DELETE FROM BD_Teste_Reconcile WHERE Dia BETWEEN \? AND \?",
+          lambda db, p: delete_staging(db, p, lambda row, p: not p[0] <= row["Dia"] <= p[1]))
+
+
+def test_reconcile_period_applies_only_the_difference(db, conn):
+    install_reconcile_sql(db)
+    db.seed(TABLE, [line(1, "2025-01-01", 10), line(1, "2025-01-01", 20), line(1, "2025-01-02", 30)])
+    unchanged_id = db.table(TABLE)[0]["id"]
+    db.seed(STAGING, [line(1, "2025-01-01", 10), line(1, "2025-01-01", 25), line(1, "2025-01-02", 40)])
+
+    deleted, inserted = reconcile_period(conn, TABLE, COLUMNS, "Dia", ["2025-01-01", "2025-01-02"])
+
+    assert (deleted, inserted) == (2, 2)
+    assert sorted((row["Dia"], row["Valor"]) for row in db.table(TABLE)) == [
+        ("2025-01-01", 10), ("2025-01-01", 25), ("2025-01-02", 40)]
+    # A linha que não mudou não foi apagada e reinserida
+    assert any(row["id"] == unchanged_id for row in db.table(TABLE))
+    # Um commit por dia e um para a limpeza do staging
+    assert conn.commits == 3
+    assert db.table(STAGING) == []
+
+
+def test_failed_day_is_rolled_back_and_staging_kept(db, conn):
+    install_reconcile_sql(db, fail_on_day="2025-01-02")
+    db.seed(TABLE, [line(1, "2025-01-01", 10), line(1, "2025-01-02", 30)])
+    db.seed(STAGING, [line(1, "2025-01-01", 15), line(1, "2025-01-02", 35)])
+
+    deleted, inserted = reconcile_period(conn, TABLE, COLUMNS, "Dia", ["2025-01-01", "2025-01-02"])
+
+    assert (deleted, inserted) == (1, 1)
+    assert conn.rollbacks == 1
+    # O staging do período fica para a próxima execução
+    assert len(db.table(STAGING)) == 2
+    assert not db.executed("DELETE FROM BD_Teste_Reconcile WHERE Dia BETWEEN")
+
+
+def test_prepare_staging_keeps_only_the_period(db, conn):
+    install_reconcile_sql(db)
+    db.seed(STAGING, [line(1, "2024-12-31", 5), line(1, "2025-01-10", 10), line(1, "2025-02-01", 20)])
+
+    staging = prepare_staging(conn.cursor(), TABLE, COLUMNS, "Dia", "2025-01-01", "2025-01-31")
+
+    assert staging == STAGING
+    assert [row["Dia"] for row in db.table(STAGING)] == ["2025-01-10"]
+
+
+def test_clear_staging_slice_only_touches_the_company_and_period(db, conn):
+    install_reconcile_sql(db)
+    db.seed(STAGING, [
+        line(1, "2025-01-05", 10), line(1, "2025-01-06", 11), line(1, "2025-02-01", 12),
+        line(2, "2025-01-05", 20),
+    ])
+
+    removed = clear_staging_slice(conn.cursor(), STAGING, "Dia", "2025-01-01", "2025-01-31", "Empresa", 1)
+
+    assert removed == 2
+    assert sorted((row["Empresa"], row["Dia"]) for row in db.table(STAGING)) == [
+        (1, "2025-02-01"), (2, "2025-01-05")]
+
+
+@pytest.mark.parametrize("key", [1, "1"])
+def test_clear_staging_slice_sends_the_key_as_text(db, conn, key):
+    seen = []
+    db.on(r"DELETE FROM BD_Teste_Reconcile", lambda db, params: seen.append(params) or 0)
+
+    clear_staging_slice(conn.cursor(), STAGING, "Dia", "2025-01-01", "2025-01-31", "Empresa", key)
+
+    assert seen == [("2025-01-01", "2025-01-31", "1")]
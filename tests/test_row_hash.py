@@ -0,0 +1,66 @@
+from decimal import Decimal
+
+from rede_etl.row_hash import backfill_row_hash, insert_new_rows, row_hash
+
+TABLE = "BD_Teste"
+COLUMNS = ["NSU", "Data", "Valor"]
+
+
+def rows_with_hash(*values):
+    return [tuple(v) + (row_hash(v),) for v in values]
+
+
+def install_backfill_sql(db):
+    """Efeito no banco do SELECT TOP por id e do UPDATE de backfill_row_hash sobre BD_Teste."""
+
+    def select_chunk(db, params):
+        chunk_size, last_id = params
+        pending = sorted((row for row in db.table(TABLE) if row.get("RowHash") is None and row["id"] > last_id),
+                         key=lambda row: row["id"])[:chunk_size]
+        return ["id"] + COLUMNS, [tuple(row[c] for c in ["id"] + COLUMNS) for row in pending]
+
+    def update_hashes(db, params):
+        by_id = {row["id"]: row for row in db.table(TABLE)}
+        for value, row_id in params:
+            by_id[row_id]["RowHash"] = value
+        return len(params)
+
+    db.on(r"SELECT TOP \(\?\) id, NSU, Data, Valor\s+FROM BD_Teste", select_chunk)
+    db.on(r"UPDATE BD_Teste SET RowHash = \? WHERE id = \?", update_hashes)
+
+
+def test_row_hash_normalizes_numbers_and_keeps_nulls_apart():
+    assert row_hash((1, 10)) == row_hash((1, 10.0)) == row_hash((1, Decimal("10.00")))
+    assert row_hash((1, None)) != row_hash((1, ""))
+    assert row_hash((1, 2)) != row_hash((2, 1))
+    assert len(row_hash(("a",))) == 32
+
+
+def test_insert_new_rows_skips_hashes_already_loaded(db, conn):
+    db.seed(TABLE, [])
+    batch = rows_with_hash((1, "2025-01-01", 10.0), (2, "2025-01-01", 20.0))
+
+    assert insert_new_rows(conn.cursor(), TABLE, COLUMNS, batch) == 2
+    assert insert_new_rows(conn.cursor(), TABLE, COLUMNS, batch + rows_with_hash((3, "2025-01-02", 5.0))) == 1
+
+    assert sorted(row["NSU"] for row in db.table(TABLE)) == [1, 2, 3]
+    # A temporária de staging é descartada ao fim de cada carga
+    assert not [name for name in db.tables if name.startswith("#")]
+
+
+def test_backfill_lets_reloads_skip_legacy_rows(db, conn):
+    install_backfill_sql(db)
+    legacy = [(1, "2025-01-01", 10), (2, "2025-01-01", 20), (3, "2025-01-02", 30)]
+    db.seed(TABLE, [dict(zip(COLUMNS, values)) for values in legacy])
+
+    assert backfill_row_hash(conn.cursor(), TABLE, COLUMNS, chunk_size=2) == 3
+    # Um commit por bloco
+    assert conn.commits == 2
+
+    # A mesma carga vinda da API não duplica as linhas antigas (10 e 10.0 têm o mesmo hash)
+    reload = rows_with_hash((1, "2025-01-01", 10.0), (2, "2025-01-01", 20), (3, "2025-01-02", 30))
+    assert insert_new_rows(conn.cursor(), TABLE, COLUMNS, reload) == 0
+    assert len(db.table(TABLE)) == 3
+
+    # Sem linhas pendentes a segunda passagem não grava nada
+    assert backfill_row_hash(conn.cursor(), TABLE, COLUMNS, chunk_size=2) == 0
@@ -0,0 +1,90 @@
+from rede_etl.snapshots import current_table_name, evict_current, prune_runs, retention_from_env
+
+TABLE = "BD_Teste"
+RUNS = ["2025-01-01 06:00:00", "2025-01-02 06:00:00", "2025-01-03 06:00:00"]
+
+
+def install_prune_sql(db):
+    """Efeito no banco das consultas e do DELETE TOP de prune_runs sobre BD_Teste."""
+
+    def runs(db):
+        return sorted({row["ExecucaoEm"] for row in db.table(TABLE) if row["ExecucaoEm"] is not None})
+
+    def delete_top(db, params):
+        chunk_size, oldest_kept = params
+        table = db.table(TABLE)
+        # NULL < x é desconhecido no SQL: linhas sem execução nunca entram
+        doomed = [row for row in table
+                  if row["ExecucaoEm"] is not None and row["ExecucaoEm"] < oldest_kept][:chunk_size]
+        table[:] = [row for row in table if not any(row is d for d in doomed)]
+        return len(doomed)
+
+    db.on(r"SELECT COUNT\(DISTINCT ExecucaoEm\) FROM BD_Teste", lambda db, p: (["n"], [(len(runs(db)),)]))
+    db.on(r"SELECT MIN\(ExecucaoEm\) FROM \(", lambda db, p: (["min"], [(min(runs(db)[-p[0]:]),)]))
+    db.on(r"DELETE TOP \(\?\) FROM BD_Teste", delete_top)
+
+
+def history(runs, per_run=2, legacy=0):
+    rows = [{"Valor": i, "ExecucaoEm": run} for run in runs for i in range(per_run)]
+    return rows + [{"Valor": -1, "ExecucaoEm": None} for _ in range(legacy)]
+
+
+def test_prune_runs_keeps_recent_runs_and_legacy_rows(db, conn):
+    install_prune_sql(db)
+    db.seed(TABLE, history(RUNS, per_run=2, legacy=3))
+
+    removed = prune_runs(conn.cursor(), TABLE, keep=2)
+
+    assert removed == 2
+    remaining = [row["ExecucaoEm"] for row in db.table(TABLE)]
+    assert RUNS[0] not in remaining
+    assert remaining.count(None) == 3
+    assert remaining.count(RUNS[1]) == remaining.count(RUNS[2]) == 2
+
+
+def test_prune_runs_deletes_in_chunks_with_a_commit_each(db, conn):
+    install_prune_sql(db)
+    db.seed(TABLE, history(RUNS, per_run=5))
+
+    removed = prune_runs(conn.cursor(), TABLE, keep=1, chunk_size=4)
+
+    assert removed == 10
+    assert len(db.executed("DELETE TOP")) == 3
+    assert conn.commits == 3
+
+
+def test_prune_runs_is_a_no_op_within_retention(db, conn):
+    install_prune_sql(db)
+    db.seed(TABLE, history(RUNS[:2], legacy=1))
+
+    assert prune_runs(conn.cursor(), TABLE, keep=2) == 0
+    assert prune_runs(conn.cursor(), TABLE, keep=0) == 0
+
+    assert not db.executed("DELETE")
+    assert len(db.table(TABLE)) == 5
+
+
+def test_evict_current_removes_keys_before_the_window(db, conn):
+    current = current_table_name(TABLE)
+
+    def delete_before(db, params):
+        rows = db.table(current)
+        kept = [row for row in rows if row["StartDate"] >= params[0]]
+        removed = len(rows) - len(kept)
+        rows[:] = kept
+        return removed
+
+    db.on(r"DELETE FROM BD_Teste_Atual WHERE StartDate < \?", delete_before)
+    db.seed(current, [{"StartDate": "2025-01-01"}, {"StartDate": "2025-02-01"}, {"StartDate": "2025-03-01"}])
+
+    assert evict_current(conn.cursor(), TABLE, "StartDate", "2025-02-01") == 1
+    assert [row["StartDate"] for row in db.table(current)] == ["2025-02-01", "2025-03-01"]
+    # Entra na transação de quem chamou
+    assert conn.commits == 0
+
+
+def test_retention_from_env(monkeypatch):
+    monkeypatch.delenv("REDE_TESTE_RETENCAO", raising=False)
+    assert retention_from_env("REDE_TESTE_RETENCAO", default=30) == 30
+    monkeypatch.setenv("REDE_TESTE_RETENCAO", "-5")
+    assert retention_from_env("REDE_TESTE_RETENCAO") == 0
@@ -0,0 +1,76 @@
+import pytest
+
+from rede_etl.table_swap import prepare_shadow, shadow_table_name, swap_in
+
+TABLE = "BD_Teste"
+SHADOW = shadow_table_name(TABLE)
+
+INDEX_COLUMNS = ["name", "type_desc", "is_unique", "is_primary_key", "is_unique_constraint",
+                 "filter_definition", "column", "is_descending_key", "is_included_column"]
+
+
+def install_catalog(db):
+    """sys.indexes / sys.check_constraints de BD_Teste: PK, um índice filtrado e um CHECK."""
+    db.on(r"FROM sys\.indexes i", lambda db, params: (INDEX_COLUMNS, [
+        ("PK_Teste", "CLUSTERED", True, True, False, None, "id", False, False),
+        ("IX_Teste_Data", "NONCLUSTERED", False, False, False, "([Valor]>(0))", "Data", True, False),
+        ("IX_Teste_Data", "NONCLUSTERED", False, False, False, "([Valor]>(0))", "Valor", False, True),
+    ]))
+    db.on(r"FROM sys\.check_constraints", lambda db, params: (
+        ["name", "definition"], [("CK_Teste_Valor", "([Valor]>=(0))")]))
+
+
+def test_prepare_shadow_creates_it_with_the_live_structure(db, conn):
+    install_catalog(db)
+    db.seed(TABLE, [{"Data": "2025-01-01", "Valor": 1}])
+
+    assert prepare_shadow(conn.cursor(), TABLE) == SHADOW
+
+    assert SHADOW in db.tables
+    assert db.executed(f"SELECT TOP 0 * INTO {SHADOW} FROM {TABLE}")
+    assert db.executed(
+        f"ALTER TABLE {SHADOW} ADD CONSTRAINT [PK_Teste_Carga] PRIMARY KEY CLUSTERED ([id])")
+    assert db.executed(
+        f"CREATE NONCLUSTERED INDEX [IX_Teste_Data] ON {SHADOW} ([Data] DESC) "
+        f"INCLUDE ([Valor]) WHERE ([Valor]>(0))")
+    assert db.executed(
+        f"ALTER TABLE {SHADOW} WITH CHECK ADD CONSTRAINT [CK_Teste_Valor_Carga] CHECK ([Valor]>=(0))")
+    # A tabela viva não é tocada
+    assert len(db.table(TABLE)) == 1
+
+
+def test_prepare_shadow_truncates_an_existing_shadow(db, conn):
+    install_catalog(db)
+    db.seed(SHADOW, [{"Data": "2025-01-01", "Valor": 1}])
+
+    prepare_shadow(conn.cursor(), TABLE)
+
+    assert db.table(SHADOW) == []
+    assert not db.executed("SELECT TOP 0 *")
+    assert not db.executed("FROM sys.indexes")
+
+
+def test_swap_in_publishes_the_shadow(db, conn):
+    db.seed(TABLE, [{"Data": "2025-01-01", "Valor": 1}])
+    db.seed(SHADOW, [{"Data": "2025-02-01", "Valor": 2}, {"Data": "2025-02-02", "Valor": 3}])
+
+    swap_in(conn, TABLE)
+
+    assert [row["Valor"] for row in db.table(TABLE)] == [2, 3]
+    assert not db.tables.get(SHADOW)
+    assert (conn.commits, conn.rollbacks) == (1, 0)
+
+
+def test_swap_in_rolls_back_and_raises_when_switch_fails(db, conn):
+    def switch(db, params):
+        raise RuntimeError("ALTER TABLE SWITCH falhou")
+
+    db.on(r"SWITCH TO", switch)
+    db.seed(SHADOW, [{"Data": "2025-02-01", "Valor": 2}])
+
+    with pytest.raises(RuntimeError):
+        swap_in(conn, TABLE)
+
+    assert (conn.commits, conn.rollbacks) == (0, 1)
+    # Sem fallback por rename
+    assert not db.executed("sp_rename")